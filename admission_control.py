@@ -0,0 +1,230 @@
+# admission_control.py
+# Обмеження навантаження на конвеєр відповідей (пошук + LLM): ліміт запитів на користувача
+# (token bucket), ліміт одночасних запитів та обмежена черга очікування. Надлишкові запити
+# отримують повідомлення "сервіс зайнятий" одразу, а не чекають без кінця.
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject, User
+
+from translations import translation_manager
+from user_settings import user_settings
+
+logger = logging.getLogger(__name__)
+
+# Скільки запитів на хвилину може надсилати один користувач (поповнення token bucket)
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "10"))
+# Скільки запитів поспіль користувач може надіслати без паузи (місткість token bucket)
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+# Максимальна кількість запитів, що одночасно проходять пошук та генерацію відповіді
+MAX_INFLIGHT_REQUESTS = int(os.getenv("MAX_INFLIGHT_REQUESTS", "16"))
+# Максимальна кількість запитів, що чекають на вільне місце; решта одразу отримує відмову
+MAX_PENDING_REQUESTS = int(os.getenv("MAX_PENDING_REQUESTS", "64"))
+# Скільки секунд запит може чекати в черзі, перш ніж отримати відмову
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "20"))
+# Максимальна кількість користувачів, для яких зберігається стан token bucket
+RATE_LIMIT_MAX_USERS = 100000
+
+# Прапорець обробника, запити до якого проходять контроль навантаження: @dp.message(flags={ADMISSION_FLAG: True})
+ADMISSION_FLAG = "rag"
+
+
+class _TokenBucket:
+    __slots__ = ("tokens", "updated_at", "notified")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated_at = now
+        # Чи повідомляли користувача про ліміт після останнього прийнятого запиту
+        self.notified = False
+
+
+class AdmissionController:
+    """
+    Рішення про прийом запиту: спочатку ліміт користувача, потім глобальний ліміт
+    одночасних запитів з обмеженою чергою.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float = RATE_LIMIT_PER_MINUTE,
+        burst: int = RATE_LIMIT_BURST,
+        max_in_flight: int = MAX_INFLIGHT_REQUESTS,
+        max_pending: int = MAX_PENDING_REQUESTS,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+    ):
+        """
+        Args:
+            rate_per_minute: Поповнення ліміту користувача, запитів на хвилину (0 - без ліміту)
+            burst: Місткість ліміту користувача
+            max_in_flight: Ліміт одночасних запитів
+            max_pending: Місткість черги очікування
+            queue_timeout: Максимальний час очікування в черзі, секунди
+        """
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_pending = max(0, max_pending)
+        self.queue_timeout = queue_timeout
+        self._buckets: "OrderedDict[int, _TokenBucket]" = OrderedDict()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.in_flight = 0
+        self.pending = 0
+        self.served = 0
+        self.queued = 0
+        self.rejected_rate_limited = 0
+        self.rejected_overloaded = 0
+        self.rejected_timeout = 0
+        self.max_queue_wait = 0.0
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        # Семафор створюється в event loop, в якому працює бот
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        return self._slots
+
+    def allow_user(self, user_id: int) -> Optional[bool]:
+        """
+        Списує один запит з ліміту користувача.
+
+        Returns:
+            True - запит дозволено; False - ліміт вичерпано, треба повідомити користувача;
+            None - ліміт вичерпано, а користувача вже повідомлено (відповідати не потрібно)
+        """
+        if self.rate_per_second <= 0:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = _TokenBucket(self.burst, now)
+            self._buckets[user_id] = bucket
+            if len(self._buckets) > RATE_LIMIT_MAX_USERS:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate_per_second)
+            bucket.updated_at = now
+            self._buckets.move_to_end(user_id)
+        if bucket.tokens >= 1.0:
+            bucket.tokens -= 1.0
+            bucket.notified = False
+            return True
+        self.rejected_rate_limited += 1
+        if bucket.notified:
+            return None
+        bucket.notified = True
+        return False
+
+    async def acquire(self) -> bool:
+        """
+        Займає місце серед одночасних запитів, за потреби чекаючи в черзі.
+
+        Returns:
+            True, якщо місце отримано (його треба звільнити через release)
+        """
+        slots = self._get_slots()
+        if self.in_flight < self.max_in_flight and not self.pending:
+            await slots.acquire()
+        else:
+            if self.pending >= self.max_pending:
+                self.rejected_overloaded += 1
+                return False
+            self.pending += 1
+            self.queued += 1
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                return False
+            finally:
+                self.pending -= 1
+            self.max_queue_wait = max(self.max_queue_wait, time.monotonic() - started)
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.served += 1
+        self._get_slots().release()
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            "in_flight": self.in_flight,
+            "pending": self.pending,
+            "max_in_flight": self.max_in_flight,
+            "max_pending": self.max_pending,
+            "served": self.served,
+            "queued": self.queued,
+            "rejected": self.rejected_rate_limited + self.rejected_overloaded + self.rejected_timeout,
+            "rejected_rate_limited": self.rejected_rate_limited,
+            "rejected_overloaded": self.rejected_overloaded,
+            "rejected_timeout": self.rejected_timeout,
+            "max_queue_wait": self.max_queue_wait,
+            "tracked_users": len(self._buckets),
+        }
+
+
+admission_controller = AdmissionController()
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Middleware для обробників з прапорцем ADMISSION_FLAG: запит, що перевищує ліміт
+    користувача або не поміщається в чергу, отримує локалізоване "сервіс зайнятий".
+    """
+
+    def __init__(self, controller: AdmissionController = admission_controller):
+        self.controller = controller
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not get_flag(data, ADMISSION_FLAG):
+            return await handler(event, data)
+        user: Optional[User] = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        allowed = self.controller.allow_user(user.id)
+        if not allowed:
+            logger.warning(f"Користувач {user.id} перевищив ліміт запитів.")
+            if allowed is False:
+                await self._answer_busy(event, user.id)
+            return None
+
+        if not await self.controller.acquire():
+            logger.warning(
+                f"Запит користувача {user.id} відхилено: зайнято {self.controller.in_flight} місць, "
+                f"у черзі {self.controller.pending}."
+            )
+            await self._answer_busy(event, user.id)
+            return None
+        try:
+            return await handler(event, data)
+        finally:
+            self.controller.release()
+
+    @staticmethod
+    async def _answer_busy(event: TelegramObject, user_id: int) -> None:
+        if isinstance(event, Message):
+            language = user_settings.get_language(user_id)
+            try:
+                await event.answer(translation_manager.get_text("service_busy", language))
+            except Exception as e:
+                logger.error(f"Не вдалося надіслати повідомлення про зайнятість користувачу {user_id}: {e}")
+
+
+def get_admission_stats() -> Dict[str, object]:
+    """Метрики контролю навантаження: прийняті, поставлені в чергу та відхилені запити."""
+    return admission_controller.get_stats()
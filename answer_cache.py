@@ -0,0 +1,348 @@
+# answer_cache.py
+# Кеш готових відповідей: схвалені відповіді з conversation_log повторно використовуються
+# для майже однакових питань (за подібністю векторів запитів), без виклику LLM
+
+import os
+import asyncio
+import logging
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from query_cache import normalize_query
+from database import get_cacheable_answers, get_feedback_since, get_log_entry
+from knowledge_utils import embed_query_async, encode_texts_async, get_index_version
+from personas import personas, get_persona
+
+logger = logging.getLogger(__name__)
+
+# Максимальна кількість відповідей у кеші на пару (персона, мова); 0 - кеш вимкнено
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+# Мінімальна косинусна подібність запитів, за якої повертається збережена відповідь
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+# Які відповіді кешувати: like - лише схвалені 👍, not_disliked - усі, крім позначених 👎
+ANSWER_CACHE_FEEDBACK = os.getenv("ANSWER_CACHE_FEEDBACK", "like")
+if ANSWER_CACHE_FEEDBACK not in ("like", "not_disliked"):
+    logger.warning(f"Невідомий ANSWER_CACHE_FEEDBACK '{ANSWER_CACHE_FEEDBACK}', використовуємо like.")
+    ANSWER_CACHE_FEEDBACK = "like"
+# Як часто (в секундах) процес підхоплює 👍/👎, записані в БД іншими воркерами webhook-режиму
+ANSWER_CACHE_SYNC_INTERVAL = float(os.getenv("ANSWER_CACHE_SYNC_INTERVAL", "10"))
+# Запас (секунди), з яким перечитується фідбек: час фідбеку ставиться до коміту транзакції
+FEEDBACK_SYNC_OVERLAP = 5.0
+
+
+class _Bucket:
+    """Відповіді однієї персони однією мовою, побудовані на одній версії бази знань."""
+
+    def __init__(self, version: Optional[str]):
+        self.version = version
+        self.log_ids: List[int] = []
+        self.keys: List[str] = []
+        self.answers: List[str] = []
+        self.vectors: List[np.ndarray] = []
+        # Матриця нормалізованих векторів запитів; перебудовується після змін
+        self._matrix: Optional[np.ndarray] = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.vstack(self.vectors) if self.vectors else np.empty((0, 0), dtype=np.float32)
+        return self._matrix
+
+    def remove_at(self, position: int) -> None:
+        for items in (self.log_ids, self.keys, self.answers, self.vectors):
+            del items[position]
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.log_ids)
+
+
+class AnswerCache:
+    """
+    Кеш відповідей за подібністю запитів, окремий для кожної пари (персона, мова).
+    Запис дійсний лише для тієї версії індексу бази знань, на якій відповідь згенеровано:
+    при зміні версії кошик персони/мови очищується.
+    """
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD):
+        """
+        Args:
+            max_size: Максимальна кількість відповідей на пару (персона, мова), 0 - вимкнено
+            threshold: Мінімальна косинусна подібність для влучання
+        """
+        self.max_size = max_size
+        self.threshold = threshold
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.saved_seconds_total = 0.0
+        # Середній час повної відповіді (пошук + LLM), з яким порівнюється відповідь з кешу
+        self.generation_seconds_avg = 0.0
+        self._generations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _bucket(self, persona: str, language: str, version: Optional[str]) -> _Bucket:
+        """Кошик для пари (персона, мова); скидається при зміні версії бази знань (під блокуванням)."""
+        bucket = self._buckets.get((persona, language))
+        if bucket is None or bucket.version != version:
+            if bucket is not None and len(bucket):
+                self.invalidations += 1
+                logger.info(f"Кеш відповідей [{persona}/{language}] скинуто: версія бази знань {bucket.version} -> {version}.")
+            bucket = _Bucket(version)
+            self._buckets[(persona, language)] = bucket
+        return bucket
+
+    def lookup(
+        self, persona: str, language: str, version: Optional[str], embedding: np.ndarray
+    ) -> Optional[Tuple[int, str, float]]:
+        """
+        Шукає збережену відповідь на найбільш схоже питання.
+
+        Returns:
+            Кортеж (log_id джерела, відповідь, подібність) або None
+        """
+        if not self.enabled:
+            return None
+        query = _normalize(embedding)
+        with self._lock:
+            self.lookups += 1
+            bucket = self._bucket(persona, language, version)
+            if not len(bucket):
+                return None
+            scores = bucket.matrix() @ query
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                return None
+            self.hits += 1
+            return bucket.log_ids[best], bucket.answers[best], similarity
+
+    def add(
+        self,
+        persona: str,
+        language: str,
+        version: Optional[str],
+        log_id: int,
+        query: str,
+        answer: str,
+        embedding: np.ndarray,
+    ) -> None:
+        """Додає відповідь; попередня відповідь на те саме (нормалізоване) питання замінюється."""
+        if not self.enabled or not answer:
+            return
+        key = normalize_query(query)
+        with self._lock:
+            bucket = self._bucket(persona, language, version)
+            if key in bucket.keys:
+                bucket.remove_at(bucket.keys.index(key))
+            bucket.log_ids.append(log_id)
+            bucket.keys.append(key)
+            bucket.answers.append(answer)
+            bucket.vectors.append(_normalize(embedding))
+            bucket._matrix = None
+            while len(bucket) > self.max_size:
+                bucket.remove_at(0)
+                self.evictions += 1
+
+    def remove(self, log_id: int) -> bool:
+        """Прибирає відповідь (наприклад, після 👎)."""
+        with self._lock:
+            for bucket in self._buckets.values():
+                if log_id in bucket.log_ids:
+                    bucket.remove_at(bucket.log_ids.index(log_id))
+                    return True
+        return False
+
+    def record_generation(self, seconds: float) -> None:
+        """Враховує час повної відповіді (пошук + LLM) для оцінки зекономленого часу."""
+        with self._lock:
+            self._generations += 1
+            # Ковзне середнє, щоб оцінка стежила за поточною затримкою API
+            weight = max(1.0 / self._generations, 0.05)
+            self.generation_seconds_avg += (seconds - self.generation_seconds_avg) * weight
+
+    def record_hit_latency(self, seconds: float) -> None:
+        """Враховує час відповіді з кешу: зекономлено середній час повної відповіді мінус цей час."""
+        with self._lock:
+            self.saved_seconds_total += max(0.0, self.generation_seconds_avg - seconds)
+
+    def get_stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "size": sum(len(bucket) for bucket in self._buckets.values()),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "generation_seconds_avg": self.generation_seconds_avg,
+                "saved_seconds_total": self.saved_seconds_total,
+            }
+
+
+def _normalize(embedding: np.ndarray) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+answer_cache = AnswerCache()
+
+
+async def seed_answer_cache(limit: int = 0) -> int:
+    """
+    Заповнює кеш відповідями з conversation_log, згенерованими на поточних версіях баз знань.
+    Викликається після прогріву (потрібна модель векторизації).
+
+    Returns:
+        Кількість доданих відповідей
+    """
+    if not answer_cache.enabled:
+        return 0
+    rows = await get_cacheable_answers(only_liked=ANSWER_CACHE_FEEDBACK == "like", limit=limit or ANSWER_CACHE_SIZE * 4)
+
+    # Лише відповіді, згенеровані на поточній версії бази знань своєї персони
+    versions: Dict[str, Optional[str]] = {}
+    matching = []
+    for row in rows:
+        persona = row["persona"] or get_persona().name
+        if persona not in versions:
+            versions[persona] = get_index_version(persona) if persona in personas else None
+        if versions[persona] is not None and row["index_version"] == versions[persona]:
+            matching.append({**row, "persona": persona})
+    # Від найстаріших до найновіших: новіша відповідь на те саме питання замінює старішу
+    rows = matching[::-1]
+
+    seeded = 0
+    for start in range(0, len(rows), 256):
+        batch = rows[start:start + 256]
+        embeddings = await encode_texts_async([row["user_query"] for row in batch])
+        if embeddings is None:
+            return seeded
+        for row, embedding in zip(batch, embeddings):
+            answer_cache.add(
+                row["persona"], row["language"], row["index_version"],
+                row["log_id"], row["user_query"], row["bot_response"], embedding,
+            )
+            seeded += 1
+    logger.info(f"Кеш відповідей заповнено з історії: {seeded} відповідей.")
+    return seeded
+
+
+async def lookup_answer(query: str, language: str, persona: str) -> Optional[Tuple[int, str, float]]:
+    """Шукає готову відповідь на схоже питання (None, якщо кеш вимкнено, модель не готова чи немає збігу)."""
+    if not answer_cache.enabled:
+        return None
+    version = get_index_version(persona)
+    if version is None:
+        return None
+    embedding = await embed_query_async(query, persona)
+    if embedding is None:
+        return None
+    return answer_cache.lookup(persona, language, version, embedding)
+
+
+async def remember_answer(
+    log_id: int, query: str, answer: str, language: str, persona: str, version: Optional[str]
+) -> None:
+    """Додає щойно згенеровану відповідь у кеш (у режимі not_disliked - одразу, у режимі like - після 👍)."""
+    if not answer_cache.enabled or ANSWER_CACHE_FEEDBACK != "not_disliked" or version is None:
+        return
+    embedding = await embed_query_async(query, persona)
+    if embedding is not None:
+        answer_cache.add(persona, language, version, log_id, query, answer, embedding)
+
+
+async def on_feedback(log_id: int, action: str) -> None:
+    """Оновлює кеш після фідбеку: 👍 додає відповідь, 👎 прибирає її."""
+    if not answer_cache.enabled:
+        return
+    _feedback_sync.mark(log_id, action)
+    if action == "dislike":
+        if answer_cache.remove(log_id):
+            logger.info(f"Відповідь {log_id} прибрано з кешу відповідей після 👎.")
+        return
+
+    row = await get_log_entry(log_id)
+    if row is None or not row["index_version"] or not row["bot_response"]:
+        return
+    persona = row["persona"] or get_persona().name
+    embedding = await embed_query_async(row["user_query"], persona)
+    if embedding is not None:
+        answer_cache.add(
+            persona, row["language"], row["index_version"],
+            log_id, row["user_query"], row["bot_response"], embedding,
+        )
+
+
+class _FeedbackSync:
+    """Який фідбек з БД уже застосовано до кешу цього процесу."""
+
+    def __init__(self):
+        # Фідбек, записаний до запуску процесу, вже врахований при заповненні кешу з історії
+        self.since = datetime.utcnow()
+        # log_id -> (дія, час) для фідбеку в межах запасу FEEDBACK_SYNC_OVERLAP
+        self._applied: Dict[int, Tuple[str, datetime]] = {}
+        self.synced = 0
+
+    def mark(self, log_id: int, action: str, at: Optional[datetime] = None) -> None:
+        self._applied[log_id] = (action, at or datetime.utcnow())
+
+    def is_applied(self, log_id: int, action: str) -> bool:
+        applied = self._applied.get(log_id)
+        return applied is not None and applied[0] == action
+
+    def advance(self, until: datetime) -> None:
+        self.since = max(self.since, until)
+        horizon = self.since - timedelta(seconds=FEEDBACK_SYNC_OVERLAP * 2)
+        for log_id in [log_id for log_id, (_, at) in self._applied.items() if at < horizon]:
+            del self._applied[log_id]
+
+
+_feedback_sync = _FeedbackSync()
+
+
+async def sync_feedback() -> int:
+    """
+    Застосовує до кешу фідбек, записаний у БД з часу попередньої синхронізації (зокрема іншими воркерами).
+
+    Returns:
+        Кількість застосованих змін фідбеку
+    """
+    rows = await get_feedback_since(_feedback_sync.since - timedelta(seconds=FEEDBACK_SYNC_OVERLAP))
+    applied = 0
+    for row in rows:
+        if not _feedback_sync.is_applied(row["log_id"], row["feedback"]):
+            await on_feedback(row["log_id"], row["feedback"])
+            applied += 1
+        _feedback_sync.mark(row["log_id"], row["feedback"], row["feedback_at"])
+    if rows:
+        _feedback_sync.advance(rows[-1]["feedback_at"])
+    _feedback_sync.synced += applied
+    return applied
+
+
+async def watch_feedback(interval: float = ANSWER_CACHE_SYNC_INTERVAL) -> None:
+    """Фонова задача webhook-воркера: кеш відповідей стежить за фідбеком, отриманим іншими воркерами."""
+    if interval <= 0 or not answer_cache.enabled:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sync_feedback()
+        except Exception as e:
+            logger.error(f"Помилка синхронізації фідбеку кешу відповідей: {e}", exc_info=True)
+
+
+def get_answer_cache_stats() -> Dict[str, object]:
+    """Метрики кешу відповідей (влучання, зекономлений час)."""
+    return dict(answer_cache.get_stats(), feedback_synced=_feedback_sync.synced)
@@ -0,0 +1,155 @@
+# bench_retrieval.py
+# Бенчмарк пошуку за векторами:
+#   storage  - затримка, пам'ять та збіг топ-K форматів матриці з базовим шляхом (cosine_similarity)
+#   backends - recall@K та затримка наближеного IVF-бекенду проти точного пошуку
+#
+# Запуск:
+#   python bench_retrieval.py                      # синтетична матриця 20000 x 768
+#   python bench_retrieval.py --chunks 200000      # більша база знань
+#   python bench_retrieval.py --index index_cache/<key>  # вектори зі збереженого індексу
+#   python bench_retrieval.py --mode backends --chunks 200000 --nlist 0
+
+import time
+import argparse
+import numpy as np
+from typing import Callable, List, Tuple
+
+from knowledge_index import EmbeddingMatrix, STORAGE_DTYPES, EMBEDDINGS_FILE, SCALES_FILE
+from retrieval_backends import ExactBackend, IVFBackend
+
+
+def _baseline_scores(raw: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+    """Попередній шлях: cosine_similarity з повторною нормалізацією всієї матриці на кожен запит."""
+    try:
+        from sklearn.metrics.pairwise import cosine_similarity
+
+        return lambda query: cosine_similarity(query.reshape(1, -1), raw)[0]
+    except ImportError:
+        def score(query: np.ndarray) -> np.ndarray:
+            matrix = raw / np.linalg.norm(raw, axis=1, keepdims=True)
+            return matrix @ (query / np.linalg.norm(query))
+        return score
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def _load_vectors(args: argparse.Namespace) -> np.ndarray:
+    if args.index:
+        stored = np.load(f"{args.index}/{EMBEDDINGS_FILE}")
+        vectors = stored.astype(np.float32)
+        if stored.dtype == np.int8:
+            vectors *= np.load(f"{args.index}/{SCALES_FILE}")[:, None]
+        print(f"Завантажено {vectors.shape} з {args.index} (формат {stored.dtype})")
+        return vectors
+    return _make_synthetic(args.chunks, args.dim, args.seed)
+
+
+def _make_synthetic(chunks: int, dim: int, seed: int) -> np.ndarray:
+    """Синтетичні вектори з кластерною структурою, схожою на реальні ембеддінги тем."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((max(1, chunks // 50), dim), dtype=np.float32)
+    vectors = topics[rng.integers(0, len(topics), chunks)]
+    return vectors + rng.standard_normal((chunks, dim), dtype=np.float32) * 0.6
+
+
+def _make_queries(vectors: np.ndarray, count: int, seed: int) -> np.ndarray:
+    """Запити - це зашумлені копії випадкових чанків, щоб топ-K мав реальних сусідів."""
+    rng = np.random.default_rng(seed + 1)
+    rows = vectors[rng.integers(0, len(vectors), count)]
+    noise = rng.standard_normal(rows.shape, dtype=np.float32) * np.linalg.norm(rows, axis=1, keepdims=True) * 0.03
+    return rows + noise
+
+
+def _measure(score_fn: Callable[[np.ndarray], np.ndarray], queries: np.ndarray, k: int) -> Tuple[List[float], List[np.ndarray]]:
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        top = _top_k(score_fn(query), k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(top)
+    return latencies, results
+
+
+def _bench_storage(raw: np.ndarray, queries: np.ndarray, k: int) -> None:
+    base_latencies, base_results = _measure(_baseline_scores(raw), queries, k)
+    header = ("шлях", "p50, мс", "p95, мс", "пам'ять, МБ", "збіг топ-K")
+    print(f"\n{header[0]:<22}{header[1]:>10}{header[2]:>10}{header[3]:>14}{header[4]:>12}")
+    print(
+        f"{'cosine_similarity':<22}{np.percentile(base_latencies, 50):>10.3f}"
+        f"{np.percentile(base_latencies, 95):>10.3f}{raw.nbytes / 2**20:>14.2f}{'100.0%':>12}"
+    )
+
+    for dtype in STORAGE_DTYPES:
+        matrix = EmbeddingMatrix.from_embeddings(raw, dtype)
+        latencies, results = _measure(matrix.score, queries, k)
+        agreement = np.mean([len(set(a) & set(b)) / k for a, b in zip(base_results, results)])
+        print(
+            f"{'dot ' + dtype:<22}{np.percentile(latencies, 50):>10.3f}"
+            f"{np.percentile(latencies, 95):>10.3f}{matrix.nbytes / 2**20:>14.2f}{agreement * 100:>11.1f}%"
+        )
+
+
+def _measure_backend(backend, queries: np.ndarray, k: int) -> Tuple[List[float], List[np.ndarray]]:
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        top, _ = backend.search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(top)
+    return latencies, results
+
+
+def _bench_backends(raw: np.ndarray, queries: np.ndarray, k: int, dtype: str, nlist: int) -> None:
+    matrix = EmbeddingMatrix.from_embeddings(raw, dtype)
+    exact_latencies, exact_results = _measure_backend(ExactBackend(matrix), queries, k)
+
+    started = time.perf_counter()
+    ivf = IVFBackend.build(matrix, nlist=nlist)
+    print(f"\nIVF: {ivf.nlist} кластерів, побудова {time.perf_counter() - started:.1f} с")
+
+    header = ("бекенд", "p50, мс", "p95, мс", f"recall@{k}")
+    print(f"{header[0]:<22}{header[1]:>10}{header[2]:>10}{header[3]:>12}")
+    print(
+        f"{'exact':<22}{np.percentile(exact_latencies, 50):>10.3f}"
+        f"{np.percentile(exact_latencies, 95):>10.3f}{'100.0%':>12}"
+    )
+    for nprobe in (1, 2, 4, 8, 16, 32, 64):
+        if nprobe > ivf.nlist:
+            break
+        ivf.nprobe = nprobe
+        latencies, results = _measure_backend(ivf, queries, k)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(exact_results, results)])
+        print(
+            f"{f'ivf nprobe={nprobe}':<22}{np.percentile(latencies, 50):>10.3f}"
+            f"{np.percentile(latencies, 95):>10.3f}{recall * 100:>11.1f}%"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк пошуку за векторами")
+    parser.add_argument("--mode", choices=("storage", "backends"), default="storage")
+    parser.add_argument("--chunks", type=int, default=20000, help="Кількість синтетичних чанків")
+    parser.add_argument("--dim", type=int, default=768, help="Розмірність векторів")
+    parser.add_argument("--queries", type=int, default=200, help="Кількість запитів")
+    parser.add_argument("--top-k", type=int, default=7, help="K для відбору чанків")
+    parser.add_argument("--index", help="Директорія збереженого індексу замість синтетичних даних")
+    parser.add_argument("--dtype", choices=STORAGE_DTYPES, default="float32", help="Формат матриці для --mode backends")
+    parser.add_argument("--nlist", type=int, default=0, help="Кількість кластерів IVF (0 - автоматично)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    raw = _load_vectors(args)
+    queries = _make_queries(raw, args.queries, args.seed)
+    k = min(args.top_k, len(raw))
+
+    if args.mode == "backends":
+        _bench_backends(raw, queries, k, args.dtype, args.nlist)
+    else:
+        _bench_storage(raw, queries, k)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ import os
 import logging
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command, CommandStart
 from aiogram.types import (
     Message,
@@ -13,13 +15,50 @@ from aiogram.types import (
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import asyncio 
-from typing import Optional # Імпорт Optional, який був потрібен раніше
+import time
+from typing import Dict, List, Optional # Імпорт Optional, який був потрібен раніше
 
 # Імпортуємо наші модулі
-from translations import translation_manager
-from database import init_db, add_log_entry, update_feedback 
-from knowledge_utils import find_relevant_context 
-from llm_utils import generate_response
+from translations import translation_manager, LocaleCatalog, watch_locales, get_translation_stats
+from database import init_db, add_log_entry, update_feedback, close_log_writer, log_writer
+from log_retention import run_retention_loop, get_retention_stats
+from user_settings import user_settings, UserSettingsMiddleware, get_user_settings_stats
+from admission_control import AdmissionMiddleware, ADMISSION_FLAG, get_admission_stats
+from single_flight import question_flights, question_key, get_coalescing_stats
+from knowledge_utils import (
+    retrieve_context_async,
+    EMPTY_CONTEXT,
+    shutdown_retrieval_executor,
+    RetrievalBusyError,
+    warmup_async,
+    is_search_available,
+    reload_knowledge_base_async,
+    watch_knowledge_base,
+    get_index_version,
+    get_encoder_stats,
+)
+from llm_utils import generate_response, initialize_anthropic_client, close_anthropic_client, get_llm_stats
+from personas import personas, get_persona
+from prompt_assets import prompt_assets, watch_prompt_assets, get_prompt_asset_stats
+from telegram_streaming import StreamingReply
+from answer_cache import answer_cache, lookup_answer, remember_answer, on_feedback, seed_answer_cache, watch_feedback, get_answer_cache_stats
+from metrics import (
+    registry as metrics_registry,
+    run_metrics_server,
+    record_request,
+    time_stage,
+    timed_stage,
+    METRICS_PORT,
+    STAGE_TELEGRAM_SEND,
+    OUTCOME_ANSWERED,
+    OUTCOME_CACHED_ANSWER,
+    OUTCOME_CONTEXT_NOT_FOUND,
+    OUTCOME_LLM_ERROR,
+    OUTCOME_REFUSAL,
+    OUTCOME_BUSY,
+    OUTCOME_WARMING_UP,
+    OUTCOME_ERROR,
+)
 
 # Налаштування логування
 logging.basicConfig(
@@ -31,14 +70,17 @@ logger = logging.getLogger(__name__)
 # Завантаження змінних середовища з .env файлу
 load_dotenv()
 
-# Отримання API ключів з змінних середовища
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-
-if not TELEGRAM_BOT_TOKEN or TELEGRAM_BOT_TOKEN == "your_telegram_bot_token_here":
-    logger.critical("!!! Валідний TELEGRAM_BOT_TOKEN не знайдено! Бот не може стартувати. !!!")
-    raise ValueError(
-        "Валідний TELEGRAM_BOT_TOKEN не знайдено в змінних середовища. Будь ласка, додайте справжній токен у файл .env"
-    )
+# Отримання API ключів з змінних середовища: окремий Telegram-токен для кожної персони
+# (для однієї персони за замовчуванням - TELEGRAM_BOT_TOKEN)
+BOT_TOKENS: Dict[str, str] = {}
+for persona_config in personas.values():
+    token = os.getenv(persona_config.token_env)
+    if not token or token == "your_telegram_bot_token_here":
+        logger.critical(f"!!! Валідний {persona_config.token_env} не знайдено! Бот не може стартувати. !!!")
+        raise ValueError(
+            f"Валідний {persona_config.token_env} не знайдено в змінних середовища. Будь ласка, додайте справжній токен у файл .env"
+        )
+    BOT_TOKENS[persona_config.name] = token
 
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 if not ANTHROPIC_API_KEY or ANTHROPIC_API_KEY == "your_anthropic_api_key_here":
@@ -46,26 +88,63 @@ if not ANTHROPIC_API_KEY or ANTHROPIC_API_KEY == "your_anthropic_api_key_here":
         "Валідний ANTHROPIC_API_KEY не знайдено. Функціональність LLM буде недоступна."
     )
 
-# Ініціалізація бота та диспетчера
-bot = Bot(token=TELEGRAM_BOT_TOKEN, parse_mode=None) 
+# Адміністратори, яким доступні службові команди (/reload), через кому
+ADMIN_USER_IDS = {
+    int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip().isdigit()
+}
+
+# Показувати відповідь LLM поступово, редагуючи повідомлення під час генерації
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+
+# Адреса Bot API (для локальної перевірки з fake_telegram.py); порожньо - api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+
+def create_bot(token: str) -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    return Bot(token=token, session=session, parse_mode=None)
+
+
+# Ініціалізація ботів (по одному на персону) та спільного диспетчера
+bots: Dict[str, Bot] = {name: create_bot(token) for name, token in BOT_TOKENS.items()}
+# Персона за id бота, який отримав оновлення
+bot_personas: Dict[int, str] = {bot.id: name for name, bot in bots.items()}
 dp = Dispatcher()
+# Мова користувача завантажується в кеш до виклику обробника, тому get_user_language не ходить у БД
+dp.message.outer_middleware(UserSettingsMiddleware())
+dp.callback_query.outer_middleware(UserSettingsMiddleware())
+# Ліміти на користувача та на одночасні запити для обробників з прапорцем ADMISSION_FLAG
+dp.message.middleware(AdmissionMiddleware())
 
-# Словник для зберігання мовних налаштувань користувачів (просте рішення для MVP)
-user_languages = {} 
+# Статистика модулів, що віддається ендпоінтом метрик разом з гістограмами етапів
+metrics_registry.register_collector("llm", get_llm_stats)
+metrics_registry.register_collector("answer_cache", get_answer_cache_stats)
+metrics_registry.register_collector("encoder", get_encoder_stats)
+metrics_registry.register_collector("admission", get_admission_stats)
+metrics_registry.register_collector("coalescing", get_coalescing_stats)
+metrics_registry.register_collector("log_writer", log_writer.get_stats)
+metrics_registry.register_collector("retention", get_retention_stats)
+metrics_registry.register_collector("user_settings", get_user_settings_stats)
+metrics_registry.register_collector("translations", get_translation_stats)
+metrics_registry.register_collector("prompt_assets", get_prompt_asset_stats)
 
 # --- Функції для клавіатур та отримання мови ---
 def get_user_language(user_id: int) -> str:
-    return user_languages.get(user_id, "en") 
+    return user_settings.get_language(user_id)
 
-def get_main_keyboard(language: str) -> InlineKeyboardMarkup:
+def get_bot_persona(bot: Bot) -> str:
+    """Персона, якій належить бот (одна модель векторизації обслуговує всі персони)."""
+    return bot_personas.get(bot.id, get_persona().name)
+
+def build_main_keyboard(catalog: LocaleCatalog) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.add(
         InlineKeyboardButton(
-            text=translation_manager.get_text("button_faq", language),
+            text=catalog.get_text("button_faq"),
             callback_data="faq",
         ),
         InlineKeyboardButton(
-            text=translation_manager.get_text("button_info", language),
+            text=catalog.get_text("button_info"),
             callback_data="info",
         ),
     )
@@ -75,16 +154,26 @@ def get_main_keyboard(language: str) -> InlineKeyboardMarkup:
     )
     return builder.as_markup()
 
-def get_back_keyboard(language: str) -> InlineKeyboardMarkup:
+def build_back_keyboard(catalog: LocaleCatalog) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.add(
         InlineKeyboardButton(
-            text=translation_manager.get_text("button_back", language),
+            text=catalog.get_text("button_back"),
             callback_data="back",
         )
     )
     return builder.as_markup()
 
+# Клавіатури меню будуються один раз для кожної мови і перебудовуються разом з перекладами
+translation_manager.register_keyboard("main", build_main_keyboard)
+translation_manager.register_keyboard("back", build_back_keyboard)
+
+def get_main_keyboard(language: str) -> InlineKeyboardMarkup:
+    return translation_manager.get_keyboard("main", language)
+
+def get_back_keyboard(language: str) -> InlineKeyboardMarkup:
+    return translation_manager.get_keyboard("back", language)
+
 def get_feedback_keyboard(log_id: int) -> Optional[InlineKeyboardMarkup]: 
     """Створює клавіатуру з кнопками 👍/👎 для фідбеку."""
     if not isinstance(log_id, int) or log_id <= 0:
@@ -126,6 +215,31 @@ async def command_info_handler(message: Message) -> None:
         text=info_text, reply_markup=get_back_keyboard(language), parse_mode="HTML" 
     )
 
+@dp.message(Command("reload"))
+async def command_reload_handler(message: Message) -> None:
+    """Перезавантажує базу знань (лише для адміністраторів)."""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_USER_IDS:
+        logger.warning(f"Користувач {user_id} без прав спробував виконати /reload")
+        return
+
+    persona = get_bot_persona(message.bot)
+    logger.info(f"Адміністратор {user_id} запустив перезавантаження бази знань персони '{persona}'")
+    # Разом з базою знань одразу підхоплюємо змінені інструкції персон, не чекаючи фонової перевірки
+    prompt_assets.refresh()
+    result = await reload_knowledge_base_async(persona)
+    if result["status"] == "reloaded":
+        await message.answer(
+            f"Knowledge base reloaded: version {result['version']}, {result['chunks']} chunks "
+            f"({result['encoded']} re-embedded, {result['reused']} reused)."
+        )
+    elif result["status"] == "unchanged":
+        await message.answer(f"Knowledge base unchanged (version {result['version']}, {result['chunks']} chunks).")
+    elif result["status"] == "not_ready":
+        await message.answer("Knowledge base is still warming up, try again later.")
+    else:
+        await message.answer("Knowledge base reload failed, see logs.")
+
 # --- Оновлений Обробник callback-запитів ---
 @dp.callback_query()
 async def callback_handler(callback: CallbackQuery) -> None:
@@ -149,6 +263,8 @@ async def callback_handler(callback: CallbackQuery) -> None:
                         success = await update_feedback(log_id, action)
                         
                         if success:
+                            # 👍 додає відповідь у кеш відповідей, 👎 прибирає її звідти
+                            await on_feedback(log_id, action)
                             feedback_text = translation_manager.get_text('feedback_thanks', language)
                             await callback.answer(feedback_text, show_alert=False) 
                             try:
@@ -174,8 +290,8 @@ async def callback_handler(callback: CallbackQuery) -> None:
             selected_lang = callback.data.split('_')[1]
             current_lang = get_user_language(user_id)
             if selected_lang != current_lang:
-                if selected_lang in translation_manager.get_available_languages():
-                    user_languages[user_id] = selected_lang
+                if translation_manager.has_language(selected_lang):
+                    user_settings.set_language(user_id, selected_lang)
                     language = selected_lang 
                     welcome_text = translation_manager.get_text("welcome_message", language, user_name=callback.from_user.full_name)
                     await callback.message.edit_text(text=welcome_text, reply_markup=get_main_keyboard(language))
@@ -217,28 +333,52 @@ async def callback_handler(callback: CallbackQuery) -> None:
          except Exception:
              pass
 
-# --- ДОДАНО ВИЗНАЧЕННЯ ФУНКЦІЇ ---
-def read_persona_instructions(file_path: str = "persona_instructions.txt") -> str:
-    """Читає інструкції щодо стилю спілкування зірки з файлу"""
-    try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            return file.read()
-    except FileNotFoundError:
-        logger.error(f"Помилка: Файл інструкцій персони '{file_path}' не знайдено.")
-        # Повертаємо базові інструкції англійською, якщо файл не знайдено
-        return "You are a virtual assistant of a star. Respond friendly and informative." 
-    except Exception as e:
-        logger.error(f"Помилка при читанні файлу інструкцій персони: {e}")
-        return "You are a virtual assistant of a star. Respond friendly and informative." # Базові інструкції у разі помилки
-# --- КІНЕЦЬ ВИЗНАЧЕННЯ ФУНКЦІЇ ---
+
+@timed_stage(STAGE_TELEGRAM_SEND)
+async def send_reply(
+    message: Message,
+    streaming_reply: Optional[StreamingReply],
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+) -> None:
+    """Надсилає фінальну відповідь: редагує потокове повідомлення або надсилає нове."""
+    if streaming_reply is not None:
+        await streaming_reply.finish(text, reply_markup=reply_markup)
+    else:
+        await message.answer(text, reply_markup=reply_markup, parse_mode=None)
+
+
+async def generate_answer(query: str, persona: str, on_text=None):
+    """
+    Пошук контексту та генерація відповіді LLM для питання.
+
+    Returns:
+        Кортеж (знайдений контекст, відповідь LLM); відповідь None, якщо контекст не знайдено
+        або LLM не відповів
+    """
+    logger.info("Пошук релевантного контексту...")
+    retrieved = await retrieve_context_async(query, max_tokens=1000, persona=persona)
+    if not retrieved:
+        return retrieved, None
+
+    logger.info("Генеруємо відповідь за допомогою LLM...")
+    llm_response = await generate_response(
+        query=query,
+        context=retrieved.text,
+        system_prompt=prompt_assets.get_system_prompt(persona),
+        max_tokens=1000,
+        on_text=on_text,
+    )
+    return retrieved, llm_response
 
 
 # --- Оновлений Обробник для всіх текстових повідомлень ---
-@dp.message()
+@dp.message(flags={ADMISSION_FLAG: True})
 async def echo_handler(message: types.Message) -> None:
     """Обробник для всіх текстових повідомлень"""
     user_id = message.from_user.id
     language = get_user_language(user_id)
+    persona = get_bot_persona(message.bot)
     
     query = message.text
     if not query: 
@@ -250,49 +390,93 @@ async def echo_handler(message: types.Message) -> None:
     if message.from_user.first_name:
          user_info_str += f", name='{message.from_user.first_name}'"
          
-    logger.info(f"Отримано запит від користувача ({user_info_str}): '{query}'")
+    logger.info(f"Отримано запит від користувача ({user_info_str}) до персони '{persona}': '{query}'")
     
-    await bot.send_chat_action(chat_id=message.chat.id, action="typing")
+    if not is_search_available(persona):
+        logger.info("База знань ще прогрівається, запит відкладено.")
+        await message.answer(translation_manager.get_text("warming_up", language))
+        record_request(OUTCOME_WARMING_UP)
+        return
+
+    await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
     
     relevant_context: Optional[str] = None
+    # Чанки контексту з хешами, рангами та оцінками - у лог пишуться посиланнями, а не текстом
+    retrieved = EMPTY_CONTEXT
     llm_response: Optional[str] = None
     log_id: Optional[int] = None
     final_bot_response: str = "" 
+    streaming_reply: Optional[StreamingReply] = None
 
+    request_started = time.monotonic()
+    outcome = OUTCOME_ERROR
     try:
-        logger.info("Пошук релевантного контексту...")
-        relevant_context = find_relevant_context(query, max_tokens=1000) 
-        
+        # Готова схвалена відповідь на майже таке саме питання - без пошуку та LLM
+        cached_answer = await lookup_answer(query, language, persona)
+        if cached_answer is not None:
+            source_log_id, final_bot_response, similarity = cached_answer
+            logger.info(f"Відповідь взято з кешу відповідей (джерело log_id={source_log_id}, подібність {similarity:.3f}).")
+            log_id = await add_log_entry(
+                user_id=user_id,
+                user_first_name=message.from_user.first_name,
+                user_username=message.from_user.username,
+                user_query=query,
+                bot_response=final_bot_response,
+                language=language,
+                retrieved_context=None,
+                persona=persona,
+                index_version=get_index_version(persona),
+            )
+            feedback_markup = get_feedback_keyboard(log_id) if log_id and log_id > 0 else None
+            with time_stage(STAGE_TELEGRAM_SEND):
+                await message.answer(final_bot_response, reply_markup=feedback_markup, parse_mode=None)
+            answer_cache.record_hit_latency(time.monotonic() - request_started)
+            outcome = OUTCOME_CACHED_ANSWER
+            return
+
+        # У потоковому режимі перше речення з'являється одразу, решта - редагуваннями
+        streaming_reply = StreamingReply(message) if LLM_STREAMING else None
+        # Однакові питання, що надійшли одночасно, отримують відповідь одного пошуку та одного виклику LLM
+        try:
+            (retrieved, llm_response), shared = await question_flights.run(
+                question_key(query, language, persona, get_index_version(persona)),
+                lambda: generate_answer(query, persona, streaming_reply.feed if streaming_reply else None),
+            )
+        except RetrievalBusyError:
+            await message.answer(translation_manager.get_text("service_busy", language))
+            outcome = OUTCOME_BUSY
+            return
+        relevant_context = retrieved.text
+        if shared:
+            # Відповідь генерувалась для іншого повідомлення - надсилаємо її цілою
+            streaming_reply = None
+            logger.info("Питання об'єднано з однаковим питанням, що вже оброблялось.")
+            if relevant_context and llm_response is not None:
+                question_flights.record_llm_call_saved()
+
         if not relevant_context:
             logger.info(f"Релевантний контекст не знайдено для запиту: {query}")
             final_bot_response = translation_manager.get_text("context_not_found", language) 
-            await message.answer(final_bot_response) 
+            with time_stage(STAGE_TELEGRAM_SEND):
+                await message.answer(final_bot_response)
             log_id = -2 
+            outcome = OUTCOME_CONTEXT_NOT_FOUND
         else:
-            logger.info("Читаємо інструкції персони...")
-            # Тепер ця функція визначена вище
-            persona_instructions = read_persona_instructions() 
-            
-            logger.info("Генеруємо відповідь за допомогою LLM...")
-            llm_response = await generate_response(
-                query=query,
-                context=relevant_context,
-                persona_instructions=persona_instructions,
-                max_tokens=1000 
-            )
-            
             if llm_response is None:
                 logger.error(f"LLM не повернув відповідь для запиту: {query}")
                 final_bot_response = translation_manager.get_text("llm_error", language)
-                await message.answer(final_bot_response)
+                await send_reply(message, streaming_reply, final_bot_response)
                 log_id = -3 
+                outcome = OUTCOME_LLM_ERROR
             elif isinstance(llm_response, str) and "sorry" in llm_response.lower() and ("cannot fulfill" in llm_response.lower() or "unable to process" in llm_response.lower() or "don't have enough information" in llm_response.lower()):
                  logger.warning(f"LLM повернув відповідь, схожу на помилку/відмову: {llm_response}")
                  final_bot_response = llm_response 
-                 await message.answer(final_bot_response, parse_mode=None)
+                 await send_reply(message, streaming_reply, final_bot_response)
                  log_id = -4 
+                 outcome = OUTCOME_REFUSAL
             else:
                 final_bot_response = llm_response 
+                index_version = retrieved.index_version
                 logger.info("Запис логу перед відправкою відповіді...")
                 log_id = await add_log_entry(
                      user_id=user_id,
@@ -301,17 +485,22 @@ async def echo_handler(message: types.Message) -> None:
                      user_query=query,
                      bot_response=final_bot_response, 
                      language=language,
-                     retrieved_context=relevant_context 
+                     retrieved_context=relevant_context,
+                     persona=persona,
+                     index_version=index_version,
+                     retrieved_chunks=retrieved.chunk_dicts(),
                 )
+                if not shared:
+                    answer_cache.record_generation(time.monotonic() - request_started)
+                if log_id and log_id > 0 and not shared:
+                    await remember_answer(log_id, query, final_bot_response, language, persona, index_version)
                 
                 feedback_markup = get_feedback_keyboard(log_id) if log_id and log_id > 0 else None
 
                 logger.info(f"Відправляємо відповідь користувачу (log_id: {log_id})")
-                await message.answer(
-                    final_bot_response,
-                    reply_markup=feedback_markup,
-                    parse_mode=None 
-                )
+                # Клавіатура фідбеку додається лише фінальним повідомленням/редагуванням
+                await send_reply(message, streaming_reply, final_bot_response, reply_markup=feedback_markup)
+                outcome = OUTCOME_ANSWERED
         
         # Записуємо в лог, якщо відповідь не була успішною відповіддю LLM, що вже залоговано, або контекст не знайдено
         if log_id is None or log_id <= 0: # Тепер включаємо -2, -3, -4
@@ -325,11 +514,17 @@ async def echo_handler(message: types.Message) -> None:
                  user_query=query,
                  bot_response=final_bot_response, 
                  language=language,
-                 retrieved_context=relevant_context 
+                 retrieved_context=relevant_context,
+                 persona=persona,
+                 # Без версії індексу: запис не є відповіддю LLM і не потрапляє в кеш відповідей
+                 index_version=None,
+                 retrieved_chunks=retrieved.chunk_dicts(),
              )
              
     except Exception as e:
         logger.error(f"Неочікувана помилка при обробці запиту: {e}", exc_info=True) 
+        if streaming_reply is not None:
+            streaming_reply.cancel()
         error_message_text = translation_manager.get_text("error_occurred", language)
         try:
             await message.answer(error_message_text)
@@ -345,23 +540,88 @@ async def echo_handler(message: types.Message) -> None:
                  user_query=query,
                  bot_response=f"ERROR: {type(e).__name__} - {e}", 
                  language=language,
-                 retrieved_context=relevant_context 
+                 retrieved_context=relevant_context,
+                 persona=persona,
+                 index_version=None,
+                 retrieved_chunks=retrieved.chunk_dicts(),
              )
         except Exception as db_err:
              logger.error(f"Не вдалося записати помилку в БД для користувача {user_id}: {db_err}")
+    finally:
+        record_request(outcome, time.monotonic() - request_started)
+
+async def warmup_and_seed() -> None:
+    """Прогріває модель та індекси, після чого заповнює кеш відповідей з історії."""
+    if await warmup_async():
+        await seed_answer_cache()
+
+async def start_services(
+    retention: bool = True, metrics_port: int = METRICS_PORT, sync_feedback: bool = False
+) -> List[asyncio.Task]:
+    """
+    Ініціалізує БД, кеші та клієнт Anthropic і запускає фонові задачі процесу, що обробляє оновлення.
+
+    Args:
+        retention: Чи запускати архівування журналу (у webhook-режимі - лише в одному воркері)
+        metrics_port: Порт ендпоінта метрик цього процесу (0 - без ендпоінта)
+        sync_feedback: Чи підхоплювати в кеш відповідей фідбек, отриманий іншими процесами (webhook-режим)
+
+    Returns:
+        Фонові задачі, які треба передати в stop_services
+    """
+    await init_db() 
+    # Мови найнедавніше активних користувачів - одразу в кеш
+    await user_settings.preload()
+    # Один клієнт Anthropic з пулом з'єднань на весь час роботи бота
+    await initialize_anthropic_client()
+    # Інструкції персон читаються з диска один раз, далі - лише з пам'яті
+    prompt_assets.load_all()
+
+    tasks = [
+        # Модель та індекс завантажуються у фоні: /start, /faq, /info доступні одразу
+        asyncio.create_task(warmup_and_seed()),
+        # Стежимо за змінами knowledge_base.txt і підхоплюємо їх без перезапуску
+        asyncio.create_task(watch_knowledge_base()),
+        # Зміни файлів у locales/ підхоплюються разом з клавіатурами без перезапуску
+        asyncio.create_task(watch_locales()),
+        # Змінені інструкції персон підміняються новою версією системного промпту
+        asyncio.create_task(watch_prompt_assets()),
+        # Гістограми етапів та лічильники результатів для Prometheus
+        asyncio.create_task(run_metrics_server(port=metrics_port)),
+    ]
+    if sync_feedback:
+        # 👍/👎 могли надійти через інший воркер: кеш відповідей цього процесу оновлюється з БД
+        tasks.append(asyncio.create_task(watch_feedback()))
+    if retention:
+        # Старі записи журналу переносяться в архів, щоб conversation_log не ріс безмежно
+        tasks.append(asyncio.create_task(run_retention_loop()))
+    return tasks
+
+
+async def stop_services(tasks: List[asyncio.Task]) -> None:
+    """Зупиняє фонові задачі та дописує все, що накопичилось у пам'яті."""
+    for task in tasks:
+        task.cancel()
+    shutdown_retrieval_executor()
+    await close_anthropic_client()
+    # Записуємо в БД усе, що залишилось у черзі логу
+    await close_log_writer()
+    await user_settings.close()
+
 
 # --- Функція для запуску бота ---
 async def main() -> None:
-    """Головна функція для запуску бота"""
-    # Імпортуємо та викликаємо ініціалізацію БД тут
-    from database import init_db
-    await init_db() 
-    
-    await bot.delete_webhook(drop_pending_updates=True)
-    logger.info("Запуск поллінгу...")
-    await dp.start_polling(bot)
+    """Головна функція для запуску бота (polling; webhook-режим запускається через webhook_server.py)"""
+    tasks = await start_services()
+    for bot in bots.values():
+        await bot.delete_webhook(drop_pending_updates=True)
+    logger.info(f"Запуск поллінгу для персон: {', '.join(bots)}...")
+    try:
+        await dp.start_polling(*bots.values())
+    finally:
+        await stop_services(tasks)
 
 if __name__ == "__main__":
     logger.info("Запуск бота...")
-    # Векторизація бази знань відбудеться при імпорті knowledge_utils вище
+    # Векторизація бази знань запускається у фоні з main()
     asyncio.run(main())
\ No newline at end of file
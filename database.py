@@ -1,22 +1,54 @@
 # database.py
 
+import os
+import time
+import asyncio
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional, Union
+from typing import Dict, List, Optional, Tuple
 
 # Імпорти SQLAlchemy для асинхронної роботи
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, MetaData, Table, update, select
+from sqlalchemy import (
+    event, Column, Integer, String, Text, DateTime, Float, MetaData, Table, Index,
+    PrimaryKeyConstraint, UniqueConstraint, update, select, text, func,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 
+from knowledge_index import chunk_hash
+from metrics import time_stage, STAGE_DB_WRITE
+
 logger = logging.getLogger(__name__)
 
-DATABASE_URL = "sqlite+aiosqlite:///history.db" # Назва файлу БД
+# Адреса БД (за замовчуванням файл history.db у директорії запуску)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///history.db")
+
+# Фоновий запис логу: максимальний розмір пакета та як часто (в секундах) скидати неповний пакет
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))
 
 # Створюємо асинхронний двигун SQLAlchemy
 async_engine = create_async_engine(DATABASE_URL, echo=False) # echo=True для відладки SQL запитів
 
+
+@event.listens_for(async_engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    WAL: читання не блокуються записом, а коміт не робить fsync основного файлу БД.
+    synchronous=NORMAL у режимі WAL безпечний щодо цілісності і значно швидший за FULL.
+    """
+    cursor = dbapi_connection.cursor()
+    # Для нової БД: звільнені сторінки повертаються файлу частинами (PRAGMA incremental_vacuum),
+    # без повного VACUUM. Існуюча БД переходить у цей режим лише після одного повного VACUUM.
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 # Метадані для опису таблиць
 metadata = MetaData()
 
@@ -33,22 +65,409 @@ conversation_log_table = Table(
     Column("timestamp_bot", DateTime), # Час відповіді бота
     Column("bot_response", Text),
     Column("language", String(5)), # Код мови (en, ms)
-    Column("retrieved_context", Text, nullable=True), # Збережений контекст (опціонально)
-    Column("feedback", String(10), nullable=True, index=True) # 'like', 'dislike' або NULL
+    Column("feedback", String(10), nullable=True, index=True), # 'like', 'dislike' або NULL
+    Column("persona", String(64), nullable=True), # Персона (бот), якій адресовано запит
+    Column("index_version", String(32), nullable=True), # Версія індексу бази знань, на якій згенеровано відповідь
+    Column("feedback_at", DateTime, nullable=True, index=True), # Час запису фідбеку в БД (для синхронізації кешів воркерів)
+    # Запити за останній період та вибірка старих записів для архівування
+    Index("ix_conversation_log_timestamp_user", "timestamp_user"),
+    # Аналітика фідбеку в розрізі мов
+    Index("ix_conversation_log_language_feedback", "language", "feedback"),
+)
+
+# Унікальні чанки бази знань, що потрапляли в контекст відповідей (текст зберігається один раз)
+knowledge_chunks_table = Table(
+    "knowledge_chunks",
+    metadata,
+    Column("chunk_id", Integer, primary_key=True),
+    Column("chunk_hash", String(40), nullable=False), # sha1 вмісту чанка
+    Column("index_version", String(32), nullable=False), # Версія індексу бази знань ('legacy' для перенесених записів)
+    Column("chunk_text", Text, nullable=False),
+    UniqueConstraint("chunk_hash", "index_version", name="uq_knowledge_chunks_hash_version"),
+)
+
+# Які чанки (в якому порядку та з якою оцінкою пошуку) склали контекст запису логу
+conversation_log_chunks_table = Table(
+    "conversation_log_chunks",
+    metadata,
+    Column("log_id", Integer, nullable=False),
+    Column("rank", Integer, nullable=False), # Позиція чанка в контексті (0 - перший)
+    # Без індексу за chunk_id: записи читаються лише за log_id, а пошук чанків без посилань
+    # (log_retention) один раз проходить таблицю; індекс займав майже стільки ж місця, як сама таблиця
+    Column("chunk_id", Integer, nullable=False),
+    Column("score", Float, nullable=True), # Оцінка пошуку (NULL для перенесених записів)
+    PrimaryKeyConstraint("log_id", "rank"),
+    # Рядки зберігаються прямо в B-дереві первинного ключа, без окремого індексу та rowid
+    sqlite_with_rowid=False,
+)
+
+# Налаштування користувачів, що мають переживати перезапуск бота
+user_settings_table = Table(
+    "user_settings",
+    metadata,
+    Column("user_id", Integer, primary_key=True),
+    Column("language", String(5), nullable=False), # Обрана мова інтерфейсу
+    Column("updated_at", DateTime, default=datetime.utcnow),
 )
 
+# Версія індексу для чанків, перенесених зі старих записів з retrieved_context
+LEGACY_INDEX_VERSION = "legacy"
+# Колонка старих БД з повним текстом контексту; переноситься в чанки і видаляється migrate_chunks.py
+LEGACY_CONTEXT_COLUMN = "retrieved_context"
+# Роздільник, яким чанки склеюються в контекст при пошуку
+CONTEXT_SEPARATOR = "\n\n"
+
+# Колонки, додані після першої версії таблиці: (назва, тип SQL) для ALTER TABLE в існуючих БД
+_ADDED_COLUMNS = [("persona", "VARCHAR(64)"), ("index_version", "VARCHAR(32)"), ("feedback_at", "DATETIME")]
+
+# Індекси попередніх версій схеми, що більше не потрібні (видаляються з існуючих БД)
+_DROPPED_INDEXES = ["ix_conversation_log_chunks_chunk_id"]
+
+def _create_missing_indexes(sync_conn) -> None:
+    """Створює індекси, яких ще немає в існуючих таблицях (create_all створює їх лише з новою таблицею)."""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+def _drop_obsolete_indexes(sync_conn) -> None:
+    """Видаляє індекси з _DROPPED_INDEXES (місце повертається при наступному VACUUM)."""
+    for name in _DROPPED_INDEXES:
+        sync_conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+def _add_missing_columns(sync_conn) -> None:
+    """Додає в існуючу таблицю колонки, яких у ній ще немає (create_all цього не робить)."""
+    existing = {row[1] for row in sync_conn.execute(text("PRAGMA table_info(conversation_log)"))}
+    for name, sql_type in _ADDED_COLUMNS:
+        if name not in existing:
+            sync_conn.execute(text(f"ALTER TABLE conversation_log ADD COLUMN {name} {sql_type}"))
+            logger.info(f"До таблиці 'conversation_log' додано колонку '{name}'.")
+
+def _has_legacy_context(sync_conn) -> bool:
+    """Чи залишились у старій колонці conversation_log тексти контексту, не перенесені в чанки."""
+    existing = {row[1] for row in sync_conn.execute(text("PRAGMA table_info(conversation_log)"))}
+    if LEGACY_CONTEXT_COLUMN not in existing:
+        return False
+    return sync_conn.execute(text(
+        f"SELECT 1 FROM conversation_log WHERE {LEGACY_CONTEXT_COLUMN} IS NOT NULL LIMIT 1"
+    )).first() is not None
+
 async def init_db():
     """Ініціалізує базу даних та створює таблицю, якщо її немає."""
     async with async_engine.begin() as conn:
         logger.info("Ініціалізація бази даних...")
         await conn.run_sync(metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+        await conn.run_sync(_drop_obsolete_indexes)
+        if await conn.run_sync(_has_legacy_context):
+            logger.warning(
+                f"Колонка '{LEGACY_CONTEXT_COLUMN}' у 'conversation_log' містить неперенесені контексти: бот її не читає "
+                "і не пише, архівування журналу вимкнено до міграції. Зупиніть бота і виконайте: python migrate_chunks.py"
+            )
         logger.info("Таблиця 'conversation_log' перевірена/створена.")
 
+async def has_legacy_context() -> bool:
+    """Чи потрібна БД міграція migrate_chunks.py (у колонці retrieved_context залишились контексти)."""
+    async with async_engine.connect() as conn:
+        return await conn.run_sync(_has_legacy_context)
+
 # Фабрика асинхронних сесій
 AsyncSessionFactory = sessionmaker(
     async_engine, class_=AsyncSession, expire_on_commit=False
 )
 
+def _log_columns(record: dict) -> dict:
+    """Значення колонок conversation_log (без службових полів запису черги)."""
+    return {key: value for key, value in record.items() if key != "chunks"}
+
+
+def _context_chunks(context: Optional[str]) -> Optional[List[dict]]:
+    """Розбиває готовий текст контексту на чанки (для викликів без retrieved_chunks)."""
+    if not context:
+        return None
+    pieces = [piece for piece in context.split(CONTEXT_SEPARATOR) if piece.strip()]
+    return [
+        {"chunk_hash": chunk_hash(piece), "text": piece, "rank": rank, "score": None}
+        for rank, piece in enumerate(pieces)
+    ] or None
+
+
+async def _insert_log_chunks(conn, records: List[dict]) -> None:
+    """
+    Записує посилання записів логу на чанки контексту. Текст чанка вставляється в
+    knowledge_chunks лише один раз для пари (хеш, версія індексу); версія береться з чанка,
+    а якщо її там немає - з запису.
+    """
+    links = [
+        (record, chunk, chunk.get("index_version") or record["index_version"] or LEGACY_INDEX_VERSION)
+        for record in records for chunk in record.get("chunks") or ()
+    ]
+    if not links:
+        return
+    keys = {(chunk["chunk_hash"], version): chunk["text"] for _, chunk, version in links}
+    chunk_ids = await _ensure_chunk_ids(conn, keys)
+    await conn.execute(conversation_log_chunks_table.insert(), [
+        {
+            "log_id": record["log_id"],
+            "rank": chunk["rank"],
+            "chunk_id": chunk_ids[(chunk["chunk_hash"], version)],
+            "score": chunk["score"],
+        }
+        for record, chunk, version in links
+    ])
+
+
+async def _ensure_chunk_ids(conn, chunks: Dict[Tuple[str, str], str]) -> Dict[Tuple[str, str], int]:
+    """Повертає chunk_id для кожної пари (хеш, версія), вставляючи відсутні чанки."""
+    table = knowledge_chunks_table
+    await conn.execute(
+        sqlite_insert(table).on_conflict_do_nothing(index_elements=["chunk_hash", "index_version"]),
+        [{"chunk_hash": h, "index_version": v, "chunk_text": chunk_text} for (h, v), chunk_text in chunks.items()],
+    )
+    chunk_ids = {}
+    keys = list(chunks)
+    # Вибираємо ID частинами, щоб не перевищити ліміт параметрів SQLite
+    for start in range(0, len(keys), 400):
+        part = keys[start:start + 400]
+        result = await conn.execute(
+            select(table.c.chunk_id, table.c.chunk_hash, table.c.index_version).where(
+                table.c.chunk_hash.in_({h for h, _ in part}),
+                table.c.index_version.in_({v for _, v in part}),
+            )
+        )
+        for chunk_id, hash_value, index_version in result:
+            chunk_ids[(hash_value, index_version)] = chunk_id
+    return chunk_ids
+
+
+async def get_retrieved_context(log_id: int) -> Optional[str]:
+    """Відновлює текст контексту запису логу з його чанків (None, якщо чанків немає)."""
+    stmt = (
+        select(knowledge_chunks_table.c.chunk_text)
+        .select_from(conversation_log_chunks_table.join(
+            knowledge_chunks_table,
+            conversation_log_chunks_table.c.chunk_id == knowledge_chunks_table.c.chunk_id,
+        ))
+        .where(conversation_log_chunks_table.c.log_id == log_id)
+        .order_by(conversation_log_chunks_table.c.rank)
+    )
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(stmt)
+        texts = [row[0] for row in result]
+    return CONTEXT_SEPARATOR.join(texts) if texts else None
+
+
+class _LogIdGenerator:
+    """
+    Генерує унікальні log_id без звернення до БД (щоб кнопки фідбеку мали ID одразу):
+    мілісекунди від 2024-01-01, номер процесу та лічильник у межах мілісекунди.
+    Номер процесу задається явно (номер воркера webhook-режиму, 0 - єдиний процес), тож
+    процеси, що одночасно пишуть у журнал, ніколи не отримують однакових ID.
+    """
+
+    _EPOCH_MS = 1704067200000
+    _PROCESS_BITS = 10
+    _SEQUENCE_BITS = 12
+    MAX_PROCESSES = 1 << _PROCESS_BITS
+
+    def __init__(self, process_id: int = 0):
+        self._process_id = 0
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.set_process_id(process_id)
+
+    def set_process_id(self, process_id: int) -> None:
+        if not 0 <= process_id < self.MAX_PROCESSES:
+            raise ValueError(f"Номер процесу для log_id має бути від 0 до {self.MAX_PROCESSES - 1}, отримано {process_id}")
+        with self._lock:
+            self._process_id = process_id
+
+    def next_id(self) -> int:
+        with self._lock:
+            now_ms = int(time.time() * 1000) - self._EPOCH_MS
+            if now_ms <= self._last_ms:
+                # Та сама мілісекунда (або годинник відступив назад): продовжуємо лічильник
+                now_ms = self._last_ms
+                self._sequence += 1
+                if self._sequence >= (1 << self._SEQUENCE_BITS):
+                    now_ms += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (now_ms << (self._PROCESS_BITS + self._SEQUENCE_BITS)) | (self._process_id << self._SEQUENCE_BITS) | self._sequence
+
+
+class ConversationLogWriter:
+    """
+    Фоновий запис conversation_log: обробники лише ставлять запис у чергу,
+    а окрема задача вставляє накопичені записи одною транзакцією, коли набирається
+    LOG_BATCH_SIZE записів або минає LOG_FLUSH_INTERVAL секунд.
+    """
+
+    def __init__(self, batch_size: int = LOG_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._ids = _LogIdGenerator()
+        # Записи, що чекають на вставку (log_id -> значення колонок), у порядку надходження
+        self._pending: "OrderedDict[int, dict]" = OrderedDict()
+        # Записи, що вставляються зараз
+        self._flushing: Dict[int, dict] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Прапорець зупинки фонової задачі: задача дописує поточний пакет і завершується сама
+        self._stopping = False
+
+        self.records_written = 0
+        self.batches_written = 0
+        self.flush_errors = 0
+
+    def _ensure_started(self) -> None:
+        """Запускає фонову задачу в поточному event loop (при першому записі)."""
+        if self._task is None or self._task.done():
+            self._flush_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, values: dict) -> int:
+        """Ставить запис у чергу і одразу повертає його log_id."""
+        self._ensure_started()
+        log_id = self._ids.next_id()
+        values["log_id"] = log_id
+        self._pending[log_id] = values
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return log_id
+
+    def get_pending(self, log_id: int) -> Optional[dict]:
+        """Повертає копію ще не записаного в БД запису."""
+        record = self._pending.get(log_id) or self._flushing.get(log_id)
+        return dict(record) if record is not None else None
+
+    async def update_pending_feedback(self, log_id: int, feedback_value: str) -> bool:
+        """
+        Записує фідбек у запис, що ще в черзі. Якщо запис саме вставляється,
+        чекає завершення вставки (далі фідбек оновлюється звичайним UPDATE).
+
+        Returns:
+            True, якщо фідбек записано в запис черги
+        """
+        record = self._pending.get(log_id)
+        if record is not None:
+            record["feedback"] = feedback_value
+            return True
+        if log_id in self._flushing and self._flush_lock is not None:
+            async with self._flush_lock:
+                pass
+            # Якщо вставка не вдалася, запис повернувся в чергу
+            record = self._pending.get(log_id)
+            if record is not None:
+                record["feedback"] = feedback_value
+                return True
+        return False
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _requeue(self, batch: List[dict]) -> None:
+        """Повертає записи пакета на початок черги в тому ж порядку."""
+        for record in reversed(batch):
+            self._pending[record["log_id"]] = record
+            self._pending.move_to_end(record["log_id"], last=False)
+
+    async def flush(self) -> bool:
+        """
+        Вставляє всі записи з черги пакетами по batch_size (кожен пакет - одна транзакція).
+        При помилці записи повертаються в чергу і будуть вставлені наступним скиданням.
+
+        Returns:
+            True, якщо черга порожня після скидання
+        """
+        if self._flush_lock is None:
+            return not self._pending
+        async with self._flush_lock:
+            while self._pending:
+                batch = []
+                while self._pending and len(batch) < self.batch_size:
+                    log_id, record = self._pending.popitem(last=False)
+                    self._flushing[log_id] = record
+                    batch.append(record)
+                now = datetime.utcnow()
+                for record in batch:
+                    # Фідбек, отриманий поки запис був у черзі, з'являється в БД лише зараз
+                    if record.get("feedback"):
+                        record["feedback_at"] = now
+                try:
+                    with time_stage(STAGE_DB_WRITE):
+                        async with async_engine.begin() as conn:
+                            await conn.execute(conversation_log_table.insert(), [_log_columns(record) for record in batch])
+                            await _insert_log_chunks(conn, batch)
+                except Exception as e:
+                    self.flush_errors += 1
+                    logger.error(f"Помилка запису пакета логу ({len(batch)} записів), повторимо пізніше: {e}", exc_info=True)
+                    self._requeue(batch)
+                    return False
+                except BaseException:
+                    # Скасування посеред вставки (транзакцію відкочено): записи не мають зникнути
+                    self._requeue(batch)
+                    raise
+                finally:
+                    for record in batch:
+                        self._flushing.pop(record["log_id"], None)
+                self.records_written += len(batch)
+                self.batches_written += 1
+                logger.debug(f"Записано пакет логу: {len(batch)} записів.")
+        return True
+
+    async def close(self, attempts: int = 3) -> None:
+        """Зупиняє фонову задачу та записує все, що залишилось у черзі (при завершенні роботи бота)."""
+        if self._task is not None:
+            # Без cancel(): задача дописує пакет, що вставляється зараз, і виходить з циклу
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for attempt in range(attempts):
+            if await self.flush():
+                break
+            await asyncio.sleep(0.5 * (attempt + 1))
+        if self._pending:
+            logger.error(f"Не вдалося записати {len(self._pending)} записів логу при завершенні роботи.")
+        else:
+            logger.info(f"Черга логу записана: всього {self.records_written} записів за {self.batches_written} пакетів.")
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending) + len(self._flushing),
+            "records_written": self.records_written,
+            "batches_written": self.batches_written,
+            "flush_errors": self.flush_errors,
+        }
+
+
+log_writer = ConversationLogWriter()
+
+
+def set_log_worker_index(worker_index: int) -> None:
+    """
+    Задає номер процесу, що входить у log_id (у webhook-режимі - номер воркера 0..N-1).
+    Викликається до першого запису в журнал.
+    """
+    log_writer._ids.set_process_id(worker_index)
+
+
 async def add_log_entry(
     user_id: int,
     user_first_name: str,
@@ -57,45 +476,44 @@ async def add_log_entry(
     bot_response: str,
     language: str,
     retrieved_context: Optional[str] = None,
+    persona: Optional[str] = None,
+    index_version: Optional[str] = None,
+    retrieved_chunks: Optional[List[dict]] = None,
 ) -> Optional[int]:
-    """Додає новий запис про взаємодію до БД та повертає його ID."""
-    async with AsyncSessionFactory() as session:
-        async with session.begin():
-            try:
-                timestamp_user = datetime.utcnow() # Беремо час перед записом запиту
-                timestamp_bot = datetime.utcnow()  # Час відповіді - майже одразу після генерації
-
-                new_log = conversation_log_table.insert().values(
-                    user_id=user_id,
-                    user_first_name=user_first_name,
-                    user_username=user_username,
-                    timestamp_user=timestamp_user, 
-                    user_query=user_query,
-                    timestamp_bot=timestamp_bot,
-                    bot_response=bot_response,
-                    language=language,
-                    retrieved_context=retrieved_context,
-                    feedback=None # Фідбек спочатку відсутній
-                )
-                result = await session.execute(new_log)
-                await session.commit() # Commit після execute для insert з values
-                
-                # Отримання ID вставленого запису
-                inserted_id = result.inserted_primary_key[0] if result.inserted_primary_key else None
-                
-                if inserted_id:
-                    logger.info(f"Запис логу {inserted_id} для користувача {user_id} додано до БД.")
-                else:
-                     logger.warning(f"Не вдалося отримати ID для нового запису логу користувача {user_id}.")
-                return inserted_id
-            except SQLAlchemyError as e:
-                await session.rollback()
-                logger.error(f"Помилка SQLAlchemy при додаванні запису до БД: {e}", exc_info=True)
-                return None
-            except Exception as e:
-                 await session.rollback()
-                 logger.error(f"Неочікувана помилка при додаванні запису до БД: {e}", exc_info=True)
-                 return None
+    """
+    Ставить запис про взаємодію в чергу фонового запису та одразу повертає його ID
+    (запис у БД відбувається пакетом, поза шляхом відповіді користувачу).
+
+    Контекст зберігається лише посиланнями на таблицю knowledge_chunks: retrieved_chunks - словники
+    chunk_hash/text/rank/score та, за потреби, index_version; якщо їх не передано, на чанки
+    розбивається retrieved_context.
+
+    index_version передається лише для успішних відповідей LLM: за ним get_cacheable_answers
+    відбирає відповіді для кешу. Версія індексу чанків записів без відповіді береться з самих чанків.
+    """
+    timestamp = datetime.utcnow()
+    log_id = log_writer.enqueue({
+        "user_id": user_id,
+        "user_first_name": user_first_name,
+        "user_username": user_username,
+        "timestamp_user": timestamp,
+        "user_query": user_query,
+        "timestamp_bot": timestamp,
+        "bot_response": bot_response,
+        "language": language,
+        "feedback": None, # Фідбек спочатку відсутній
+        "feedback_at": None,
+        "persona": persona,
+        "index_version": index_version,
+        "chunks": retrieved_chunks or _context_chunks(retrieved_context),
+    })
+    logger.info(f"Запис логу {log_id} для користувача {user_id} поставлено в чергу.")
+    return log_id
+
+
+async def close_log_writer() -> None:
+    """Записує чергу логу в БД (викликається при завершенні роботи бота)."""
+    await log_writer.close()
 
 
 async def update_feedback(log_id: int, feedback_value: str):
@@ -108,13 +526,18 @@ async def update_feedback(log_id: int, feedback_value: str):
         logger.warning(f"Спроба оновити фідбек з невалідним значенням: {feedback_value}")
         return False
 
+    # Запис ще може чекати в черзі фонового запису
+    if await log_writer.update_pending_feedback(log_id, feedback_value):
+        logger.info(f"Фідбек '{feedback_value}' для запису логу {log_id} (ще в черзі) оновлено.")
+        return True
+
     async with AsyncSessionFactory() as session:
         async with session.begin():
             try:
                 stmt = (
                     update(conversation_log_table)
                     .where(conversation_log_table.c.log_id == log_id)
-                    .values(feedback=feedback_value)
+                    .values(feedback=feedback_value, feedback_at=datetime.utcnow())
                 )
                 result = await session.execute(stmt)
                 await session.commit()
@@ -132,4 +555,134 @@ async def update_feedback(log_id: int, feedback_value: str):
             except Exception as e:
                 await session.rollback()
                 logger.error(f"Неочікувана помилка при оновленні фідбеку для log_id {log_id}: {e}", exc_info=True)
-                return False
\ No newline at end of file
+                return False
+
+
+async def get_log_entry(log_id: int) -> Optional[dict]:
+    """Повертає запис логу як словник або None."""
+    pending = log_writer.get_pending(log_id)
+    if pending is not None:
+        chunks = pending.pop("chunks", None)
+        pending["retrieved_context"] = CONTEXT_SEPARATOR.join(chunk["text"] for chunk in chunks) if chunks else None
+        return pending
+    async with AsyncSessionFactory() as session:
+        try:
+            result = await session.execute(
+                select(conversation_log_table).where(conversation_log_table.c.log_id == log_id)
+            )
+            row = result.mappings().first()
+        except SQLAlchemyError as e:
+            logger.error(f"Помилка SQLAlchemy при читанні запису логу {log_id}: {e}", exc_info=True)
+            return None
+    if row is None:
+        return None
+    entry = dict(row, retrieved_context=None)
+    try:
+        entry["retrieved_context"] = await get_retrieved_context(log_id)
+    except SQLAlchemyError as e:
+        logger.error(f"Помилка SQLAlchemy при читанні чанків запису логу {log_id}: {e}", exc_info=True)
+    return entry
+
+
+async def get_cacheable_answers(only_liked: bool = True, limit: int = 10000) -> list:
+    """
+    Повертає відповіді LLM, придатні для кешу відповідей (від найновіших):
+    зі схваленням 👍, або (only_liked=False) усі, крім позначених 👎.
+    Враховуються лише записи з версією індексу, тобто успішні відповіді LLM.
+    """
+    table = conversation_log_table
+    if only_liked:
+        feedback_filter = table.c.feedback == "like"
+    else:
+        feedback_filter = (table.c.feedback.is_(None)) | (table.c.feedback != "dislike")
+    stmt = (
+        select(
+            table.c.log_id, table.c.user_query, table.c.bot_response,
+            table.c.language, table.c.persona, table.c.index_version,
+        )
+        .where(table.c.index_version.is_not(None), feedback_filter)
+        .order_by(table.c.log_id.desc())
+        .limit(limit)
+    )
+    async with AsyncSessionFactory() as session:
+        try:
+            result = await session.execute(stmt)
+            return [dict(row) for row in result.mappings()]
+        except SQLAlchemyError as e:
+            logger.error(f"Помилка SQLAlchemy при читанні відповідей для кешу: {e}", exc_info=True)
+            return []
+
+
+async def get_feedback_since(since: datetime, limit: int = 1000) -> list:
+    """
+    Повертає фідбек, записаний у БД не раніше since (від найстаріших): словники log_id/feedback/feedback_at.
+    Так воркери webhook-режиму дізнаються про 👍/👎, отримані іншими воркерами.
+    """
+    table = conversation_log_table
+    stmt = (
+        select(table.c.log_id, table.c.feedback, table.c.feedback_at)
+        .where(table.c.feedback_at >= since)
+        .order_by(table.c.feedback_at)
+        .limit(limit)
+    )
+    async with AsyncSessionFactory() as session:
+        try:
+            result = await session.execute(stmt)
+            return [dict(row) for row in result.mappings()]
+        except SQLAlchemyError as e:
+            logger.error(f"Помилка SQLAlchemy при читанні фідбеку: {e}", exc_info=True)
+            return []
+
+
+async def save_user_languages(languages: Dict[int, str]) -> None:
+    """Зберігає мови користувачів (upsert однією транзакцією). Помилки передаються викликачу."""
+    if not languages:
+        return
+    now = datetime.utcnow()
+    stmt = sqlite_insert(user_settings_table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"language": stmt.excluded.language, "updated_at": stmt.excluded.updated_at},
+    )
+    async with async_engine.begin() as conn:
+        await conn.execute(stmt, [
+            {"user_id": user_id, "language": language, "updated_at": now}
+            for user_id, language in languages.items()
+        ])
+
+
+async def get_user_language_setting(user_id: int) -> Optional[str]:
+    """Повертає збережену мову користувача або None, якщо він її не обирав."""
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            select(user_settings_table.c.language).where(user_settings_table.c.user_id == user_id)
+        )
+        return result.scalar()
+
+
+async def get_recent_user_languages(limit: int) -> Dict[int, str]:
+    """
+    Мови користувачів, що писали боту найнедавніше (для попереднього заповнення кешу).
+    Користувачі без збереженої мови не повертаються.
+    """
+    log = conversation_log_table
+    settings = user_settings_table
+    last_active = (
+        select(log.c.user_id, func.max(log.c.timestamp_user).label("last_active"))
+        .group_by(log.c.user_id)
+        .subquery()
+    )
+    stmt = (
+        select(settings.c.user_id, settings.c.language)
+        .select_from(settings.outerjoin(last_active, last_active.c.user_id == settings.c.user_id))
+        # Користувачі без записів у журналі - за часом зміни мови
+        .order_by(func.coalesce(last_active.c.last_active, settings.c.updated_at).desc())
+        .limit(limit)
+    )
+    async with AsyncSessionFactory() as session:
+        try:
+            result = await session.execute(stmt)
+            return {user_id: language for user_id, language in result}
+        except SQLAlchemyError as e:
+            logger.error(f"Помилка SQLAlchemy при читанні мов користувачів: {e}", exc_info=True)
+            return {}
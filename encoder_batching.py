@@ -0,0 +1,136 @@
+# encoder_batching.py
+# Мікробатчинг запитів до енкодера: одночасні запити користувачів векторизуються одним викликом model.encode(list)
+
+import time
+import asyncio
+import logging
+import numpy as np
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class EncoderBatcher:
+    """
+    Збирає запити протягом короткого вікна (або до max_batch_size штук)
+    і векторизує їх одним пакетом. Кожен виклик encode() отримує свій вектор.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        executor: Optional[Executor] = None,
+        batch_window_ms: float = 5.0,
+        max_batch_size: int = 16,
+    ):
+        """
+        Args:
+            encode_fn: Функція, що векторизує список текстів (блокуюча)
+            executor: Пул, у якому виконується encode_fn (None - пул за замовчуванням)
+            batch_window_ms: Скільки мілісекунд чекати на додаткові запити після першого
+            max_batch_size: Максимальний розмір пакета
+        """
+        self.encode_fn = encode_fn
+        self.executor = executor
+        self.batch_window = max(0.0, batch_window_ms) / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.batches_total = 0
+        self.items_total = 0
+        self.max_batch_seen = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self.encode_seconds_total = 0.0
+
+    def _ensure_worker(self) -> None:
+        """Запускає фоновий обробник черги в поточному event loop."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Ставить текст у чергу та повертає його вектор після векторизації пакета."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[str, asyncio.Future]]:
+        """Чекає перший запит, потім добирає інші до закінчення вікна або ліміту пакета."""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # Вікно минуло - забираємо лише те, що вже чекає в черзі
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            # Запити, які вже скасовано (наприклад, користувач пішов), не векторизуємо
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            texts = [text for text, _ in batch]
+            started = time.perf_counter()
+            try:
+                embeddings = await loop.run_in_executor(self.executor, self.encode_fn, texts)
+            except Exception as e:
+                logger.error(f"Помилка пакетної векторизації ({len(texts)} запитів): {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self._record_batch(len(texts), time.perf_counter() - started)
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    def _record_batch(self, size: int, seconds: float) -> None:
+        self.batches_total += 1
+        self.items_total += size
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        self.batch_size_counts[size] = self.batch_size_counts.get(size, 0) + 1
+        self.encode_seconds_total += seconds
+        logger.debug(f"Векторизовано пакет з {size} запитів за {seconds * 1000:.1f} мс")
+
+    def get_stats(self) -> Dict[str, object]:
+        """Повертає метрики батчингу (кількість пакетів, середній/максимальний розмір, гістограму)."""
+        return {
+            "batches_total": self.batches_total,
+            "items_total": self.items_total,
+            "avg_batch_size": (self.items_total / self.batches_total) if self.batches_total else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+            "encode_seconds_total": self.encode_seconds_total,
+        }
+
+    def close(self) -> None:
+        """Зупиняє фоновий обробник черги."""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        # Запити, що залишились у черзі, скасовуємо, щоб ніхто не чекав вічно
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
@@ -0,0 +1,139 @@
+# fake_anthropic_server.py
+# Локальний імітатор Anthropic Messages API для розробки та перевірки потокових відповідей
+# і кешування префікса промпту без реального ключа. Відповідає фіксованим текстом, який
+# віддається частинами з затримкою; блоки з cache_control "кешуються" в пам'яті процесу.
+#
+# Запуск:
+#   python fake_anthropic_server.py --port 8765 --delay 0.05
+#   ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=test python bot.py
+
+import json
+import hashlib
+import asyncio
+import argparse
+import logging
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ANSWER = (
+    "Hello! Thanks for your question. "
+    "This answer comes from a local fake server, word by word, so you can watch it grow in Telegram. "
+    "The feedback buttons should appear only when the answer is complete."
+)
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+def _count_tokens(value) -> int:
+    """Груба оцінка кількості токенів (приблизно 4 символи на токен)."""
+    return len(json.dumps(value, ensure_ascii=False)) // 4
+
+
+def _usage(body: dict, prompt_cache: set) -> dict:
+    """
+    Рахує вхідні токени як провайдер з prompt caching: префікс до останнього блоку
+    з cache_control при першому запиті записується в кеш, при наступних - читається з нього.
+    """
+    system = body.get("system") or []
+    blocks = [{"type": "text", "text": system}] if isinstance(system, str) else list(system)
+    cached_until = max((i + 1 for i, block in enumerate(blocks) if block.get("cache_control")), default=0)
+    prefix = blocks[:cached_until]
+    prefix_tokens = _count_tokens(prefix) if prefix else 0
+    usage = {
+        "input_tokens": _count_tokens(blocks[cached_until:]) + _count_tokens(body.get("messages", [])),
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": 0,
+        "output_tokens": 0,
+    }
+    if prefix:
+        key = hashlib.sha256(json.dumps([body.get("model"), prefix], sort_keys=True).encode("utf-8")).hexdigest()
+        if key in prompt_cache:
+            usage["cache_read_input_tokens"] = prefix_tokens
+        else:
+            prompt_cache.add(key)
+            usage["cache_creation_input_tokens"] = prefix_tokens
+    return usage
+
+
+def _message(model: str, text: str, usage: dict) -> dict:
+    return {
+        "id": "msg_fake",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}] if text else [],
+        "stop_reason": "end_turn" if text else None,
+        "stop_sequence": None,
+        "usage": usage,
+    }
+
+
+def create_app(answer: str = DEFAULT_ANSWER, delay: float = 0.05, first_token_delay: float = 0.5) -> web.Application:
+    """
+    Створює aiohttp-застосунок з ендпоінтом POST /v1/messages.
+
+    Args:
+        answer: Текст відповіді
+        delay: Затримка між словами в потоковому режимі, секунди
+        first_token_delay: Затримка перед першим словом (імітація time-to-first-token)
+    """
+
+    prompt_cache = set()
+
+    async def messages(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get("model", "fake")
+        words = answer.split(" ")
+        usage = _usage(body, prompt_cache)
+        logger.info(f"Запит: {usage}")
+
+        if not body.get("stream"):
+            await asyncio.sleep(first_token_delay + delay * len(words))
+            return web.json_response(_message(model, answer, {**usage, "output_tokens": len(words)}))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await response.write(_sse("message_start", {"type": "message_start", "message": _message(model, "", usage)}))
+        await response.write(_sse("content_block_start", {
+            "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""},
+        }))
+        await asyncio.sleep(first_token_delay)
+        for i, word in enumerate(words):
+            text = word if i == 0 else " " + word
+            await response.write(_sse("content_block_delta", {
+                "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text},
+            }))
+            await asyncio.sleep(delay)
+        await response.write(_sse("content_block_stop", {"type": "content_block_stop", "index": 0}))
+        await response.write(_sse("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": len(words)},
+        }))
+        await response.write(_sse("message_stop", {"type": "message_stop"}))
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/messages", messages)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальний імітатор Anthropic Messages API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.05, help="Затримка між словами, секунди")
+    parser.add_argument("--first-token-delay", type=float, default=0.5, help="Затримка перед першим словом, секунди")
+    parser.add_argument("--answer", default=DEFAULT_ANSWER, help="Текст відповіді")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(args.answer, args.delay, args.first_token_delay), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# fake_telegram.py
+# Локальна перевірка webhook-режиму без Telegram: імітатор Bot API (приймає sendMessage,
+# editMessageText та інші виклики ботів) і генератор оновлень, що надсилає повідомлення
+# від кількох чатів на webhook. Наприкінці перевіряє, що кожен чат отримав відповіді
+# в тому ж порядку, в якому надсилав повідомлення.
+#
+# Запуск (у трьох терміналах або у фоні):
+#   python fake_anthropic_server.py --port 8765
+#   TELEGRAM_API_URL=http://127.0.0.1:8081 ANTHROPIC_BASE_URL=http://127.0.0.1:8765 python webhook_server.py
+#   python fake_telegram.py --port 8081 --webhook http://127.0.0.1:8080/webhook/default --chats 20 --messages 5
+
+import re
+import time
+import asyncio
+import argparse
+import logging
+from typing import Dict, List
+
+from aiohttp import web, ClientSession
+
+logger = logging.getLogger(__name__)
+
+# Питання, що надсилаються по черзі між командами ORDER_PROBE
+QUESTIONS = [
+    "Who are you?",
+    "What is your favourite food?",
+    "Tell me about your latest movie",
+    "Where did you grow up?",
+]
+# Команда, на яку бот відповідає привітанням з іменем користувача. Ім'я містить номер повідомлення,
+# тому за привітаннями перевіряється порядок обробки повідомлень чату
+ORDER_PROBE = "/start"
+_PROBE_NUMBER_RE = re.compile(r"#(\d+)")
+
+
+class FakeBotAPI:
+    """Імітатор методів Bot API, які викликає бот. Запам'ятовує надіслані в кожен чат повідомлення."""
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self.sent: Dict[int, List[str]] = {}
+        self._next_message_id = 1
+
+    def _message(self, chat_id: int, text: str) -> dict:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+
+        if method == "getMe":
+            token = request.match_info["token"]
+            result = {"id": int(token.split(":")[0]), "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            text = str(params.get("text", ""))
+            if method == "sendMessage":
+                self.sent.setdefault(chat_id, []).append(text)
+            result = self._message(chat_id, text)
+        else:
+            # sendChatAction, answerCallbackQuery, setWebhook, deleteWebhook тощо
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        return app
+
+
+def make_update(update_id: int, chat_id: int, number: int, text: str) -> dict:
+    name = f"Fan {chat_id} #{number}"
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": name},
+            "from": {"id": chat_id, "is_bot": False, "first_name": name, "language_code": "en"},
+            "text": text,
+        },
+    }
+
+
+async def feed_updates(webhook_url: str, chats: int, messages: int, secret: str = "") -> Dict[str, int]:
+    """
+    Надсилає messages повідомлень від кожного з chats чатів. Повідомлення чергуються:
+    питання та команда ORDER_PROBE, щоб за відповідями на команду перевірити порядок.
+    """
+    statuses: Dict[str, int] = {}
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    update_id = 1
+    async with ClientSession() as session:
+        for number in range(messages):
+            requests = []
+            for chat in range(chats):
+                chat_id = 100000 + chat
+                text = ORDER_PROBE if number % 2 else QUESTIONS[number % len(QUESTIONS)]
+                requests.append(session.post(webhook_url, json=make_update(update_id, chat_id, number, text), headers=headers))
+                update_id += 1
+            for response in await asyncio.gather(*requests):
+                statuses[str(response.status)] = statuses.get(str(response.status), 0) + 1
+                response.release()
+    return statuses
+
+
+def check_order(api: FakeBotAPI, chats: int) -> int:
+    """Кількість чатів, у яких привітання на ORDER_PROBE прийшли не в порядку повідомлень."""
+    broken = 0
+    for chat in range(chats):
+        numbers = [
+            int(match.group(1))
+            for match in (_PROBE_NUMBER_RE.search(text) for text in api.sent.get(100000 + chat, []))
+            if match
+        ]
+        if numbers != sorted(numbers):
+            broken += 1
+    return broken
+
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    logger.info(f"Імітатор Bot API слухає http://{args.host}:{args.port}")
+
+    if args.webhook:
+        started = time.monotonic()
+        statuses = await feed_updates(args.webhook, args.chats, args.messages, args.secret)
+        total = args.chats * args.messages
+        logger.info(f"Надіслано {total} оновлень за {time.monotonic() - started:.2f} с, відповіді webhook: {statuses}")
+        # Чекаємо, поки бот відповість на все
+        deadline = time.monotonic() + args.wait
+        while time.monotonic() < deadline and sum(len(v) for v in api.sent.values()) < total:
+            await asyncio.sleep(0.2)
+        replies = sum(len(v) for v in api.sent.values())
+        logger.info(f"Отримано {replies} з {total} відповідей за {time.monotonic() - started:.2f} с; виклики API: {api.calls}")
+        broken = check_order(api, args.chats)
+        logger.info("Порядок відповідей у чатах збережено." if not broken else f"Чатів з порушеним порядком: {broken}")
+        await runner.cleanup()
+    else:
+        # Лише імітатор Bot API (оновлення надсилаються іншим інструментом)
+        await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Імітатор Telegram Bot API та генератор оновлень для webhook-режиму")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--webhook", default="", help="Адреса webhook бота; порожньо - лише імітатор Bot API")
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET бота")
+    parser.add_argument("--chats", type=int, default=20, help="Кількість чатів")
+    parser.add_argument("--messages", type=int, default=5, help="Повідомлень від кожного чату")
+    parser.add_argument("--wait", type=float, default=60.0, help="Скільки секунд чекати на відповіді")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
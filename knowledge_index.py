@@ -0,0 +1,368 @@
+# knowledge_index.py
+# Збереження векторизованої бази знань на диск, щоб не перевекторизовувати її при кожному старті
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import numpy as np
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокування між процесами недоступне
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Версія формату артефакту. Збільшуйте при зміні структури файлів індексу.
+INDEX_FORMAT_VERSION = 3
+# Найстаріший формат, з якого ще можна повторно використати вектори при перебудові
+MIN_REUSABLE_FORMAT_VERSION = 2
+# Директорія для збережених індексів
+INDEX_DIR = os.getenv("KNOWLEDGE_INDEX_DIR", "index_cache")
+
+CHUNKS_FILE = "chunks.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+TOKENS_FILE = "token_counts.npy"
+META_FILE = "meta.json"
+# Файл блокування побудови індексу (спільний для процесів, що працюють з однією директорією)
+BUILD_LOCK_FILE = ".build.lock"
+
+# Підтримувані формати зберігання матриці векторів
+STORAGE_DTYPES = ("float32", "float16", "int8")
+# Скільки рядків матриці переводити у float32 за раз при оцінці стиснених форматів
+_SCORE_BLOCK_ROWS = 8192
+
+
+class EmbeddingMatrix:
+    """
+    Матриця L2-нормалізованих векторів чанків.
+    Косинусна подібність зводиться до одного добутку матриці на вектор.
+    Підтримує зберігання у float32, float16 або int8 з масштабом для кожного рядка.
+    """
+
+    def __init__(self, data: np.ndarray, scales: Optional[np.ndarray] = None):
+        """
+        Args:
+            data: Нормалізовані вектори (float32/float16) або квантизовані значення (int8)
+            scales: Масштаб кожного рядка для int8 (None для float-форматів)
+        """
+        if data.dtype == np.int8 and scales is None:
+            raise ValueError("int8 matrix requires per-row scales")
+        self.data = data
+        self.scales = scales
+
+    @classmethod
+    def from_embeddings(cls, embeddings: np.ndarray, storage_dtype: str = "float32") -> "EmbeddingMatrix":
+        """Нормалізує вектори (один раз при побудові індексу) та переводить їх у потрібний формат."""
+        if storage_dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported storage dtype: {storage_dtype}")
+
+        vectors = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        if storage_dtype == "float16":
+            return cls(vectors.astype(np.float16))
+        if storage_dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales = np.maximum(scales, 1e-12).astype(np.float32)
+            quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+            return cls(quantized, scales)
+        return cls(np.ascontiguousarray(vectors))
+
+    @property
+    def storage_dtype(self) -> str:
+        return str(self.data.dtype)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def __len__(self) -> int:
+        return int(self.data.shape[0]) if self.data.ndim == 2 else 0
+
+    def score(self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Повертає косинусну подібність запиту до кожного чанка (або лише до рядків rows), float32.
+        Вектор запиту нормалізується тут, вектори чанків - вже нормалізовані.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        if rows is not None:
+            return self.rows_float32(rows) @ query
+
+        if self.data.dtype == np.float32:
+            return self.data @ query
+
+        # Стиснені формати переводимо у float32 блоками, щоб не розпаковувати всю матрицю
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), _SCORE_BLOCK_ROWS):
+            block = self.data[start:start + _SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def rows_float32(self, indices) -> np.ndarray:
+        """Повертає вибрані рядки як нормалізовані float32-вектори (з деквантизацією для int8)."""
+        rows = np.asarray(self.data[indices], dtype=np.float32)
+        if self.scales is not None:
+            rows *= np.asarray(self.scales[indices], dtype=np.float32)[:, None]
+        return rows
+
+
+def chunk_hash(chunk: str) -> str:
+    """Хеш вмісту чанка, за яким вектори повторно використовуються між версіями бази знань."""
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest()
+
+
+class KnowledgeIndex:
+    """
+    Незмінний знімок індексу: чанки, їх хеші, матриця векторів та версія.
+    Пошук бере посилання на знімок один раз, тому заміна індексу під час
+    перезавантаження ніколи не дає розсинхронізованої пари чанки/вектори.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        chunks: List[str],
+        embeddings: EmbeddingMatrix,
+        chunk_hashes: Optional[List[str]] = None,
+        token_counts: Optional[np.ndarray] = None,
+    ):
+        if len(chunks) != len(embeddings):
+            raise ValueError(f"Chunks/embeddings mismatch: {len(chunks)} != {len(embeddings)}")
+        if token_counts is not None and len(token_counts) != len(chunks):
+            raise ValueError(f"Chunks/token counts mismatch: {len(chunks)} != {len(token_counts)}")
+        self.version = version
+        self.chunks = chunks
+        self.embeddings = embeddings
+        self.chunk_hashes = chunk_hashes if chunk_hashes is not None else [chunk_hash(chunk) for chunk in chunks]
+        # Кількість токенів кожного чанка (рахується один раз при побудові індексу)
+        self.token_counts = token_counts
+        # Бекенд семантичного пошуку (див. retrieval_backends) та лексичний BM25-індекс
+        # (див. lexical_index); підключаються до публікації індексу
+        self.backend = None
+        self.lexical = None
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def memory_bytes(self) -> int:
+        """
+        Приблизний обсяг пам'яті індексу: матриця векторів, тексти чанків та хеші,
+        бекенд пошуку та лексичний індекс (для обмеження пам'яті кількох персон).
+        """
+        total = self.embeddings.nbytes
+        if self.token_counts is not None:
+            total += self.token_counts.nbytes
+        total += sum(sys.getsizeof(chunk) for chunk in self.chunks)
+        total += sum(sys.getsizeof(h) for h in self.chunk_hashes)
+        if self.backend is not None:
+            total += self.backend.nbytes
+        if self.lexical is not None:
+            total += self.lexical.nbytes
+        return int(total)
+
+
+def compute_index_key(
+    knowledge_text: str,
+    model_name: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    storage_dtype: str = "float32",
+) -> str:
+    """
+    Обчислює ключ індексу: хеш тексту бази знань разом з параметрами моделі, розбиття
+    та формату зберігання. Будь-яка зміна цих параметрів дає новий ключ, а отже - перевекторизацію.
+    """
+    hasher = hashlib.sha256()
+    params = {
+        "format_version": INDEX_FORMAT_VERSION,
+        "model_name": model_name,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "storage_dtype": storage_dtype,
+    }
+    hasher.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    hasher.update(b"\0")
+    hasher.update(knowledge_text.encode("utf-8"))
+    return hasher.hexdigest()[:16]
+
+
+def index_path(key: str, index_dir: str = INDEX_DIR) -> str:
+    """Директорія збереженого індексу з ключем key."""
+    return os.path.join(index_dir, key)
+
+
+@contextmanager
+def index_build_lock(index_dir: str = INDEX_DIR) -> Iterator[None]:
+    """
+    Блокування побудови індексу між процесами (воркери webhook-режиму): поки один процес
+    векторизує базу знань, решта чекає і потім завантажує вже збережений індекс.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, BUILD_LOCK_FILE), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_index(key: str, index_dir: str = INDEX_DIR, min_format_version: int = INDEX_FORMAT_VERSION) -> Optional[KnowledgeIndex]:
+    """
+    Завантажує збережений індекс за ключем.
+    Матриця векторів відкривається через memory-map (лише читання).
+    Індекси старішого формату (від min_format_version) завантажуються лише як джерело векторів.
+
+    Returns:
+        Знімок індексу або None, якщо індекс відсутній/пошкоджений
+    """
+    path = index_path(key, index_dir)
+    if not os.path.isdir(path):
+        return None
+
+    try:
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        if not min_format_version <= meta.get("format_version", 0) <= INDEX_FORMAT_VERSION:
+            logger.info(f"Індекс {key} має застарілий формат {meta.get('format_version')}, буде перебудовано.")
+            return None
+
+        with open(os.path.join(path, CHUNKS_FILE), "r", encoding="utf-8") as file:
+            chunks = json.load(file)
+        data = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        scales = None
+        if data.dtype == np.int8:
+            scales = np.load(os.path.join(path, SCALES_FILE), mmap_mode="r")
+
+        if data.ndim != 2 or data.shape[0] != len(chunks):
+            logger.warning(f"Індекс {key} пошкоджено: {len(chunks)} чанків, матриця {data.shape}.")
+            return None
+
+        embeddings = EmbeddingMatrix(data, scales)
+        token_counts = None
+        tokens_path = os.path.join(path, TOKENS_FILE)
+        if os.path.exists(tokens_path):
+            token_counts = np.load(tokens_path)
+        logger.info(
+            f"Індекс {key} завантажено з диска: {len(chunks)} чанків, розмірність {data.shape}, "
+            f"формат {embeddings.storage_dtype}, {embeddings.nbytes / 1024:.0f} КБ."
+        )
+        return KnowledgeIndex(key, chunks, embeddings, token_counts=token_counts)
+    except Exception as e:
+        logger.error(f"Помилка при завантаженні індексу {key}: {e}", exc_info=True)
+        return None
+
+
+def load_latest_index(model_name: str, index_dir: str = INDEX_DIR) -> Optional[KnowledgeIndex]:
+    """
+    Завантажує найсвіжіший збережений індекс, побудований тією ж моделлю.
+    Використовується як джерело готових векторів при інкрементальній перебудові.
+    """
+    if not os.path.isdir(index_dir):
+        return None
+
+    candidates = []
+    for name in os.listdir(index_dir):
+        meta_path = os.path.join(index_dir, name, META_FILE)
+        if ".tmp-" in name or not os.path.isfile(meta_path):
+            continue
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+        except Exception:
+            continue
+        format_version = meta.get("format_version", 0)
+        if meta.get("model_name") == model_name and MIN_REUSABLE_FORMAT_VERSION <= format_version <= INDEX_FORMAT_VERSION:
+            candidates.append((meta.get("created_at", 0), name))
+
+    for _, name in sorted(candidates, reverse=True):
+        index = load_index(name, index_dir, min_format_version=MIN_REUSABLE_FORMAT_VERSION)
+        if index is not None:
+            return index
+    return None
+
+
+def save_index(
+    index: KnowledgeIndex,
+    model_name: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    index_dir: str = INDEX_DIR,
+) -> bool:
+    """
+    Зберігає чанки та нормалізовану матрицю векторів (у форматі зберігання матриці) на диск.
+    Файли пишуться в тимчасову директорію, яка потім атомарно перейменовується,
+    тому паралельний процес ніколи не побачить напівзаписаний індекс.
+    Старі індекси в тій самій директорії видаляються.
+    """
+    key, chunks, embeddings = index.version, index.chunks, index.embeddings
+    path = index_path(key, index_dir)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        with open(os.path.join(tmp_path, CHUNKS_FILE), "w", encoding="utf-8") as file:
+            json.dump(chunks, file, ensure_ascii=False)
+        np.save(os.path.join(tmp_path, EMBEDDINGS_FILE), np.ascontiguousarray(embeddings.data))
+        if embeddings.scales is not None:
+            np.save(os.path.join(tmp_path, SCALES_FILE), np.ascontiguousarray(embeddings.scales))
+        if index.token_counts is not None:
+            np.save(os.path.join(tmp_path, TOKENS_FILE), np.asarray(index.token_counts, dtype=np.int32))
+
+        meta = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "key": key,
+            "model_name": model_name,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "num_chunks": len(chunks),
+            "dim": int(embeddings.shape[1]) if len(embeddings.shape) == 2 else 0,
+            "storage_dtype": embeddings.storage_dtype,
+            "normalized": True,
+            "created_at": time.time(),
+        }
+        with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as file:
+            json.dump(meta, file, indent=2)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        logger.info(f"Індекс {key} збережено в '{path}'.")
+    except Exception as e:
+        logger.error(f"Помилка при збереженні індексу {key}: {e}", exc_info=True)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return False
+
+    _prune_old_indexes(keep=key, index_dir=index_dir)
+    return True
+
+
+def _prune_old_indexes(keep: str, index_dir: str) -> None:
+    """Видаляє застарілі індекси, залишаючи лише поточний."""
+    try:
+        for name in os.listdir(index_dir):
+            if name != keep and ".tmp-" not in name and name != BUILD_LOCK_FILE:
+                shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+                logger.info(f"Видалено застарілий індекс '{name}'.")
+    except OSError as e:
+        logger.warning(f"Не вдалося очистити старі індекси: {e}")
@@ -1,14 +1,37 @@
 # knowledge_utils.py (Версія 6 - з Semantic Search)
 
 import os
-import re
+import time
+import asyncio
+import threading
 import numpy as np
-from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
 import logging 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-# Додано імпорти для Sentence Transformers та Cosine Similarity
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+
+# Важкі залежності (torch, sentence-transformers, langchain) імпортуються
+# ліниво під час прогріву, щоб імпорт модуля нічого не завантажував.
+if TYPE_CHECKING:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from sentence_transformers import SentenceTransformer
+
+from knowledge_index import (
+    EmbeddingMatrix,
+    KnowledgeIndex,
+    STORAGE_DTYPES,
+    chunk_hash,
+    compute_index_key,
+    index_build_lock,
+    load_index,
+    load_latest_index,
+    save_index,
+)
+from encoder_batching import EncoderBatcher
+from retrieval_backends import BACKENDS, create_backend
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from query_cache import QueryCache, normalize_query
+from personas import personas, get_persona
+from metrics import time_stage, observe_stage, STAGE_EMBEDDING, STAGE_SEARCH, STAGE_CONTEXT_ASSEMBLY
 
 logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG) # Розкоментуйте для ще більш детальних логів
@@ -20,14 +43,142 @@ KNOWLEDGE_BASE_PATH = "knowledge_base.txt"
 CHUNK_SIZE = 400  # Розмір чанка в символах
 CHUNK_OVERLAP = 80 # Перекриття чанків в символах
 TOP_K = 7         # Кількість найбільш релевантних чанків для відбору
+# Формат зберігання нормалізованої матриці векторів: float32, float16 або int8
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+if EMBEDDING_STORAGE_DTYPE not in STORAGE_DTYPES:
+    logger.warning(f"Невідомий EMBEDDING_STORAGE_DTYPE '{EMBEDDING_STORAGE_DTYPE}', використовуємо float32.")
+    EMBEDDING_STORAGE_DTYPE = "float32"
+# Бекенд пошуку: exact (точний перебір) або ivf (наближений, для великих баз знань)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "exact")
+if RETRIEVAL_BACKEND not in BACKENDS:
+    logger.warning(f"Невідомий RETRIEVAL_BACKEND '{RETRIEVAL_BACKEND}', використовуємо exact.")
+    RETRIEVAL_BACKEND = "exact"
+# Параметри IVF: кількість кластерів (0 - автоматично) та скільки з них переглядати на запит
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+# Режим пошуку: hybrid (семантичний + BM25 через reciprocal rank fusion), dense або lexical
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+if RETRIEVAL_MODE not in ("hybrid", "dense", "lexical"):
+    logger.warning(f"Невідомий RETRIEVAL_MODE '{RETRIEVAL_MODE}', використовуємо hybrid.")
+    RETRIEVAL_MODE = "hybrid"
+# Оцінка кількості символів на токен, якщо токенізатор моделі недоступний
+CHARS_PER_TOKEN = 4
+# Скільки токенів займає роздільник між чанками в контексті
+CONTEXT_SEPARATOR_TOKENS = 1
+# Скільки кандидатів брати з кожного списку перед злиттям у гібридному режимі
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+# Відповідати лише лексичним пошуком, поки модель векторизації ще завантажується
+LEXICAL_FALLBACK = os.getenv("LEXICAL_FALLBACK", "1") == "1"
+# Пул потоків для векторизації запитів поза event loop бота
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "2"))
+# Скільки запитів можуть чекати на вільний потік понад RETRIEVAL_WORKERS
+RETRIEVAL_QUEUE_SIZE = int(os.getenv("RETRIEVAL_QUEUE_SIZE", "32"))
+# Мікробатчинг: скільки мс чекати на сусідні запити та максимальний розмір пакета
+ENCODE_BATCH_WINDOW_MS = float(os.getenv("ENCODE_BATCH_WINDOW_MS", "5"))
+ENCODE_MAX_BATCH_SIZE = int(os.getenv("ENCODE_MAX_BATCH_SIZE", "16"))
+# Кеш запитів: максимальна кількість записів (0 - вимкнено) та час життя запису
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+# Як часто (в секундах) перевіряти зміни файлу бази знань; 0 - лише вручну через /reload
+KNOWLEDGE_RELOAD_INTERVAL = float(os.getenv("KNOWLEDGE_RELOAD_INTERVAL", "60"))
+# Ліміт пам'яті (МБ) на індекси всіх персон; при перевищенні витісняються найдавніше використані (0 - без ліміту)
+INDEX_MEMORY_BUDGET_MB = float(os.getenv("INDEX_MEMORY_BUDGET_MB", "0"))
+
+# Глобальні змінні для зберігання моделі та спліттера (спільні для всіх персон)
+model: Optional["SentenceTransformer"] = None
+splitter: Optional["RecursiveCharacterTextSplitter"] = None
 
-# Глобальні змінні для зберігання моделі, чанків та їх векторів
-model: Optional[SentenceTransformer] = None
-knowledge_chunks: List[str] = []
-chunk_embeddings: Optional[np.ndarray] = None
+# Пул потоків та лічильник слотів черги (створюються ліниво)
+_retrieval_executor: Optional[ThreadPoolExecutor] = None
+_retrieval_slots: Optional[asyncio.Semaphore] = None
+_encoder_batcher: Optional[EncoderBatcher] = None
+
+# Стан прогріву: подія готовності моделі та блокування від одночасного прогріву
+_ready_event = threading.Event()
+_index_lock = threading.Lock()
+# Блокування обліку пам'яті індексів (витіснення при перевищенні INDEX_MEMORY_BUDGET_MB)
+_budget_lock = threading.Lock()
 # --- Кінець Констант та Глобальних Змінних ---
 
 
+class RetrievalBusyError(RuntimeError):
+    """Черга пошуку контексту переповнена, запит відхилено."""
+
+
+class RetrievedChunk:
+    """Чанк, що увійшов у контекст: хеш вмісту, текст, позиція в контексті та оцінка пошуку."""
+
+    __slots__ = ("chunk_hash", "text", "rank", "score")
+
+    def __init__(self, chunk_hash: str, text: str, rank: int, score: Optional[float]):
+        self.chunk_hash = chunk_hash
+        self.text = text
+        self.rank = rank
+        self.score = score
+
+    def as_dict(self) -> dict:
+        return {"chunk_hash": self.chunk_hash, "text": self.text, "rank": self.rank, "score": self.score}
+
+
+class RetrievedContext:
+    """Результат пошуку: готовий текст контексту та чанки, з яких його складено (для журналу)."""
+
+    def __init__(self, text: str, chunks: List[RetrievedChunk], index_version: Optional[str]):
+        self.text = text
+        self.chunks = chunks
+        self.index_version = index_version
+
+    def __bool__(self) -> bool:
+        return bool(self.text)
+
+    def chunk_dicts(self) -> List[dict]:
+        """Чанки для журналу (add_log_entry(retrieved_chunks=...)) разом з версією індексу, з якого їх узято."""
+        return [dict(chunk.as_dict(), index_version=self.index_version) for chunk in self.chunks]
+
+
+# Порожній результат пошуку (нічого не знайдено або помилка)
+EMPTY_CONTEXT = RetrievedContext("", [], None)
+
+
+class KnowledgeBase:
+    """
+    База знань однієї персони: файл, директорія збережених індексів, активний індекс
+    та кеш запитів. Модель векторизації, пул потоків і батчер спільні для всіх персон.
+    """
+
+    def __init__(self, name: str, file_path: str, index_dir: str):
+        self.name = name
+        self.file_path = file_path
+        self.index_dir = index_dir
+        # Поточний індекс (чанки + вектори + версія). Замінюється цілим об'єктом при перезавантаженні,
+        # тому пошук, що вже взяв посилання на індекс, завжди бачить узгоджену пару чанки/вектори.
+        # None - індекс ще не завантажено або витіснено через ліміт пам'яті.
+        self.active_index: Optional[KnowledgeIndex] = None
+        # Час зміни файлу бази знань, з якого побудовано active_index
+        self.knowledge_mtime: Optional[float] = None
+        # Час останнього використання індексу (для витіснення найдавніше використаних)
+        self.last_used = 0.0
+        # Кеш векторів запитів та готового контексту (скидається при зміні версії індексу)
+        self.query_cache = QueryCache(max_size=QUERY_CACHE_SIZE, ttl_seconds=QUERY_CACHE_TTL_SECONDS)
+        # Блокування від одночасної побудови індексу цієї персони
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"KnowledgeBase({self.name!r}, loaded={self.active_index is not None})"
+
+
+# Бази знань усіх персон процесу (див. personas.py)
+knowledge_bases: Dict[str, KnowledgeBase] = {
+    persona.name: KnowledgeBase(persona.name, persona.knowledge_base_path, persona.index_dir)
+    for persona in personas.values()
+}
+
+
+def get_knowledge_base(persona: Optional[str] = None) -> KnowledgeBase:
+    """Повертає базу знань персони (None - перша/єдина персона)."""
+    return knowledge_bases[get_persona(persona).name]
+
+
 def read_knowledge_base(file_path: str = KNOWLEDGE_BASE_PATH) -> str:
     """
     Читає вміст файлу бази знань.
@@ -42,15 +193,18 @@ def read_knowledge_base(file_path: str = KNOWLEDGE_BASE_PATH) -> str:
         logger.error(f"Помилка при читанні файлу бази знань: {e}")
         return ""
 
-def _initialize_splitter_and_model() -> Tuple[Optional[RecursiveCharacterTextSplitter], Optional[SentenceTransformer]]:
+def _initialize_splitter_and_model() -> Tuple[Optional["RecursiveCharacterTextSplitter"], Optional["SentenceTransformer"]]:
     """Ініціалізує спліттер та модель Sentence Transformer."""
     try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from sentence_transformers import SentenceTransformer
+
         splitter = RecursiveCharacterTextSplitter(
             chunk_size=CHUNK_SIZE,
             chunk_overlap=CHUNK_OVERLAP,
             length_function=len,
             is_separator_regex=False,
-            separators=["\n\n", "\n", ". ", ", ", " ", ""], 
+            separators=["\n\n", "\n", ". ", ", ", " ", ""],
         )
         # Завантажуємо модель один раз
         loaded_model = SentenceTransformer(MODEL_NAME)
@@ -60,131 +214,650 @@ def _initialize_splitter_and_model() -> Tuple[Optional[RecursiveCharacterTextSpl
         logger.error(f"Помилка при ініціалізації спліттера або моделі SentenceTransformer: {e}", exc_info=True)
         return None, None
 
-def _load_and_embed_knowledge():
+def _get_knowledge_mtime(file_path: str = KNOWLEDGE_BASE_PATH) -> Optional[float]:
+    try:
+        return os.path.getmtime(file_path)
+    except OSError:
+        return None
+
+def _build_index(
+    kb: KnowledgeBase, knowledge_text: str, previous: Optional[KnowledgeIndex]
+) -> Tuple[Optional[KnowledgeIndex], int]:
+    """
+    Розбиває текст на чанки та будує індекс.
+    Якщо індекс для цього тексту вже збережено на диску, він просто завантажується.
+    Інакше векторизуються лише нові або змінені чанки, а вектори решти
+    (за хешем вмісту) беруться з попереднього індексу.
+
+    Returns:
+        Кортеж (індекс або None, кількість щойно векторизованих чанків)
     """
-    Завантажує, розбиває на чанки та векторизує базу знань.
-    Виконується один раз при завантаженні модуля.
+    key = compute_index_key(knowledge_text, MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_STORAGE_DTYPE)
+    cached = load_index(key, kb.index_dir)
+    if cached is None:
+        with index_build_lock(kb.index_dir):
+            # Поки чекали на блокування, індекс міг побудувати інший процес
+            cached = load_index(key, kb.index_dir)
+            if cached is None:
+                return _build_new_index(kb, key, knowledge_text, previous)
+    _attach_backend(cached, kb.index_dir)
+    return cached, 0
+
+def _build_new_index(
+    kb: KnowledgeBase, key: str, knowledge_text: str, previous: Optional[KnowledgeIndex]
+) -> Tuple[Optional[KnowledgeIndex], int]:
+    """Векторизує та зберігає індекс, якого ще немає на диску (під index_build_lock)."""
+    chunks = splitter.split_text(knowledge_text)
+    if not chunks:
+        logger.warning(f"[{kb.name}] Розбиття тексту не дало результатів (чанків).")
+        return None, 0
+    logger.info(f"[{kb.name}] Базу знань розбито на {len(chunks)} чанків.")
+
+    hashes = [chunk_hash(chunk) for chunk in chunks]
+    previous_rows = {}
+    if previous is not None:
+        previous_rows = {h: row for row, h in enumerate(previous.chunk_hashes)}
+    reused = [i for i, h in enumerate(hashes) if h in previous_rows]
+    to_encode = [i for i, h in enumerate(hashes) if h not in previous_rows]
+
+    encoded = None
+    if to_encode:
+        logger.info(f"[{kb.name}] Векторизація {len(to_encode)} нових/змінених чанків (повторно використано {len(reused)})...")
+        encoded = np.asarray(model.encode([chunks[i] for i in to_encode], show_progress_bar=len(to_encode) > 50), dtype=np.float32)
+
+    dim = encoded.shape[1] if encoded is not None else previous.embeddings.shape[1]
+    vectors = np.empty((len(chunks), dim), dtype=np.float32)
+    if reused:
+        vectors[reused] = previous.embeddings.rows_float32([previous_rows[hashes[i]] for i in reused])
+    if encoded is not None:
+        vectors[to_encode] = encoded
+
+    # Нормалізація та підрахунок токенів виконуються один раз тут, а не на кожен запит
+    index = KnowledgeIndex(
+        key, chunks, EmbeddingMatrix.from_embeddings(vectors, EMBEDDING_STORAGE_DTYPE), hashes, _count_tokens(chunks)
+    )
+    logger.info(
+        f"[{kb.name}] Індекс {key} побудовано. Розмірність: {index.embeddings.shape}, "
+        f"формат {index.embeddings.storage_dtype}, {index.embeddings.nbytes / 1024:.0f} КБ"
+    )
+    if save_index(index, MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP, kb.index_dir):
+        # Працюємо зі збереженою копією через memory-map, як і інші процеси: сторінки матриці
+        # спільні в кеші ОС, а не окрема копія в пам'яті кожного процесу
+        index = load_index(key, kb.index_dir) or index
+    _attach_backend(index, kb.index_dir)
+    return index, len(to_encode)
+
+def _attach_backend(index: KnowledgeIndex, index_dir: str) -> None:
     """
-    global model, knowledge_chunks, chunk_embeddings 
-    
-    logger.info("Завантаження та векторизація бази знань...")
-    knowledge_text = read_knowledge_base()
-    if not knowledge_text:
-        logger.error("Не вдалося завантажити базу знань. Пошук контексту буде недоступний.")
+    Підключає до індексу налаштований бекенд пошуку та будує лексичний BM25-індекс
+    (до того, як індекс стане активним).
+    """
+    if index.backend is None:
+        index.backend = create_backend(index, RETRIEVAL_BACKEND, nlist=IVF_NLIST, nprobe=IVF_NPROBE, index_dir=index_dir)
+        logger.info(f"Бекенд пошуку для індексу {index.version}: {index.backend.name}")
+    if index.token_counts is None:
+        index.token_counts = _count_tokens(index.chunks)
+    if index.lexical is None:
+        index.lexical = BM25Index(index.chunks)
+        logger.info(f"Лексичний індекс для {index.version}: {len(index.lexical.vocabulary)} слів.")
+
+def _count_tokens(chunks: List[str]) -> np.ndarray:
+    """
+    Кількість токенів кожного чанка. Рахується токенізатором моделі векторизації
+    (SentencePiece, коректно ділить і малайський текст); без моделі - оцінка за кількістю символів.
+    """
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is not None and chunks:
+        try:
+            input_ids = tokenizer(chunks, add_special_tokens=False)["input_ids"]
+            return np.asarray([len(ids) for ids in input_ids], dtype=np.int32)
+        except Exception as e:
+            logger.warning(f"Не вдалося порахувати токени токенізатором моделі, використовуємо оцінку: {e}")
+    return np.asarray([max(1, round(len(chunk) / CHARS_PER_TOKEN)) for chunk in chunks], dtype=np.int32)
+
+def _publish_index(kb: KnowledgeBase, index: KnowledgeIndex, knowledge_mtime: Optional[float]) -> None:
+    """Робить індекс активним для персони та витісняє інші індекси, якщо перевищено ліміт пам'яті."""
+    kb.active_index = index
+    kb.knowledge_mtime = knowledge_mtime
+    kb.last_used = time.monotonic()
+    _enforce_memory_budget(keep=kb)
+
+def _enforce_memory_budget(keep: KnowledgeBase) -> None:
+    """
+    Витісняє найдавніше використані індекси інших персон, поки сумарний обсяг
+    завантажених індексів перевищує INDEX_MEMORY_BUDGET_MB. Витіснений індекс
+    залишається на диску і завантажується знову при наступному запиті до персони.
+    """
+    if INDEX_MEMORY_BUDGET_MB <= 0:
         return
+    budget = INDEX_MEMORY_BUDGET_MB * 2**20
+    with _budget_lock:
+        loaded = [(kb, kb.active_index) for kb in knowledge_bases.values() if kb.active_index is not None]
+        sizes = {kb.name: index.memory_bytes() for kb, index in loaded}
+        total = sum(sizes.values())
+        for kb, _ in sorted(loaded, key=lambda item: item[0].last_used):
+            if total <= budget:
+                break
+            if kb is keep:
+                continue
+            kb.active_index = None
+            total -= sizes[kb.name]
+            logger.info(
+                f"[{kb.name}] Індекс витіснено з пам'яті ({sizes[kb.name] / 2**20:.1f} МБ), "
+                f"завантажено {total / 2**20:.1f} з {INDEX_MEMORY_BUDGET_MB} МБ."
+            )
+        if total > budget:
+            logger.warning(f"[{keep.name}] Індекс сам по собі перевищує INDEX_MEMORY_BUDGET_MB ({total / 2**20:.1f} МБ).")
+
+def _load_persisted_index(kb: KnowledgeBase) -> bool:
+    """
+    Публікує збережений на диску індекс поточної версії бази знань персони.
+    Не потребує моделі, тому лексичний пошук працює, поки завантажується SentenceTransformer.
+    """
+    knowledge_mtime = _get_knowledge_mtime(kb.file_path)
+    knowledge_text = read_knowledge_base(kb.file_path)
+    if not knowledge_text:
+        return False
+    key = compute_index_key(knowledge_text, MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_STORAGE_DTYPE)
+    cached = load_index(key, kb.index_dir)
+    if cached is None:
+        return False
+    _attach_backend(cached, kb.index_dir)
+    _publish_index(kb, cached, knowledge_mtime)
+    return True
+
+def _load_knowledge_base(kb: KnowledgeBase) -> bool:
+    """
+    Завантажує, розбиває на чанки та векторизує базу знань персони (потрібна модель).
+    Якщо на диску вже є індекс для поточної бази знань та параметрів моделі,
+    чанки та вектори беруться з нього без повторної векторизації; з попередньої
+    версії індексу повторно використовуються вектори чанків, що не змінились.
+
+    Returns:
+        True, якщо індекс персони активний
+    """
+    with kb.lock:
+        if kb.active_index is not None:
+            return True
+        logger.info(f"[{kb.name}] Завантаження та векторизація бази знань...")
+        knowledge_mtime = _get_knowledge_mtime(kb.file_path)
+        knowledge_text = read_knowledge_base(kb.file_path)
+        if not knowledge_text:
+            logger.error(f"[{kb.name}] Не вдалося завантажити базу знань. Пошук контексту буде недоступний.")
+            return False
+        try:
+            index, _ = _build_index(kb, knowledge_text, load_latest_index(MODEL_NAME, kb.index_dir))
+        except Exception as e:
+            logger.error(f"[{kb.name}] Помилка під час розбиття або векторизації бази знань: {e}", exc_info=True)
+            return False
+        if index is None:
+            return False
+        _publish_index(kb, index, knowledge_mtime)
+        return True
+
+def _ensure_index(kb: KnowledgeBase) -> Optional[KnowledgeIndex]:
+    """
+    Повертає активний індекс персони, за потреби завантажуючи його з диска або будуючи
+    (якщо його витіснено через ліміт пам'яті чи ще не завантажено). Блокуючий виклик.
+    """
+    index = kb.active_index
+    if index is None:
+        if model is not None:
+            _load_knowledge_base(kb)
+        elif LEXICAL_FALLBACK:
+            _load_persisted_index(kb)
+        index = kb.active_index
+    kb.last_used = time.monotonic()
+    return index
+
+def _load_and_embed_knowledge():
+    """
+    Завантажує модель та індекси баз знань усіх персон. Викликається один раз через warmup().
+    Спершу публікуються збережені на диску індекси (лексичний пошук до завантаження моделі),
+    потім завантажується спільна модель і будуються індекси, яких ще немає.
+    """
+    global model, splitter
+
+    if LEXICAL_FALLBACK:
+        for kb in knowledge_bases.values():
+            if _load_persisted_index(kb):
+                logger.info(f"[{kb.name}] Лексичний пошук доступний до завершення завантаження моделі.")
+
+    loaded_splitter, loaded_model = _initialize_splitter_and_model()
 
-    splitter, loaded_model = _initialize_splitter_and_model()
-    
-    if not splitter or not loaded_model:
+    if not loaded_splitter or not loaded_model:
         logger.error("Не вдалося ініціалізувати спліттер або модель. Пошук контексту буде недоступний.")
         return
-        
+
     model = loaded_model # Зберігаємо модель глобально
+    splitter = loaded_splitter
 
-    try:
-        knowledge_chunks = splitter.split_text(knowledge_text)
-        if not knowledge_chunks:
-            logger.warning("Розбиття тексту не дало результатів (чанків).")
-            knowledge_chunks = [] # Переконуємось, що це порожній список
-            chunk_embeddings = np.array([]) # Порожній numpy масив
-            return
-            
-        logger.info(f"Базу знань розбито на {len(knowledge_chunks)} чанків.")
-        
-        # Векторизація всіх чанків
-        chunk_embeddings = model.encode(knowledge_chunks, show_progress_bar=True)
-        logger.info(f"Чанки успішно векторизовано. Розмірність: {chunk_embeddings.shape}")
+    for kb in knowledge_bases.values():
+        if kb.active_index is None:
+            _load_knowledge_base(kb)
 
-    except Exception as e:
-        logger.error(f"Помилка під час розбиття або векторизації бази знань: {e}", exc_info=True)
-        knowledge_chunks = []
-        chunk_embeddings = None # Скидаємо ембеддінги у разі помилки
+def warmup() -> bool:
+    """
+    Завантажує модель та індекси баз знань (блокуючий виклик, ідемпотентний).
+
+    Returns:
+        True, якщо модель завантажена і хоча б одна база знань готова до пошуку
+    """
+    with _index_lock:
+        if not _ready_event.is_set():
+            _load_and_embed_knowledge()
+            loaded = [kb.name for kb in knowledge_bases.values() if kb.active_index is not None and len(kb.active_index) > 0]
+            if model is not None and loaded:
+                _ready_event.set()
+                logger.info(f"Прогрів завершено, пошук контексту доступний. Завантажені індекси: {', '.join(loaded)}")
+            else:
+                logger.error("Прогрів завершився без готового індексу.")
+    return _ready_event.is_set()
+
+
+async def warmup_async() -> bool:
+    """Запускає warmup() у фоновому потоці, не блокуючи event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, warmup)
+
+
+def is_ready() -> bool:
+    """Чи завершено прогрів і чи можна виконувати пошук контексту."""
+    return _ready_event.is_set()
+
+
+def is_search_available(persona: Optional[str] = None) -> bool:
+    """Чи можна відповідати на запити персони: повний прогрів або лексичний пошук під час прогріву."""
+    if _ready_event.is_set():
+        return True
+    index = get_knowledge_base(persona).active_index
+    return LEXICAL_FALLBACK and index is not None and index.lexical is not None
+
+
+def _use_lexical_only() -> bool:
+    """Пошук без векторизації запиту: так налаштовано або модель ще не завантажена."""
+    return RETRIEVAL_MODE == "lexical" or model is None
+
+
+def reload_knowledge_base(persona: Optional[str] = None) -> dict:
+    """
+    Перечитує файл бази знань персони і перебудовує індекс (блокуючий виклик).
+    Перевекторизуються лише нові або змінені чанки. Новий індекс підміняє
+    старий одним присвоєнням, тому запити, що виконуються, не бачать напівготового стану.
+
+    Returns:
+        Словник зі статусом ('reloaded', 'unchanged', 'not_ready', 'error') та статистикою
+    """
+    kb = get_knowledge_base(persona)
+    with kb.lock:
+        if model is None or splitter is None:
+            return {"status": "not_ready"}
+
+        knowledge_mtime = _get_knowledge_mtime(kb.file_path)
+        knowledge_text = read_knowledge_base(kb.file_path)
+        if not knowledge_text:
+            return {"status": "error"}
+
+        previous = kb.active_index
+        if previous is None:
+            # Індекс витіснено з пам'яті: вектори незмінних чанків беремо з диска
+            previous = load_latest_index(MODEL_NAME, kb.index_dir)
+        try:
+            index, encoded = _build_index(kb, knowledge_text, previous)
+        except Exception as e:
+            logger.error(f"[{kb.name}] Помилка під час перезавантаження бази знань: {e}", exc_info=True)
+            return {"status": "error"}
+        if index is None:
+            return {"status": "error"}
+
+        if kb.active_index is not None and index.version == kb.active_index.version:
+            kb.knowledge_mtime = knowledge_mtime
+            logger.info(f"[{kb.name}] База знань не змінилась, індекс залишено без змін.")
+            return {"status": "unchanged", "version": index.version, "chunks": len(index)}
+
+        _publish_index(kb, index, knowledge_mtime)
+        logger.info(f"[{kb.name}] Індекс бази знань оновлено до версії {index.version}: {len(index)} чанків, векторизовано {encoded}.")
+        return {
+            "status": "reloaded",
+            "version": index.version,
+            "chunks": len(index),
+            "encoded": encoded,
+            "reused": len(index) - encoded,
+        }
 
-# --- Викликаємо функцію завантаження та векторизації при імпорті модуля ---
-_load_and_embed_knowledge()
-# --- 
 
-def find_relevant_context(query: str, max_tokens: int = 1000) -> str:
+async def reload_knowledge_base_async(persona: Optional[str] = None) -> dict:
+    """Запускає reload_knowledge_base() у фоновому потоці."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, reload_knowledge_base, persona)
+
+
+async def watch_knowledge_base(interval: float = KNOWLEDGE_RELOAD_INTERVAL) -> None:
+    """
+    Періодично перевіряє час зміни файлів баз знань і перезавантажує індекси при змінах.
+    Перевіряються лише завантажені індекси: витіснений індекс і так перебудується при наступному запиті.
+    """
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        if not is_ready():
+            continue
+        for kb in list(knowledge_bases.values()):
+            if kb.active_index is None or _get_knowledge_mtime(kb.file_path) == kb.knowledge_mtime:
+                continue
+            logger.info(f"[{kb.name}] Файл бази знань змінився, перезавантажуємо індекс...")
+            try:
+                await reload_knowledge_base_async(kb.name)
+            except Exception as e:
+                logger.error(f"[{kb.name}] Помилка автоматичного перезавантаження бази знань: {e}", exc_info=True)
+
+
+def find_relevant_context(query: str, max_tokens: int = 1000, persona: Optional[str] = None) -> str:
+    """Текст релевантного контексту (див. retrieve_context)."""
+    return retrieve_context(query, max_tokens, persona).text
+
+
+def retrieve_context(query: str, max_tokens: int = 1000, persona: Optional[str] = None) -> RetrievedContext:
     """
     Знаходить релевантні фрагменти тексту (чанки) за допомогою семантичного пошуку.
-    
+
     Args:
         query: Запит користувача
         max_tokens: Максимальна кількість токенів для фінального контексту (приблизна)
-        
+        persona: Персона, в базі знань якої шукати (None - перша/єдина)
+
     Returns:
-        Рядок з релевантним контекстом або порожній рядок, якщо нічого не знайдено/помилка
+        Контекст з переліком чанків або порожній контекст, якщо нічого не знайдено/помилка
     """
-    global model, knowledge_chunks, chunk_embeddings
     logger.info(f"--- Starting find_relevant_context for query: '{query}' ---")
 
-    # Перевірка, чи модель та вектори бази знань завантажено
-    if model is None or chunk_embeddings is None or chunk_embeddings.size == 0 or not knowledge_chunks:
+    kb = get_knowledge_base(persona)
+    index = _ensure_index(kb)
+    if not _can_search(index, query):
+        return EMPTY_CONTEXT
+
+    if _use_lexical_only():
+        return _search_context(index, query, None, max_tokens)
+
+    cache_key = normalize_query(query)
+    version = index.version
+    cached_context = kb.query_cache.get_context(cache_key, max_tokens, version)
+    if cached_context is not None:
+        logger.info("Контекст знайдено в кеші запитів.")
+        return cached_context
+
+    query_embedding = kb.query_cache.get_embedding(cache_key, version)
+    if query_embedding is None:
+        try:
+            # 1. Векторизація запиту
+            with time_stage(STAGE_EMBEDDING):
+                query_embedding = model.encode(query)
+        except Exception as e:
+            logger.error(f"Помилка під час векторизації запиту: {e}", exc_info=True)
+            return EMPTY_CONTEXT
+
+    context = _search_context(index, query, query_embedding, max_tokens)
+    kb.query_cache.put(cache_key, version, embedding=query_embedding, max_tokens=max_tokens, context=context)
+    return context
+
+
+def _can_search(index: Optional[KnowledgeIndex], query: str) -> bool:
+    """
+    Перевіряє, чи індекс бази знань завантажено і чи запит не порожній.
+    Без моделі пошук можливий лише лексичний (якщо дозволено LEXICAL_FALLBACK).
+    """
+    if index is None or len(index) == 0 or (model is None and not (LEXICAL_FALLBACK and index.lexical is not None)):
         logger.error("Модель або вектори бази знань не ініціалізовані. Неможливо виконати пошук.")
-        return ""
+        return False
         
     if not query:
         logger.warning("Query is empty, returning empty context.")
-        return ""
+        return False
+    return True
+
+
+def _encode_queries(queries: List[str]) -> np.ndarray:
+    """Векторизує список запитів одним викликом моделі (використовується батчером)."""
+    return model.encode(queries)
+
+
+def _rank_chunks(
+    index: KnowledgeIndex, query: str, query_embedding: Optional[np.ndarray], k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Відбирає топ-K чанків: семантично через бекенд пошуку, лексично через BM25
+    або гібридно (обидва списки кандидатів зливаються reciprocal rank fusion).
+    """
+    if query_embedding is None:
+        return index.lexical.search(query, k)
+    if RETRIEVAL_MODE == "dense":
+        return index.backend.search(query_embedding, k)
 
+    candidates = max(k, HYBRID_CANDIDATES)
+    dense_indices, _ = index.backend.search(query_embedding, candidates)
+    lexical_indices, _ = index.lexical.search(query, candidates)
+    return reciprocal_rank_fusion([dense_indices, lexical_indices], k)
+
+
+def _search_context(
+    index: KnowledgeIndex, query: str, query_embedding: Optional[np.ndarray], max_tokens: int = 1000
+) -> RetrievedContext:
+    """
+    Відбирає топ-K чанків та формує з них контекст.
+
+    Args:
+        index: Знімок індексу, взятий на початку пошуку
+        query: Текст запиту (для лексичного пошуку)
+        query_embedding: Вектор запиту (None - лише лексичний пошук)
+        max_tokens: Максимальна кількість токенів для фінального контексту (за токенізатором моделі векторизації)
+
+    Returns:
+        Контекст з переліком чанків або порожній контекст, якщо нічого не знайдено/помилка
+    """
     try:
-        # 1. Векторизація запиту
-        query_embedding = model.encode(query)
-        
-        # 2. Обчислення косинусної подібності
-        # cosine_similarity очікує 2D масиви
-        similarities = cosine_similarity(query_embedding.reshape(1, -1), chunk_embeddings)[0] 
-        
-        # 3. Відбір топ-K індексів
-        # argsort повертає індекси, які б відсортували масив. Беремо останні K для найбільших значень.
-        # Використовуємо partition замість argsort для ефективності, якщо K << N
-        # top_k_indices = np.argsort(similarities)[-TOP_K:][::-1] # Варіант з argsort
-        
-        # Варіант з partition: знаходить K найбільших значень без повного сортування
-        k_to_consider = min(TOP_K, len(knowledge_chunks)) # K не може бути більшим за кількість чанків
+        # 2-3. Оцінка чанків та відбір топ-K: семантичний бекенд (точний або IVF),
+        # BM25 або їх злиття залежно від RETRIEVAL_MODE
+        k_to_consider = min(TOP_K, len(index)) # K не може бути більшим за кількість чанків
         if k_to_consider <= 0:
             logger.warning("k_to_consider is zero or negative.")
-            return ""
+            return EMPTY_CONTEXT
 
-        # Знаходимо індекси K найбільших елементів
-        top_k_indices = np.argpartition(similarities, -k_to_consider)[-k_to_consider:]
-        # Сортуємо ці K індексів за спаданням їх подібності
-        top_k_indices = top_k_indices[np.argsort(similarities[top_k_indices])[::-1]]
+        with time_stage(STAGE_SEARCH):
+            top_k_indices, top_k_scores = _rank_chunks(index, query, query_embedding, k_to_consider)
 
         logger.debug(f"Top {k_to_consider} chunk indices: {top_k_indices}")
-        logger.debug(f"Top {k_to_consider} similarities: {similarities[top_k_indices]}")
-
-        # 4. Формування контексту з топ-K чанків
-        context = ""
-        current_word_count = 0 
-        max_word_limit = int(max_tokens * 0.75) # Ліміт слів
-
-        for i in top_k_indices:
-            chunk = knowledge_chunks[i]
-            score = similarities[i] # Оцінка подібності
-            chunk_word_count = len(chunk.split())
-            
-            logger.debug(f"Considering chunk {i} score={score:.4f}. Context words: {current_word_count}, Chunk words: {chunk_word_count}, Limit: {max_word_limit}")
-            
-            # Перевірка ліміту слів
-            if (current_word_count + chunk_word_count + 1) <= max_word_limit:
-                if context: 
-                    context += "\n\n" 
-                context += chunk
-                current_word_count += chunk_word_count + (1 if context else 0) 
-                logger.debug(f"Added chunk {i}. Total words ~ {current_word_count}")
+        logger.debug(f"Top {k_to_consider} similarities: {top_k_scores}")
+
+        # 4. Формування контексту з топ-K чанків за попередньо порахованою кількістю токенів:
+        # чанк, що не вміщується в ліміт, пропускається, а менші чанки нижче за рейтингом ще можуть увійти
+        assembly_started = time.perf_counter()
+        selected = []
+        current_token_count = 0
+        for i, score in zip(top_k_indices, top_k_scores):
+            chunk_token_count = int(index.token_counts[i]) + (CONTEXT_SEPARATOR_TOKENS if selected else 0)
+            if current_token_count + chunk_token_count <= max_tokens:
+                selected.append(RetrievedChunk(index.chunk_hashes[i], index.chunks[i], len(selected), float(score)))
+                current_token_count += chunk_token_count
+                logger.debug(f"Added chunk {i} score={score:.4f}. Total tokens {current_token_count}/{max_tokens}")
             else:
-                logger.debug(f"Word limit ({max_word_limit}) reached based on chunk {i} score {score:.4f}. Breaking loop. Current words ~ {current_word_count}")
-                break 
-                
+                logger.debug(f"Skipped chunk {i} score={score:.4f}: {chunk_token_count} tokens do not fit ({current_token_count}/{max_tokens})")
+        context = "\n\n".join(chunk.text for chunk in selected)
+        observe_stage(STAGE_CONTEXT_ASSEMBLY, time.perf_counter() - assembly_started)
+
         if not context:
-             logger.warning(f"Final context is empty after attempting to build it!")
+             logger.warning("Final context is empty after attempting to build it!")
         else:
-             logger.info(f"Final context length (chars): {len(context)}, Estimated words: {current_word_count}")
+             logger.info(f"Final context length (chars): {len(context)}, tokens: {current_token_count}, chunks: {len(selected)}")
 
-        logger.info(f"--- Ending find_relevant_context ---")
-        return context
+        logger.info("--- Ending find_relevant_context ---")
+        return RetrievedContext(context, selected, index.version)
 
     except Exception as e:
         logger.error(f"Помилка під час семантичного пошуку: {e}", exc_info=True)
-        return "" # Повертаємо порожній рядок у разі помилки
\ No newline at end of file
+        return EMPTY_CONTEXT # Повертаємо порожній рядок у разі помилки
+
+
+def _get_retrieval_executor() -> ThreadPoolExecutor:
+    """Повертає (створюючи при потребі) пул потоків для пошуку контексту."""
+    global _retrieval_executor
+    if _retrieval_executor is None:
+        _retrieval_executor = ThreadPoolExecutor(
+            max_workers=max(1, RETRIEVAL_WORKERS),
+            thread_name_prefix="retrieval",
+        )
+    return _retrieval_executor
+
+
+async def find_relevant_context_async(query: str, max_tokens: int = 1000, persona: Optional[str] = None) -> str:
+    """Асинхронна версія find_relevant_context (див. retrieve_context_async)."""
+    return (await retrieve_context_async(query, max_tokens, persona)).text
+
+
+async def retrieve_context_async(query: str, max_tokens: int = 1000, persona: Optional[str] = None) -> RetrievedContext:
+    """
+    Асинхронна версія retrieve_context.
+
+    Векторизація запиту (пакетами через EncoderBatcher) та обчислення подібності виконуються
+    в обмеженому пулі потоків, тому event loop бота не блокується. Одночасно в роботі та в черзі може бути не більше
+    RETRIEVAL_WORKERS + RETRIEVAL_QUEUE_SIZE запитів, решта відхиляється.
+
+    Raises:
+        RetrievalBusyError: якщо черга пошуку переповнена
+    """
+    global _retrieval_slots
+    if _retrieval_slots is None:
+        _retrieval_slots = asyncio.Semaphore(max(1, RETRIEVAL_WORKERS) + max(0, RETRIEVAL_QUEUE_SIZE))
+
+    if _retrieval_slots.locked():
+        logger.warning(f"Черга пошуку контексту переповнена, запит відхилено: '{query}'")
+        raise RetrievalBusyError("Retrieval queue is full")
+
+    async with _retrieval_slots:
+        logger.info(f"--- Starting find_relevant_context_async for query: '{query}' ---")
+        loop = asyncio.get_running_loop()
+        kb = get_knowledge_base(persona)
+        index = kb.active_index
+        if index is None:
+            # Індекс персони ще не завантажено або витіснено: завантажуємо поза пулом пошуку,
+            # щоб побудова індексу не займала потоки векторизації запитів
+            index = await loop.run_in_executor(None, _ensure_index, kb)
+        kb.last_used = time.monotonic()
+        if not _can_search(index, query):
+            return EMPTY_CONTEXT
+
+        if _use_lexical_only():
+            # Результат не кешуємо: після завантаження моделі відповідь має бути гібридною
+            return await loop.run_in_executor(_get_retrieval_executor(), _search_context, index, query, None, max_tokens)
+
+        cache_key = normalize_query(query)
+        version = index.version
+        cached_context = kb.query_cache.get_context(cache_key, max_tokens, version)
+        if cached_context is not None:
+            logger.info("Контекст знайдено в кеші запитів.")
+            return cached_context
+
+        query_embedding = kb.query_cache.get_embedding(cache_key, version)
+        if query_embedding is None:
+            try:
+                # Вектор запиту рахується пакетом разом з іншими одночасними запитами
+                with time_stage(STAGE_EMBEDDING):
+                    query_embedding = await _get_encoder_batcher().encode(query)
+            except Exception as e:
+                logger.error(f"Помилка під час векторизації запиту: {e}", exc_info=True)
+                return EMPTY_CONTEXT
+
+        context = await loop.run_in_executor(
+            _get_retrieval_executor(), _search_context, index, query, query_embedding, max_tokens
+        )
+        kb.query_cache.put(cache_key, version, embedding=query_embedding, max_tokens=max_tokens, context=context)
+        return context
+
+
+def get_index_version(persona: Optional[str] = None) -> Optional[str]:
+    """Версія активного індексу бази знань персони (None, якщо індекс не завантажено)."""
+    index = get_knowledge_base(persona).active_index
+    return index.version if index is not None else None
+
+
+async def embed_query_async(query: str, persona: Optional[str] = None) -> Optional[np.ndarray]:
+    """
+    Вектор запиту (з кешу запитів персони або через батчер). Збережений вектор потім
+    повторно використовується find_relevant_context_async, тому запит не векторизується двічі.
+
+    Returns:
+        Вектор або None, якщо модель ще не завантажена чи сталася помилка
+    """
+    if model is None or not query:
+        return None
+    kb = get_knowledge_base(persona)
+    index = kb.active_index
+    cache_key = normalize_query(query)
+    if index is not None:
+        query_embedding = kb.query_cache.get_embedding(cache_key, index.version)
+        if query_embedding is not None:
+            return query_embedding
+    try:
+        with time_stage(STAGE_EMBEDDING):
+            query_embedding = await _get_encoder_batcher().encode(query)
+    except Exception as e:
+        logger.error(f"Помилка під час векторизації запиту: {e}", exc_info=True)
+        return None
+    if index is not None:
+        kb.query_cache.put(cache_key, index.version, embedding=query_embedding)
+    return query_embedding
+
+
+async def encode_texts_async(texts: List[str]) -> Optional[np.ndarray]:
+    """Векторизує список текстів одним викликом моделі в пулі пошуку (None, якщо модель не готова)."""
+    if model is None:
+        return None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_retrieval_executor(), _encode_queries, texts)
+
+
+def _get_encoder_batcher() -> EncoderBatcher:
+    """Повертає (створюючи при потребі) батчер векторизації запитів."""
+    global _encoder_batcher
+    if _encoder_batcher is None:
+        _encoder_batcher = EncoderBatcher(
+            _encode_queries,
+            executor=_get_retrieval_executor(),
+            batch_window_ms=ENCODE_BATCH_WINDOW_MS,
+            max_batch_size=ENCODE_MAX_BATCH_SIZE,
+        )
+    return _encoder_batcher
+
+
+def get_query_cache_stats(persona: Optional[str] = None) -> dict:
+    """Метрики кешу запитів персони (влучання, промахи, витіснення)."""
+    return get_knowledge_base(persona).query_cache.get_stats()
+
+
+def get_index_memory_stats() -> dict:
+    """Які індекси персон завантажені та скільки пам'яті вони займають (МБ)."""
+    stats = {}
+    for kb in knowledge_bases.values():
+        index = kb.active_index
+        stats[kb.name] = {
+            "loaded": index is not None,
+            "version": index.version if index is not None else None,
+            "memory_mb": round(index.memory_bytes() / 2**20, 2) if index is not None else 0.0,
+        }
+    return stats
+
+
+def get_encoder_stats() -> dict:
+    """Метрики мікробатчингу векторизації запитів (розміри пакетів тощо)."""
+    return _encoder_batcher.get_stats() if _encoder_batcher is not None else {}
+
+
+def shutdown_retrieval_executor() -> None:
+    """Зупиняє пул потоків пошуку (викликається при завершенні роботи бота)."""
+    global _retrieval_executor, _encoder_batcher
+    if _encoder_batcher is not None:
+        _encoder_batcher.close()
+        _encoder_batcher = None
+    if _retrieval_executor is not None:
+        _retrieval_executor.shutdown(wait=False, cancel_futures=True)
+        _retrieval_executor = None
@@ -0,0 +1,110 @@
+# lexical_index.py
+# Лексичний пошук BM25 по чанках бази знань (точні імена, назви фільмів, дати) та злиття з семантичним пошуком
+
+import re
+import logging
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Розбиває текст на слова без урахування регістру (працює для EN/MS та цифр у датах)."""
+    return _TOKEN_RE.findall(text.casefold())
+
+
+class BM25Index:
+    """
+    Інвертований індекс BM25. Ваги BM25 для кожної пари (слово, чанк) обчислюються
+    при побудові, тому оцінка запиту - це лише сума ваг зі списків його слів.
+    """
+
+    def __init__(self, chunks: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            chunks: Тексти чанків (номер чанка = номер рядка в індексі)
+            k1: Насичення частоти слова
+            b: Вплив довжини чанка
+        """
+        self.num_docs = len(chunks)
+        self.vocabulary: Dict[str, int] = {}
+
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        term_freqs: List[int] = []
+        doc_lengths = np.zeros(self.num_docs, dtype=np.float32)
+
+        for doc_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            doc_lengths[doc_id] = len(tokens)
+            for term, freq in Counter(tokens).items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+
+        term_ids_arr = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids_arr, kind="stable")
+        term_ids_arr = term_ids_arr[order]
+        docs = np.asarray(doc_ids, dtype=np.int64)[order]
+        tf = np.asarray(term_freqs, dtype=np.float32)[order]
+
+        doc_freq = np.bincount(term_ids_arr, minlength=len(self.vocabulary)).astype(np.float32)
+        idf = np.log1p((self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_length = float(doc_lengths.mean()) if self.num_docs else 0.0
+        length_norm = k1 * (1 - b + b * doc_lengths[docs] / max(avg_length, 1e-9))
+
+        # Списки (postings) у форматі CSR: для слова t - posting_docs[offsets[t]:offsets[t + 1]]
+        self.offsets = np.concatenate([[0], np.cumsum(doc_freq)]).astype(np.int64)
+        self.posting_docs = docs
+        self.posting_weights = (idf[term_ids_arr] * tf * (k1 + 1) / (tf + length_norm)).astype(np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        """Приблизний обсяг пам'яті індексу (масиви postings та словник)."""
+        vocabulary_bytes = sum(len(term) + 80 for term in self.vocabulary)
+        return int(self.offsets.nbytes + self.posting_docs.nbytes + self.posting_weights.nbytes + vocabulary_bytes)
+
+    def score(self, query: str) -> np.ndarray:
+        """Повертає BM25-оцінку кожного чанка для запиту (нулі для чанків без збігів)."""
+        term_ids = {self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary}
+        if not term_ids:
+            return np.zeros(self.num_docs, dtype=np.float32)
+        docs = np.concatenate([self.posting_docs[self.offsets[t]:self.offsets[t + 1]] for t in term_ids])
+        weights = np.concatenate([self.posting_weights[self.offsets[t]:self.offsets[t + 1]] for t in term_ids])
+        return np.bincount(docs, weights=weights, minlength=self.num_docs).astype(np.float32)
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            Кортеж (індекси чанків, BM25-оцінки) за спаданням; лише чанки з хоча б одним збігом
+        """
+        scores = self.score(query)
+        matched = np.flatnonzero(scores)
+        if len(matched) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        k = min(k, len(matched))
+        top = matched[np.argpartition(scores[matched], -k)[-k:]]
+        top = top[np.argsort(scores[top])[::-1]]
+        return top, scores[top]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], k: int, rrf_k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Зливає кілька ранжованих списків чанків: оцінка = сума 1 / (rrf_k + позиція) по списках.
+
+    Returns:
+        Кортеж (індекси чанків, RRF-оцінки) за спаданням, не більше k елементів
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1.0 / (rrf_k + rank + 1)
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return (
+        np.asarray([doc_id for doc_id, _ in best], dtype=np.int64),
+        np.asarray([score for _, score in best], dtype=np.float32),
+    )
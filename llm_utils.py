@@ -2,11 +2,25 @@ import os
 import logging
 import time
 import asyncio
-from typing import Optional, Dict, Any, Union
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional, Dict, Any, Union
 
-from anthropic import AsyncAnthropic, AuthenticationError, APIError, RateLimitError
+import httpx
+from anthropic import AsyncAnthropic, AuthenticationError, APIError, RateLimitError, DefaultAsyncHttpxClient
 from anthropic.types import MessageParam
 
+from metrics import (
+    timed_stage,
+    record_llm_failure,
+    STAGE_LLM,
+    LLM_FAILURE_UNAVAILABLE,
+    LLM_FAILURE_QUEUE_TIMEOUT,
+    LLM_FAILURE_RATE_LIMITED,
+    LLM_FAILURE_AUTH,
+    LLM_FAILURE_API_ERROR,
+    LLM_FAILURE_UNEXPECTED,
+)
+
 # Налаштування логування
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,32 +29,234 @@ logger = logging.getLogger(__name__)
 MAX_RETRIES = 5
 # Базова затримка для експоненціального відступу (в секундах)
 BASE_DELAY = 1
+# Скільки запитів до Anthropic API може виконуватись одночасно в процесі
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Скільки секунд запит може чекати на вільний слот, перш ніж отримати відмову
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Пул HTTP-з'єднань спільного клієнта: максимум з'єднань, скільки тримати відкритими та як довго
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", str(max(LLM_MAX_CONCURRENCY, 1) * 2)))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", str(max(LLM_MAX_CONCURRENCY, 1))))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+# Таймаут одного запиту до API (в секундах) та окремо - на встановлення з'єднання
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+
+# Позначати системний промпт для кешування префікса на боці провайдера (prompt caching)
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "1") == "1"
+
+# Правила, що додаються до інструкцій персони в системному промпті
+RULES_PROMPT = """
+    Важливі правила:
+    1. Базуй свою відповідь ВИКЛЮЧНО на інформації, наданій у контексті нижче.
+    2. Якщо в контексті немає відповіді на запитання, чесно визнай це.
+    3. НІКОЛИ не вигадуй інформацію.
+    4. Відповідай мовою запиту користувача.
+    """
+
+# Спільний клієнт (створюється при старті бота, закривається при завершенні)
+_client: Optional[AsyncAnthropic] = None
+# Обмежувач одночасних запитів до API (створюється ліниво в event loop бота)
+_llm_slots: Optional[asyncio.Semaphore] = None
+# До якого моменту (time.monotonic) всі запити чекають після відповіді 429 від API
+_rate_limited_until = 0.0
+
+
+class LLMStats:
+    """Лічильники використання спільної ємності LLM: черга, одночасні запити, повтори."""
+
+    def __init__(self):
+        self.api_calls_total = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.waiting = 0
+        self.queue_wait_seconds_total = 0.0
+        self.queue_wait_seconds_max = 0.0
+        self.queue_timeouts = 0
+        self.rate_limited = 0
+        self.retries = 0
+        # Токени запитів: звичайні вхідні, прочитані з кешу префікса, записані в кеш, вихідні
+        self.input_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.output_tokens = 0
+        self.cache_hits = 0
+
+    def record_wait(self, seconds: float) -> None:
+        self.api_calls_total += 1
+        self.queue_wait_seconds_total += seconds
+        self.queue_wait_seconds_max = max(self.queue_wait_seconds_max, seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "api_calls_total": self.api_calls_total,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "waiting": self.waiting,
+            "avg_queue_wait_seconds": self.queue_wait_seconds_total / self.api_calls_total if self.api_calls_total else 0.0,
+            "max_queue_wait_seconds": self.queue_wait_seconds_max,
+            "queue_timeouts": self.queue_timeouts,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "input_tokens": self.input_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_hits": self.cache_hits,
+        }
+
+
+llm_stats = LLMStats()
 
 
 async def initialize_anthropic_client() -> Optional[AsyncAnthropic]:
     """
-    Ініціалізує клієнт Anthropic з API-ключем зі змінних оточення.
+    Повертає спільний клієнт Anthropic, створюючи його при першому виклику.
+    Клієнт тримає пул HTTP-з'єднань, тому відповіді не платять за нове з'єднання та TLS-рукостискання.
     
     Returns:
         Клієнт AsyncAnthropic або None, якщо API-ключ не знайдено
     """
+    global _client
+    if _client is not None:
+        return _client
+
     api_key = os.getenv("ANTHROPIC_API_KEY")
     if not api_key or api_key == "your_anthropic_api_key_here":
         logger.warning(
             "Валідний ANTHROPIC_API_KEY не знайдено в змінних середовища. Функціональність LLM недоступна."
         )
         return None
-    
-    return AsyncAnthropic(api_key=api_key)
 
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+    # Повтори виконує generate_response з урахуванням спільного ліміту, тому вбудовані повтори SDK вимкнено
+    _client = AsyncAnthropic(api_key=api_key, http_client=http_client, max_retries=0)
+    logger.info(
+        f"Клієнт Anthropic створено: до {LLM_MAX_CONCURRENCY} одночасних запитів, "
+        f"пул з'єднань {LLM_MAX_CONNECTIONS} (keep-alive {LLM_MAX_KEEPALIVE_CONNECTIONS})."
+    )
+    return _client
+
+
+async def close_anthropic_client() -> None:
+    """Закриває спільний клієнт та його пул з'єднань (викликається при завершенні роботи бота)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+        logger.info("Клієнт Anthropic закрито.")
+
+
+def _get_llm_slots() -> asyncio.Semaphore:
+    global _llm_slots
+    if _llm_slots is None:
+        _llm_slots = asyncio.Semaphore(max(1, LLM_MAX_CONCURRENCY))
+    return _llm_slots
+
+
+async def _acquire_llm_slot() -> bool:
+    """
+    Чекає на вільний слот для запиту до API (не довше LLM_QUEUE_TIMEOUT) та на завершення
+    спільної паузи після rate limit.
+
+    Returns:
+        True, якщо слот отримано (його треба звільнити через _release_llm_slot)
+    """
+    slots = _get_llm_slots()
+    started = time.monotonic()
+    llm_stats.waiting += 1
+    try:
+        # Після 429 решта запитів не б'є в API, доки не мине пауза (слоти при цьому не займаються)
+        pause = _rate_limited_until - time.monotonic()
+        while pause > 0:
+            await asyncio.sleep(pause)
+            pause = _rate_limited_until - time.monotonic()
+        await asyncio.wait_for(slots.acquire(), timeout=LLM_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        llm_stats.queue_timeouts += 1
+        logger.warning(f"Запит до LLM не дочекався вільного слоту за {LLM_QUEUE_TIMEOUT} с.")
+        return False
+    finally:
+        llm_stats.waiting -= 1
 
+    llm_stats.record_wait(time.monotonic() - started)
+    llm_stats.in_flight += 1
+    llm_stats.max_in_flight = max(llm_stats.max_in_flight, llm_stats.in_flight)
+    return True
+
+
+def _release_llm_slot() -> None:
+    llm_stats.in_flight -= 1
+    _get_llm_slots().release()
+
+
+def _retry_delay(error: RateLimitError, attempt: int) -> float:
+    """Затримка перед повтором: заголовок retry-after від API або експоненціальний відступ."""
+    delay = BASE_DELAY * (2 ** (attempt - 1))
+    try:
+        retry_after = float(error.response.headers.get("retry-after", ""))
+        delay = max(delay, retry_after)
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return delay
+
+
+@lru_cache(maxsize=32)
+def build_system_prompt(persona_instructions: str) -> Union[str, List[Dict[str, Any]]]:
+    """
+    Збирає системний промпт з інструкцій персони та правил. Результат кешується, тому
+    префікс запиту байт-у-байт однаковий між запитами. З PROMPT_CACHE_ENABLED блок
+    позначається cache_control, і провайдер читає його з кешу замість повторної обробки.
+    """
+    system_prompt = f"""
+    {persona_instructions}
+    {RULES_PROMPT}"""
+    if not PROMPT_CACHE_ENABLED:
+        return system_prompt
+    return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+
+
+def _record_usage(response: Any) -> None:
+    """Записує використання токенів запиту, зокрема прочитані з кешу префікса та записані в нього."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    llm_stats.input_tokens += usage.input_tokens or 0
+    llm_stats.output_tokens += usage.output_tokens or 0
+    llm_stats.cache_read_tokens += cache_read
+    llm_stats.cache_write_tokens += cache_write
+    if cache_read:
+        llm_stats.cache_hits += 1
+    logger.info(
+        f"Токени запиту: вхідні {usage.input_tokens}, з кешу {cache_read}, "
+        f"записано в кеш {cache_write}, вихідні {usage.output_tokens}."
+    )
+
+
+def get_llm_stats() -> Dict[str, Any]:
+    """Метрики спільного клієнта LLM: очікування в черзі, одночасні запити, rate limit."""
+    return llm_stats.as_dict()
+
+
+# Тривалість етапу LLM включає очікування слота та паузи між повторами після RateLimitError
+@timed_stage(STAGE_LLM)
 async def generate_response(
     query: str, 
     context: str, 
-    persona_instructions: str,
+    persona_instructions: str = "",
     max_tokens: int = 1000,
-    model: str = "claude-3-5-sonnet-20240620"
-) -> str:
+    model: str = "claude-3-5-sonnet-20240620",
+    on_text: Optional[Callable[[str], Awaitable[None]]] = None,
+    system_prompt: Optional[Union[str, List[Dict[str, Any]]]] = None,
+) -> Optional[str]:
     """
     Генерує відповідь від Claude на основі запиту користувача, контексту та інструкцій персони.
     
@@ -50,24 +266,26 @@ async def generate_response(
         persona_instructions: Інструкції щодо стилю спілкування зірки
         max_tokens: Максимальна кількість токенів для відповіді
         model: Назва моделі Claude для використання
+        on_text: Якщо задано, відповідь генерується потоково і ця корутина викликається
+            для кожного нового фрагмента тексту (для поступового показу в Telegram)
+        system_prompt: Готовий системний промпт (див. prompt_assets); якщо не задано,
+            збирається з persona_instructions
         
     Returns:
-        Згенерована відповідь або повідомлення про помилку
+        Згенерована відповідь або None, якщо відповідь отримати не вдалося (перевантаження,
+        помилка API, аутентифікації тощо; причина логується). Текст помилки для користувача
+        обирає викликач, тому помилка не потрапляє в журнал і кеш як відповідь.
     """
+    global _rate_limited_until
     client = await initialize_anthropic_client()
     if not client:
-        return "На жаль, сервіс відповідей тимчасово недоступний. Спробуйте пізніше."
-    
-    # Формування системного промпту
-    system_prompt = f"""
-    {persona_instructions}
+        record_llm_failure(LLM_FAILURE_UNAVAILABLE)
+        return None
     
-    Важливі правила:
-    1. Базуй свою відповідь ВИКЛЮЧНО на інформації, наданій у контексті нижче.
-    2. Якщо в контексті немає відповіді на запитання, чесно визнай це.
-    3. НІКОЛИ не вигадуй інформацію.
-    4. Відповідай мовою запиту користувача.
-    """
+    # Системний промпт (інструкції персони + правила) - незмінний префікс, який кешується провайдером;
+    # контекст та запитання, що змінюються з кожним запитом, ідуть після нього
+    if system_prompt is None:
+        system_prompt = build_system_prompt(persona_instructions)
     
     # Формування основного промпту
     user_message = f"""
@@ -78,11 +296,16 @@ async def generate_response(
     Запитання користувача: {query}
     """
     
-    # Спроба отримати відповідь з експоненціальною затримкою при помилках
+    # Спроба отримати відповідь з експоненціальною затримкою при помилках.
+    # Слот спільного ліміту тримається лише на час запиту і звільняється на час затримки,
+    # а пауза після 429 застосовується до всіх запитів процесу, а не лише до цього.
     retries = 0
     while retries <= MAX_RETRIES:
+        if not await _acquire_llm_slot():
+            record_llm_failure(LLM_FAILURE_QUEUE_TIMEOUT)
+            return None
         try:
-            response = await client.messages.create(
+            request = dict(
                 model=model,
                 max_tokens=max_tokens,
                 system=system_prompt,
@@ -90,29 +313,48 @@ async def generate_response(
                     MessageParam(role="user", content=user_message)
                 ]
             )
-            return response.content[0].text
+            if on_text is None:
+                response = await client.messages.create(**request)
+                _record_usage(response)
+                return response.content[0].text
+
+            async with client.messages.stream(**request) as stream:
+                async for text in stream.text_stream:
+                    await on_text(text)
+                response = await stream.get_final_message()
+            _record_usage(response)
+            return "".join(block.text for block in response.content if block.type == "text")
             
         except RateLimitError as e:
+            llm_stats.rate_limited += 1
             retries += 1
             if retries > MAX_RETRIES:
                 logger.error(f"Перевищено ліміт спроб після помилки RateLimitError: {e}")
-                return "На жаль, сервіс перевантажений. Будь ласка, спробуйте пізніше."
+                record_llm_failure(LLM_FAILURE_RATE_LIMITED)
+                return None
             
-            # Експоненціальна затримка
-            delay = BASE_DELAY * (2 ** (retries - 1))
+            # Експоненціальна затримка (або retry-after від API), спільна для всіх запитів
+            delay = _retry_delay(e, retries)
+            _rate_limited_until = max(_rate_limited_until, time.monotonic() + delay)
+            llm_stats.retries += 1
             logger.warning(f"RateLimitError: затримка на {delay} секунд перед повторною спробою {retries}/{MAX_RETRIES}")
-            await asyncio.sleep(delay)
             
         except AuthenticationError as e:
             logger.error(f"Помилка аутентифікації Anthropic API: {e}")
-            return "На жаль, виникла проблема з аутентифікацією до сервісу відповідей. Зверніться до адміністратора."
+            record_llm_failure(LLM_FAILURE_AUTH)
+            return None
             
         except APIError as e:
             logger.error(f"Помилка Anthropic API: {e}")
-            return "На жаль, виникла помилка при обробці вашого запиту. Спробуйте пізніше."
+            record_llm_failure(LLM_FAILURE_API_ERROR)
+            return None
             
         except Exception as e:
             logger.error(f"Неочікувана помилка при генерації відповіді: {e}")
-            return "На жаль, виникла неочікувана помилка. Спробуйте пізніше."
+            record_llm_failure(LLM_FAILURE_UNEXPECTED)
+            return None
+
+        finally:
+            _release_llm_slot()
     
-    return "На жаль, сервіс відповідей тимчасово недоступний. Спробуйте пізніше."
\ No newline at end of file
+    return None
@@ -0,0 +1,291 @@
+# log_retention.py
+# Зберігання журналу розмов: записи, старші за LOG_RETENTION_DAYS, переносяться в стиснуті
+# помісячні архіви (JSON Lines + gzip) і видаляються з conversation_log невеликими партіями,
+# щоб не тримати блокування запису довго. Звільнене місце повертається через incremental VACUUM.
+#
+# У боті прохід запускається у фоні раз на LOG_RETENTION_INTERVAL секунд. Вручну:
+#   python log_retention.py                # один прохід з поточними налаштуваннями
+#   python log_retention.py --days 30
+#   python log_retention.py --vacuum       # одноразово: перевести існуючу БД у режим incremental VACUUM
+
+import os
+import gzip
+import json
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, delete, text
+
+from database import (
+    async_engine,
+    conversation_log_table,
+    conversation_log_chunks_table,
+    knowledge_chunks_table,
+    has_legacy_context,
+)
+
+logger = logging.getLogger(__name__)
+
+# Скільки днів записи зберігаються в conversation_log (0 - архівування вимкнено)
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "90"))
+# Директорія архівів: conversation_log-YYYY-MM.jsonl.gz (місяць - за часом запиту)
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "log_archive")
+# Скільки записів архівується та видаляється однією транзакцією
+LOG_RETENTION_BATCH = int(os.getenv("LOG_RETENTION_BATCH", "500"))
+# Інтервал між проходами у фоні бота, секунди
+LOG_RETENTION_INTERVAL = float(os.getenv("LOG_RETENTION_INTERVAL", "21600"))
+# Скільки вільних сторінок БД повертати файлу за один крок incremental VACUUM
+LOG_VACUUM_PAGES = int(os.getenv("LOG_VACUUM_PAGES", "1000"))
+# Пауза між партіями, щоб фоновий запис логу та фідбек не чекали на архівування
+RETENTION_BATCH_PAUSE = 0.05
+
+
+class RetentionStats:
+    """Лічильники архівування журналу."""
+
+    def __init__(self):
+        self.runs = 0
+        self.rows_archived = 0
+        self.chunks_deleted = 0
+        self.pages_vacuumed = 0
+        self.errors = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_run_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "runs": self.runs,
+            "rows_archived": self.rows_archived,
+            "chunks_deleted": self.chunks_deleted,
+            "pages_vacuumed": self.pages_vacuumed,
+            "errors": self.errors,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_run_seconds": self.last_run_seconds,
+        }
+
+
+retention_stats = RetentionStats()
+
+
+def _archive_path(archive_dir: str, timestamp: Optional[datetime]) -> str:
+    month = timestamp.strftime("%Y-%m") if timestamp else "unknown"
+    return os.path.join(archive_dir, f"conversation_log-{month}.jsonl.gz")
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _write_archive(archive_dir: str, rows: List[dict]) -> None:
+    """
+    Дописує записи в помісячні gzip-архіви і скидає їх на диск. Кожне дописування -
+    окремий gzip-член, тому файл читається як один потік (zcat, gzip.open).
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    by_path: Dict[str, List[dict]] = {}
+    for row in rows:
+        by_path.setdefault(_archive_path(archive_dir, row["timestamp_user"]), []).append(row)
+    for path, path_rows in by_path.items():
+        with open(path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as archive:
+                for row in path_rows:
+                    line = json.dumps({key: _json_value(value) for key, value in row.items()}, ensure_ascii=False)
+                    archive.write(line.encode("utf-8") + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+async def _archive_batch(cutoff: datetime, batch_size: int, archive_dir: str) -> int:
+    """
+    Архівує та видаляє одну партію найстаріших записів. Записи видаляються з БД лише
+    після того, як архів записано на диск.
+
+    Returns:
+        Кількість заархівованих записів (0 - старих записів більше немає)
+    """
+    log = conversation_log_table
+    links = conversation_log_chunks_table
+    chunks = knowledge_chunks_table
+    async with async_engine.connect() as conn:
+        result = await conn.execute(
+            select(log).where(log.c.timestamp_user < cutoff).order_by(log.c.timestamp_user).limit(batch_size)
+        )
+        rows = [dict(row) for row in result.mappings()]
+        if not rows:
+            return 0
+        log_ids = [row["log_id"] for row in rows]
+        result = await conn.execute(
+            select(links.c.log_id, links.c.rank, links.c.score, chunks.c.chunk_hash, chunks.c.index_version, chunks.c.chunk_text)
+            .select_from(links.join(chunks, links.c.chunk_id == chunks.c.chunk_id))
+            .where(links.c.log_id.in_(log_ids))
+            .order_by(links.c.log_id, links.c.rank)
+        )
+        row_chunks: Dict[int, List[dict]] = {}
+        for link in result.mappings():
+            row_chunks.setdefault(link["log_id"], []).append({
+                "rank": link["rank"],
+                "score": link["score"],
+                "chunk_hash": link["chunk_hash"],
+                "index_version": link["index_version"],
+                "text": link["chunk_text"],
+            })
+    # Архів самодостатній: разом із записом зберігаються тексти його чанків
+    for row in rows:
+        row["chunks"] = row_chunks.get(row["log_id"], [])
+
+    await asyncio.to_thread(_write_archive, archive_dir, rows)
+
+    async with async_engine.begin() as conn:
+        await conn.execute(delete(links).where(links.c.log_id.in_(log_ids)))
+        await conn.execute(delete(log).where(log.c.log_id.in_(log_ids)))
+    return len(rows)
+
+
+async def _delete_orphan_chunks(batch_size: int) -> int:
+    """Видаляє чанки, на які більше не посилається жоден запис журналу (партіями)."""
+    deleted = 0
+    while True:
+        async with async_engine.begin() as conn:
+            result = await conn.execute(text(
+                "DELETE FROM knowledge_chunks WHERE chunk_id IN ("
+                " SELECT chunk_id FROM knowledge_chunks"
+                " WHERE chunk_id NOT IN (SELECT chunk_id FROM conversation_log_chunks)"
+                " LIMIT :limit)"
+            ), {"limit": batch_size})
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+
+
+async def _incremental_vacuum(pages: int) -> int:
+    """
+    Повертає файлу БД вільні сторінки кроками по pages сторінок.
+
+    Returns:
+        Кількість звільнених сторінок (0, якщо БД не в режимі incremental VACUUM)
+    """
+    async with async_engine.connect() as conn:
+        auto_vacuum = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+        if auto_vacuum != 2:
+            logger.info("БД не в режимі incremental VACUUM; щоб повернути місце, виконайте: python log_retention.py --vacuum")
+            return 0
+        freed = 0
+        while True:
+            free_before = (await conn.execute(text("PRAGMA freelist_count"))).scalar()
+            if not free_before:
+                return freed
+            # Прагма звільняє по сторінці на кожен крок виконання, а execute() драйвера робить лише
+            # один крок; executescript() виконує її до кінця
+            raw = (await conn.get_raw_connection()).driver_connection
+            await raw.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            await conn.commit()
+            free_after = (await conn.execute(text("PRAGMA freelist_count"))).scalar()
+            freed += free_before - free_after
+            if free_after >= free_before:
+                return freed
+            await asyncio.sleep(RETENTION_BATCH_PAUSE)
+
+
+async def run_retention(
+    days: int = LOG_RETENTION_DAYS,
+    batch_size: int = LOG_RETENTION_BATCH,
+    archive_dir: str = LOG_ARCHIVE_DIR,
+) -> int:
+    """
+    Один прохід: архівує записи старші за days днів, прибирає чанки без посилань
+    і повертає вільне місце файлу БД.
+
+    Returns:
+        Кількість заархівованих записів
+    """
+    if days <= 0:
+        return 0
+    if await has_legacy_context():
+        # Контекст старих записів ще не перенесено в чанки - архів втратив би його
+        logger.warning("Архівування журналу пропущено: спочатку виконайте python migrate_chunks.py")
+        return 0
+    started = datetime.utcnow()
+    cutoff = started - timedelta(days=days)
+    archived = 0
+    while True:
+        count = await _archive_batch(cutoff, batch_size, archive_dir)
+        archived += count
+        retention_stats.rows_archived += count
+        if count < batch_size:
+            break
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+
+    if archived:
+        chunks_deleted = await _delete_orphan_chunks(batch_size)
+        retention_stats.chunks_deleted += chunks_deleted
+        retention_stats.pages_vacuumed += await _incremental_vacuum(LOG_VACUUM_PAGES)
+        logger.info(
+            f"Архівовано {archived} записів журналу старших за {cutoff:%Y-%m-%d} у '{archive_dir}', "
+            f"видалено {chunks_deleted} чанків без посилань."
+        )
+    retention_stats.runs += 1
+    retention_stats.last_run_at = started
+    retention_stats.last_run_seconds = (datetime.utcnow() - started).total_seconds()
+    return archived
+
+
+async def run_retention_loop(interval: float = LOG_RETENTION_INTERVAL) -> None:
+    """Фонова задача бота: архівування журналу раз на interval секунд."""
+    if LOG_RETENTION_DAYS <= 0:
+        logger.info("Архівування журналу вимкнено (LOG_RETENTION_DAYS=0).")
+        return
+    while True:
+        try:
+            await run_retention()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retention_stats.errors += 1
+            logger.error(f"Помилка архівування журналу: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+def get_retention_stats() -> Dict[str, object]:
+    """Метрики архівування журналу."""
+    return retention_stats.as_dict()
+
+
+async def enable_incremental_vacuum() -> None:
+    """Переводить існуючу БД у режим incremental VACUUM (потрібен один повний VACUUM)."""
+    async with async_engine.connect() as conn:
+        await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        await conn.commit()
+        await conn.exec_driver_sql("VACUUM")
+        mode = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+    logger.info(f"Повний VACUUM виконано, auto_vacuum={mode}.")
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from database import init_db
+
+    await init_db()
+    if args.vacuum:
+        await enable_incremental_vacuum()
+    archived = await run_retention(args.days, args.batch_size, args.archive_dir)
+    print(f"Заархівовано записів: {archived}; {get_retention_stats()}")
+    await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Архівування старих записів журналу розмов")
+    parser.add_argument("--days", type=int, default=LOG_RETENTION_DAYS, help="Зберігати записи за стільки днів")
+    parser.add_argument("--batch-size", type=int, default=LOG_RETENTION_BATCH, help="Записів на транзакцію")
+    parser.add_argument("--archive-dir", default=LOG_ARCHIVE_DIR, help="Директорія архівів")
+    parser.add_argument("--vacuum", action="store_true", help="Перевести БД у режим incremental VACUUM (повний VACUUM)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# metrics.py
+# Метрики продуктивності у форматі Prometheus: гістограми тривалості етапів обробки питання
+# (векторизація, пошук, формування контексту, LLM, запис у БД, надсилання в Telegram),
+# лічильники результатів та числові поля статистики інших модулів (get_*_stats).
+# Віддаються локальним HTTP-ендпоінтом /metrics.
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Адреса та порт HTTP-ендпоінта метрик; 0 вимикає ендпоінт (у webhook-режимі воркер N слухає METRICS_PORT + N)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Префікс назв метрик
+METRICS_PREFIX = "celebrichain"
+# Межі кошиків гістограм тривалості, секунди
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Етапи обробки питання
+STAGE_EMBEDDING = "embedding"
+STAGE_SEARCH = "search"
+STAGE_CONTEXT_ASSEMBLY = "context_assembly"
+STAGE_LLM = "llm"
+STAGE_DB_WRITE = "db_write"
+STAGE_TELEGRAM_SEND = "telegram_send"
+
+# Результати обробки питання (мітка outcome)
+OUTCOME_ANSWERED = "answered"
+OUTCOME_CACHED_ANSWER = "cached_answer"
+# Відповіді без успішної відповіді LLM: у журналі їм відповідають log_id -2, -3 та -4
+OUTCOME_CONTEXT_NOT_FOUND = "context_not_found"
+OUTCOME_LLM_ERROR = "llm_error"
+OUTCOME_REFUSAL = "refusal"
+OUTCOME_BUSY = "busy"
+OUTCOME_WARMING_UP = "warming_up"
+OUTCOME_ERROR = "error"
+
+# Причини, з яких generate_response не повернув відповідь (мітка reason)
+LLM_FAILURE_UNAVAILABLE = "unavailable"
+LLM_FAILURE_QUEUE_TIMEOUT = "queue_timeout"
+LLM_FAILURE_RATE_LIMITED = "rate_limited"
+LLM_FAILURE_AUTH = "auth"
+LLM_FAILURE_API_ERROR = "api_error"
+LLM_FAILURE_UNEXPECTED = "unexpected"
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Лічильник з мітками. Потокобезпечний: етапи пошуку виконуються в пулі потоків."""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def get(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Гістограма з кумулятивними кошиками та мітками (як histogram у Prometheus)."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # мітки -> [кількість у кожному кошику (некумулятивно, останній - +Inf), сума, кількість]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[label_values] = series
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        """Вимірює тривалість блоку (враховується і блок, що завершився винятком)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def get_count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, (list(series[0]), series[1], series[2])) for labels, series in self._series.items())
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le)} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Метрики процесу та функції статистики модулів, що віддаються як gauge."""
+
+    def __init__(self, prefix: str = METRICS_PREFIX):
+        self.prefix = prefix
+        self._metrics: List[object] = []
+        self._collectors: Dict[str, Callable[[], Dict[str, object]]] = {}
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(f"{self.prefix}_{name}", documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.prefix}_{name}", documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, name: str, collect: Callable[[], Dict[str, object]]) -> None:
+        """
+        Додає функцію статистики (наприклад get_llm_stats): її числові поля верхнього рівня
+        віддаються як gauge <prefix>_<name>_<поле>. Вкладені словники та списки пропускаються.
+        """
+        self._collectors[name] = collect
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, collect in self._collectors.items():
+            try:
+                stats = collect()
+            except Exception as e:
+                logger.error(f"Не вдалося зібрати статистику '{name}' для метрик: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                metric_name = f"{self.prefix}_{name}_{key}"
+                lines.append(f"# TYPE {metric_name} gauge")
+                lines.append(f"{metric_name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    "stage_duration_seconds", "Тривалість етапів обробки питання", ("stage",)
+)
+request_duration = registry.histogram(
+    "request_duration_seconds", "Повна тривалість обробки питання за результатом", ("outcome",)
+)
+requests_total = registry.counter(
+    "requests_total", "Оброблені питання за результатом", ("outcome",)
+)
+llm_failures_total = registry.counter(
+    "llm_failures_total", "Виклики LLM, що завершились без відповіді, за причиною", ("reason",)
+)
+
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    """Вимірює тривалість етапу обробки питання: with time_stage(STAGE_SEARCH): ..."""
+    with stage_duration.time(stage):
+        yield
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    stage_duration.observe(seconds, stage)
+
+
+def timed_stage(stage: str):
+    """Декоратор асинхронної функції, тривалість якої враховується як етап обробки."""
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage_duration.time(stage):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_request(outcome: str, seconds: Optional[float] = None) -> None:
+    """Враховує оброблене питання та (якщо відома) повну тривалість його обробки."""
+    requests_total.inc(outcome)
+    if seconds is not None:
+        request_duration.observe(seconds, outcome)
+
+
+def record_llm_failure(reason: str) -> None:
+    """Враховує виклик LLM без відповіді (лічильник інкрементується там, де сталася помилка)."""
+    llm_failures_total.inc(reason)
+
+
+async def run_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+    """Фонова задача: HTTP-ендпоінт /metrics до скасування задачі."""
+    if port <= 0:
+        return
+
+    async def handle_metrics(_: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Метрики доступні на http://{host}:{port}/metrics")
+        await asyncio.Event().wait()
+    except OSError as e:
+        logger.error(f"Не вдалося запустити ендпоінт метрик на {host}:{port}: {e}")
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,215 @@
+# migrate_chunks.py
+# Міграція історії: текст retrieved_context зі старих записів conversation_log переноситься
+# в таблицю унікальних чанків knowledge_chunks, а записи посилаються на них через
+# conversation_log_chunks (ранг = позиція чанка в контексті). Після перенесення колонка
+# retrieved_context видаляється (SQLite 3.35+), а БД стискається VACUUM.
+#
+# Запуск (бота перед цим слід зупинити):
+#   python migrate_chunks.py                # history.db
+#   python migrate_chunks.py --db other.db --dry-run
+
+import os
+import argparse
+import sqlite3
+from typing import Dict, Tuple
+
+from sqlalchemy import create_engine, event
+
+from database import (
+    metadata,
+    conversation_log_chunks_table,
+    CONTEXT_SEPARATOR,
+    LEGACY_CONTEXT_COLUMN,
+    LEGACY_INDEX_VERSION,
+    _add_missing_columns,
+    _drop_obsolete_indexes,
+)
+from knowledge_index import chunk_hash
+
+# ALTER TABLE ... DROP COLUMN з'явився в SQLite 3.35.0
+DROP_COLUMN_SQLITE_VERSION = (3, 35, 0)
+
+
+def _file_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def _space_by_table(db_path: str) -> Dict[str, int]:
+    """Місце, яке займають таблиці та індекси БД, в байтах (порожньо, якщо SQLite зібрано без dbstat)."""
+    connection = sqlite3.connect(db_path)
+    try:
+        return dict(connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC"))
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        connection.close()
+
+
+def _migration_engine(db_path: str):
+    """
+    Двигун з транзакційним DDL: pysqlite сам не відкриває транзакцію перед CREATE/ALTER,
+    тому BEGIN видається явно, і відкат dry run прибирає також створені таблиці та колонки.
+    """
+    engine = create_engine(f"sqlite:///{db_path}")
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, _):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    return engine
+
+
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def _table_exists(conn, name: str) -> bool:
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).first() is not None
+
+
+def _detach_rowid_links(conn) -> None:
+    """
+    Перейменовує таблицю посилань, створену попередніми версіями бота з rowid, щоб create_all
+    створив її заново як WITHOUT ROWID; рядки переносить _copy_detached_links.
+    """
+    name = conversation_log_chunks_table.name
+    row = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).first()
+    if row is None or "WITHOUT ROWID" in row[0].upper():
+        return
+    for index in conversation_log_chunks_table.indexes:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+    conn.exec_driver_sql(f"ALTER TABLE {name} RENAME TO {name}_rowid")
+
+
+def _copy_detached_links(conn) -> None:
+    """Переносить рядки перейменованої таблиці посилань (зокрема після перерваного запуску)."""
+    name = conversation_log_chunks_table.name
+    if not _table_exists(conn, f"{name}_rowid"):
+        return
+    conn.exec_driver_sql(
+        f"INSERT OR REPLACE INTO {name} (log_id, rank, chunk_id, score) "
+        f"SELECT log_id, rank, chunk_id, score FROM {name}_rowid"
+    )
+    conn.exec_driver_sql(f"DROP TABLE {name}_rowid")
+
+
+def _copy_contexts(conn, batch_size: int, dry_run: bool, stats: Dict[str, int]):
+    """
+    Переносить контексти партіями. Кожна партія - окрема транзакція, щоб не тримати блокування БД
+    надовго; у dry run усе виконується в одній транзакції, яку відкочує викликач.
+
+    Returns:
+        Поточна (ще не завершена) транзакція
+    """
+    transaction = conn.get_transaction()
+    chunk_ids: Dict[Tuple[str, str], int] = {
+        (h, v): chunk_id
+        for chunk_id, h, v in conn.exec_driver_sql("SELECT chunk_id, chunk_hash, index_version FROM knowledge_chunks")
+    }
+    last_id = 0
+    while True:
+        rows = conn.exec_driver_sql(
+            f"SELECT log_id, {LEGACY_CONTEXT_COLUMN}, index_version FROM conversation_log "
+            f"WHERE {LEGACY_CONTEXT_COLUMN} IS NOT NULL AND log_id > ? ORDER BY log_id LIMIT ?",
+            (last_id, batch_size),
+        ).all()
+        if not rows:
+            return transaction
+        for log_id, context, index_version in rows:
+            last_id = log_id
+            version = index_version or LEGACY_INDEX_VERSION
+            pieces = [piece for piece in context.split(CONTEXT_SEPARATOR) if piece.strip()]
+            for rank, piece in enumerate(pieces):
+                key = (chunk_hash(piece), version)
+                if key not in chunk_ids:
+                    result = conn.exec_driver_sql(
+                        "INSERT INTO knowledge_chunks (chunk_hash, index_version, chunk_text) VALUES (?, ?, ?)",
+                        (key[0], key[1], piece),
+                    )
+                    chunk_ids[key] = result.lastrowid
+                    stats["chunks"] += 1
+                conn.exec_driver_sql(
+                    "INSERT OR REPLACE INTO conversation_log_chunks (log_id, rank, chunk_id, score) VALUES (?, ?, ?, NULL)",
+                    (log_id, rank, chunk_ids[key]),
+                )
+                stats["links"] += 1
+            stats["rows"] += 1
+        if not dry_run:
+            transaction.commit()
+            transaction = conn.begin()
+
+
+def migrate(db_path: str, batch_size: int = 500, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Переносить контексти старих записів у нормалізовані таблиці та видаляє колонку retrieved_context.
+    Dry run виконує ту саму міграцію (разом зі створенням таблиць) в одній транзакції і відкочує її.
+
+    Returns:
+        Статистика: кількість перенесених записів, посилань, унікальних чанків і чи видалено колонку
+    """
+    stats = {"rows": 0, "links": 0, "chunks": 0, "column_dropped": 0}
+    engine = _migration_engine(db_path)
+    try:
+        with engine.connect() as conn:
+            transaction = conn.begin()
+            try:
+                _detach_rowid_links(conn)
+                # Таблиці та колонки створюються з тих самих описів, що й у боті
+                metadata.create_all(conn)
+                _add_missing_columns(conn)
+                _drop_obsolete_indexes(conn)
+                _copy_detached_links(conn)
+                if LEGACY_CONTEXT_COLUMN in _columns(conn, "conversation_log"):
+                    transaction = _copy_contexts(conn, batch_size, dry_run, stats)
+                    # Посилання на чанки записано для всіх записів; повторний запуск після збою перезаписує ті самі посилання
+                    if sqlite3.sqlite_version_info >= DROP_COLUMN_SQLITE_VERSION:
+                        conn.exec_driver_sql(f"ALTER TABLE conversation_log DROP COLUMN {LEGACY_CONTEXT_COLUMN}")
+                        stats["column_dropped"] = 1
+                    else:
+                        conn.exec_driver_sql(f"UPDATE conversation_log SET {LEGACY_CONTEXT_COLUMN} = NULL")
+            except BaseException:
+                transaction.rollback()
+                raise
+            if dry_run:
+                transaction.rollback()
+                return stats
+            transaction.commit()
+            # VACUUM не виконується всередині транзакції, тому - напряму через з'єднання sqlite3
+            raw = conn.connection.driver_connection
+            raw.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            raw.execute("VACUUM")
+    finally:
+        engine.dispose()
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Перенесення retrieved_context у таблицю чанків і видалення колонки")
+    parser.add_argument("--db", default="history.db", help="Файл БД SQLite")
+    parser.add_argument("--batch-size", type=int, default=500, help="Записів на транзакцію")
+    parser.add_argument("--dry-run", action="store_true", help="Порахувати, нічого не змінюючи")
+    args = parser.parse_args()
+
+    size_before = _file_size(args.db)
+    stats = migrate(args.db, args.batch_size, args.dry_run)
+    size_after = _file_size(args.db)
+    print(
+        f"Записів: {stats['rows']}, посилань на чанки: {stats['links']}, нових унікальних чанків: {stats['chunks']}"
+        + (" (dry run, зміни відкочено)" if args.dry_run else "")
+    )
+    if not args.dry_run and stats["rows"] and not stats["column_dropped"]:
+        print(f"SQLite {sqlite3.sqlite_version} не підтримує DROP COLUMN: колонку {LEGACY_CONTEXT_COLUMN} очищено, але не видалено")
+    print(f"Розмір БД: {size_before / 1024:.1f} КБ -> {size_after / 1024:.1f} КБ")
+    # Що залишилось у файлі: після перенесення основну частину займають відповіді бота, а не контекст
+    for name, size in _space_by_table(args.db).items():
+        print(f"  {name}: {size / 1024:.1f} КБ")
+
+
+if __name__ == "__main__":
+    main()
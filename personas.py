@@ -0,0 +1,89 @@
+# personas.py
+# Опис персон (зірок), яких обслуговує один процес бота: база знань, інструкції персони та Telegram-токен
+
+import os
+import json
+import logging
+from typing import Dict, List, Optional
+
+from knowledge_index import INDEX_DIR
+
+logger = logging.getLogger(__name__)
+
+# JSON-файл зі списком персон. Якщо його немає, бот працює з однією персоною за замовчуванням.
+PERSONAS_CONFIG_PATH = os.getenv("PERSONAS_CONFIG", "personas.json")
+DEFAULT_PERSONA = "default"
+
+
+class Persona:
+    """Налаштування однієї персони."""
+
+    def __init__(
+        self,
+        name: str,
+        knowledge_base_path: str = "knowledge_base.txt",
+        persona_instructions_path: str = "persona_instructions.txt",
+        token_env: str = "TELEGRAM_BOT_TOKEN",
+        index_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            name: Унікальна назва персони
+            knowledge_base_path: Файл бази знань
+            persona_instructions_path: Файл інструкцій щодо стилю спілкування
+            token_env: Змінна середовища з токеном Telegram-бота цієї персони
+            index_dir: Директорія збережених індексів (за замовчуванням INDEX_DIR/<name>)
+        """
+        self.name = name
+        self.knowledge_base_path = knowledge_base_path
+        self.persona_instructions_path = persona_instructions_path
+        self.token_env = token_env
+        self.index_dir = index_dir or os.path.join(INDEX_DIR, name)
+
+    def __repr__(self) -> str:
+        return f"Persona({self.name!r}, kb={self.knowledge_base_path!r})"
+
+
+def load_personas(config_path: str = PERSONAS_CONFIG_PATH) -> Dict[str, Persona]:
+    """
+    Завантажує персони з JSON-файлу виду
+    {"zizan": {"knowledge_base": "...", "persona_instructions": "...", "token_env": "ZIZAN_BOT_TOKEN"}}.
+
+    Returns:
+        Словник назва -> Persona (упорядкований як у файлі)
+    """
+    if not os.path.exists(config_path):
+        # Одна персона з файлами в корені проекту; індекси - безпосередньо в INDEX_DIR, як раніше
+        return {DEFAULT_PERSONA: Persona(DEFAULT_PERSONA, index_dir=INDEX_DIR)}
+
+    with open(config_path, "r", encoding="utf-8") as file:
+        config = json.load(file)
+
+    personas = {}
+    for name, options in config.items():
+        personas[name] = Persona(
+            name,
+            knowledge_base_path=options.get("knowledge_base", f"personas/{name}/knowledge_base.txt"),
+            persona_instructions_path=options.get("persona_instructions", f"personas/{name}/persona_instructions.txt"),
+            token_env=options.get("token_env", f"{name.upper()}_BOT_TOKEN"),
+            index_dir=options.get("index_dir"),
+        )
+    if not personas:
+        raise ValueError(f"Файл персон '{config_path}' не містить жодної персони")
+    logger.info(f"Завантажено персони з '{config_path}': {', '.join(personas)}")
+    return personas
+
+
+# Персони поточного процесу
+personas: Dict[str, Persona] = load_personas()
+
+
+def get_persona(name: Optional[str] = None) -> Persona:
+    """Повертає персону за назвою (None - перша/єдина персона)."""
+    if name is None:
+        return next(iter(personas.values()))
+    return personas[name]
+
+
+def get_persona_names() -> List[str]:
+    return list(personas)
@@ -0,0 +1,145 @@
+# prompt_assets.py
+# Реєстр інструкцій персон: файли читаються один раз, системний промпт рендериться один раз
+# на версію файлу і зберігається в пам'яті. Фонова задача дешево перевіряє час зміни та
+# розмір файлів і атомарно підміняє нову версію, тож обробка повідомлення не читає диск.
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from llm_utils import build_system_prompt
+from personas import personas, Persona
+
+logger = logging.getLogger(__name__)
+
+# Як часто (в секундах) перевіряти зміни файлів інструкцій персон; 0 вимикає автоматичне перезавантаження
+PROMPT_ASSETS_RELOAD_INTERVAL = float(os.getenv("PROMPT_ASSETS_RELOAD_INTERVAL", "30"))
+# Базові інструкції, якщо файл інструкцій персони не знайдено або не вдалося прочитати
+DEFAULT_PERSONA_INSTRUCTIONS = "You are a virtual assistant of a star. Respond friendly and informative."
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """Час зміни та розмір файлу (None - файлу немає)."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class PersonaPrompt:
+    """Незмінна версія інструкцій персони разом з готовим системним промптом."""
+
+    __slots__ = ("persona", "path", "instructions", "system_prompt", "signature", "version", "loaded_at")
+
+    def __init__(self, persona: str, path: str, instructions: str, signature: Optional[Tuple[int, int]], version: int):
+        self.persona = persona
+        self.path = path
+        self.instructions = instructions
+        self.system_prompt = build_system_prompt(instructions)
+        self.signature = signature
+        self.version = version
+        self.loaded_at = time.time()
+
+
+class PromptAssetRegistry:
+    """Інструкції та системні промпти всіх персон процесу."""
+
+    def __init__(self, persona_configs: Dict[str, Persona] = personas):
+        self._personas = persona_configs
+        self._prompts: Dict[str, PersonaPrompt] = {}
+
+        self.reloads = 0
+        self.reload_errors = 0
+
+    def _load(self, persona: str, previous: Optional[PersonaPrompt]) -> PersonaPrompt:
+        path = self._personas[persona].persona_instructions_path
+        signature = _file_signature(path)
+        version = previous.version + 1 if previous else 1
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                instructions = file.read()
+        except FileNotFoundError:
+            logger.error(f"[{persona}] Помилка: Файл інструкцій персони '{path}' не знайдено.")
+            instructions = DEFAULT_PERSONA_INSTRUCTIONS
+        except Exception as e:
+            self.reload_errors += 1
+            logger.error(f"[{persona}] Помилка при читанні файлу інструкцій персони '{path}': {e}")
+            if previous is not None:
+                # Залишаємо попередню версію; файл перечитається при наступній зміні
+                return previous
+            instructions = DEFAULT_PERSONA_INSTRUCTIONS
+        if previous is not None and instructions == previous.instructions:
+            # Змінився лише час зміни файлу - промпт (і кеш префікса у провайдера) залишається тим самим
+            previous.signature = signature
+            return previous
+        prompt = PersonaPrompt(persona, path, instructions, signature, version)
+        if previous is not None:
+            self.reloads += 1
+            logger.info(f"[{persona}] Інструкції персони оновлено (версія {version}).")
+        return prompt
+
+    def get(self, persona: str) -> PersonaPrompt:
+        """Поточна версія інструкцій персони (завантажується з диска лише перший раз)."""
+        prompt = self._prompts.get(persona)
+        if prompt is None:
+            prompt = self._load(persona, None)
+            self._prompts[persona] = prompt
+        return prompt
+
+    def get_system_prompt(self, persona: str) -> Any:
+        """Готовий системний промпт персони для generate_response."""
+        return self.get(persona).system_prompt
+
+    def load_all(self) -> None:
+        for persona in self._personas:
+            self.get(persona)
+
+    def refresh(self) -> List[str]:
+        """
+        Перевіряє час зміни та розмір файлів інструкцій і перечитує змінені.
+
+        Returns:
+            Персони, чиї інструкції замінено
+        """
+        changed = []
+        for persona, prompt in list(self._prompts.items()):
+            if _file_signature(prompt.path) == prompt.signature:
+                continue
+            updated = self._load(persona, prompt)
+            if updated is not prompt:
+                self._prompts[persona] = updated
+                changed.append(persona)
+        return changed
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            "personas": {
+                persona: {"version": prompt.version, "chars": len(prompt.instructions), "loaded_at": prompt.loaded_at}
+                for persona, prompt in self._prompts.items()
+            },
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+        }
+
+
+prompt_assets = PromptAssetRegistry()
+
+
+async def watch_prompt_assets(interval: float = PROMPT_ASSETS_RELOAD_INTERVAL) -> None:
+    """Періодично перевіряє файли інструкцій персон і підхоплює зміни без перезапуску бота."""
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            prompt_assets.refresh()
+        except Exception as e:
+            logger.error(f"Помилка автоматичного перезавантаження інструкцій персон: {e}", exc_info=True)
+
+
+def get_prompt_asset_stats() -> Dict[str, object]:
+    """Метрики реєстру інструкцій персон."""
+    return prompt_assets.get_stats()
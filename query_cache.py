@@ -0,0 +1,156 @@
+# query_cache.py
+# Кеш векторів запитів та знайденого контексту для питань, що часто повторюються
+
+import re
+import time
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Нормалізує запит для використання як ключа кешу:
+    регістр, пунктуація та зайві пробіли не впливають на ключ.
+    """
+    text = unicodedata.normalize("NFKC", query).casefold()
+    # Пунктуацію та символи (емодзі тощо) замінюємо пробілами
+    text = "".join(" " if unicodedata.category(ch)[0] in ("P", "S") else ch for ch in text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class _CacheEntry:
+    __slots__ = ("created_at", "embedding", "contexts")
+
+    def __init__(self, created_at: float):
+        self.created_at = created_at
+        self.embedding: Optional[np.ndarray] = None
+        # Контекст залежить від ліміту токенів, тому зберігається окремо для кожного max_tokens
+        self.contexts: Dict[int, Any] = {}
+
+
+class QueryCache:
+    """
+    Обмежений LRU-кеш з TTL. Ключ - нормалізований запит.
+    Зберігає вектор запиту та готовий результат пошуку контексту.
+    Повністю очищується, коли змінюється версія індексу бази знань.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600.0):
+        """
+        Args:
+            max_size: Максимальна кількість запитів у кеші (0 - кеш вимкнено)
+            ttl_seconds: Час життя запису в секундах
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.index_version: Optional[str] = None
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.context_hits = 0
+        self.embedding_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _check_version(self, index_version: Optional[str]) -> None:
+        """Скидає кеш, якщо індекс бази знань змінився (викликається під блокуванням)."""
+        if index_version != self.index_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.index_version = index_version
+
+    def _get_entry(self, key: str) -> Optional[_CacheEntry]:
+        """Повертає живий запис і оновлює його позицію в LRU (викликається під блокуванням)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created_at > self.ttl_seconds:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_context(self, key: str, max_tokens: int, index_version: Optional[str]) -> Optional[Any]:
+        """Повертає збережений контекст (результат пошуку) або None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._check_version(index_version)
+            entry = self._get_entry(key)
+            if entry is not None and max_tokens in entry.contexts:
+                self.context_hits += 1
+                return entry.contexts[max_tokens]
+            return None
+
+    def get_embedding(self, key: str, index_version: Optional[str]) -> Optional[np.ndarray]:
+        """Повертає збережений вектор запиту або None (промах рахується тут)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._check_version(index_version)
+            entry = self._get_entry(key)
+            if entry is not None and entry.embedding is not None:
+                self.embedding_hits += 1
+                return entry.embedding
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        key: str,
+        index_version: Optional[str],
+        embedding: Optional[np.ndarray] = None,
+        max_tokens: Optional[int] = None,
+        context: Optional[Any] = None,
+    ) -> None:
+        """Зберігає вектор та/або контекст для запиту."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._check_version(index_version)
+            entry = self._get_entry(key)
+            if entry is None:
+                entry = _CacheEntry(time.monotonic())
+                self._entries[key] = entry
+            if embedding is not None:
+                entry.embedding = embedding
+            if max_tokens is not None and context:
+                entry.contexts[max_tokens] = context
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, object]:
+        """Лічильники влучань/промахів та поточний розмір кешу."""
+        with self._lock:
+            lookups = self.context_hits + self.embedding_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "context_hits": self.context_hits,
+                "embedding_hits": self.embedding_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.context_hits + self.embedding_hits) / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "index_version": self.index_version,
+            }
@@ -0,0 +1,205 @@
+# retrieval_backends.py
+# Бекенди пошуку найближчих чанків: точний перебір (за замовчуванням) та наближений IVF-індекс
+
+import os
+import time
+import logging
+import numpy as np
+from typing import Optional, Tuple
+
+from knowledge_index import INDEX_DIR, EmbeddingMatrix, KnowledgeIndex, index_path
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("exact", "ivf")
+
+
+class RetrievalBackend:
+    """Інтерфейс бекенду пошуку: повертає топ-K рядків індексу за вектором запиту."""
+
+    name = "base"
+
+    def search(self, query_embedding: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            Кортеж (індекси чанків, оцінки подібності), відсортований за спаданням подібності
+        """
+        raise NotImplementedError
+
+    @property
+    def nbytes(self) -> int:
+        """Додаткова пам'ять бекенду понад матрицю векторів."""
+        return 0
+
+
+def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Повертає k найбільших оцінок (позиції та значення) за спаданням."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    # partition знаходить K найбільших значень без повного сортування
+    top = np.argpartition(scores, -k)[-k:]
+    # Сортуємо ці K індексів за спаданням їх подібності
+    top = top[np.argsort(scores[top])[::-1]]
+    return top, scores[top]
+
+
+class ExactBackend(RetrievalBackend):
+    """Точний пошук: подібність до кожного чанка та відбір топ-K."""
+
+    name = "exact"
+
+    def __init__(self, embeddings: EmbeddingMatrix):
+        self.embeddings = embeddings
+
+    def search(self, query_embedding: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return _top_k(self.embeddings.score(query_embedding), k)
+
+
+class IVFBackend(RetrievalBackend):
+    """
+    Наближений пошук IVF (inverted file): вектори розбиваються на nlist кластерів
+    сферичним k-means, запит порівнюється лише з чанками nprobe найближчих кластерів.
+    Центроїди та списки кластерів зберігаються поруч з індексом і перевикористовуються.
+    """
+
+    name = "ivf"
+
+    def __init__(
+        self,
+        embeddings: EmbeddingMatrix,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_rows: np.ndarray,
+        nprobe: int = 8,
+    ):
+        """
+        Args:
+            embeddings: Матриця векторів чанків
+            centroids: Нормалізовані центроїди кластерів (nlist x dim)
+            list_offsets: Межі списків кластерів у list_rows (nlist + 1)
+            list_rows: Номери рядків, згруповані за кластерами
+            nprobe: Скільки найближчих кластерів переглядати на запит
+        """
+        self.embeddings = embeddings
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.nprobe = max(1, nprobe)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.centroids.nbytes + self.list_offsets.nbytes + self.list_rows.nbytes)
+
+    def search(self, query_embedding: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        probe, _ = _top_k(self.centroids @ query, self.nprobe)
+        # Сортовані номери рядків - послідовніше читання матриці (важливо для memory-map)
+        candidates = np.sort(np.concatenate(
+            [self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe]
+        ))
+        if len(candidates) == 0:
+            return _top_k(np.empty(0, dtype=np.float32), k)
+        positions, scores = _top_k(self.embeddings.score(query, rows=candidates), k)
+        return candidates[positions], scores
+
+    @classmethod
+    def build(cls, embeddings: EmbeddingMatrix, nlist: int = 0, nprobe: int = 8, iterations: int = 10, seed: int = 0) -> "IVFBackend":
+        """
+        Навчає центроїди сферичним k-means на вибірці векторів і розкладає всі рядки по кластерах.
+
+        Args:
+            nlist: Кількість кластерів (0 - автоматично, приблизно sqrt(N))
+        """
+        n = len(embeddings)
+        if nlist <= 0:
+            nlist = max(1, int(round(np.sqrt(n))))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(seed)
+        started = time.perf_counter()
+
+        # Навчання на вибірці: достатньо кількох десятків векторів на кластер
+        sample_size = min(n, max(nlist * 40, 10000))
+        sample_rows = np.sort(rng.choice(n, sample_size, replace=False))
+        sample = embeddings.rows_float32(sample_rows)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Порожні кластери переініціалізуємо випадковими векторами вибірки
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        assignment = np.concatenate([
+            _assign(embeddings.rows_float32(np.arange(start, min(start + 8192, n))), centroids)
+            for start in range(0, n, 8192)
+        ])
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=nlist)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        logger.info(f"IVF-індекс побудовано: {n} векторів, {nlist} кластерів за {time.perf_counter() - started:.1f} с.")
+        return cls(embeddings, centroids.astype(np.float32), list_offsets, order.astype(np.int64), nprobe)
+
+    def save(self, path: str) -> None:
+        """Зберігає центроїди та списки кластерів (атомарно, через тимчасовий файл)."""
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp_path, centroids=self.centroids, list_offsets=self.list_offsets, list_rows=self.list_rows)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, embeddings: EmbeddingMatrix, nprobe: int = 8) -> Optional["IVFBackend"]:
+        try:
+            with np.load(path) as data:
+                backend = cls(embeddings, data["centroids"], data["list_offsets"], data["list_rows"], nprobe)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Не вдалося завантажити IVF-індекс '{path}': {e}")
+            return None
+        if backend.list_offsets[-1] != len(embeddings):
+            logger.warning(f"IVF-індекс '{path}' не відповідає матриці векторів, буде перебудовано.")
+            return None
+        return backend
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Номер найближчого (за косинусом) центроїда для кожного вектора."""
+    return np.argmax(vectors @ centroids.T, axis=1)
+
+
+def create_backend(
+    index: KnowledgeIndex,
+    name: str = "exact",
+    nlist: int = 0,
+    nprobe: int = 8,
+    index_dir: str = INDEX_DIR,
+) -> RetrievalBackend:
+    """
+    Створює бекенд пошуку для індексу. IVF-структура береться з диска, якщо вона вже побудована
+    для цієї версії індексу, інакше будується та зберігається поруч з індексом.
+    """
+    if name == "ivf":
+        path = os.path.join(index_path(index.version, index_dir), f"ivf_{nlist or 'auto'}.npz")
+        backend = IVFBackend.load(path, index.embeddings, nprobe)
+        if backend is None:
+            backend = IVFBackend.build(index.embeddings, nlist=nlist, nprobe=nprobe)
+            if os.path.isdir(os.path.dirname(path)):
+                try:
+                    backend.save(path)
+                except OSError as e:
+                    logger.warning(f"Не вдалося зберегти IVF-індекс '{path}': {e}")
+        return backend
+
+    if name != "exact":
+        logger.warning(f"Невідомий бекенд пошуку '{name}', використовуємо точний пошук.")
+    return ExactBackend(index.embeddings)
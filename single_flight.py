@@ -0,0 +1,81 @@
+# single_flight.py
+# Об'єднання однакових запитів, що обробляються одночасно: перший запит виконує пошук і
+# генерацію, а однакові запити, що надійшли до його завершення, чекають на той самий результат
+
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from query_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Чи об'єднувати однакові одночасні питання (1/0)
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") == "1"
+
+
+class SingleFlight:
+    """
+    Не більше одного виконання на ключ одночасно. Робота виконується окремою задачею,
+    тому скасування першого запиту не скасовує її для решти, хто чекає.
+    """
+
+    def __init__(self, enabled: bool = COALESCE_REQUESTS):
+        self.enabled = enabled
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.llm_calls_saved = 0
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Виконує work() або приєднується до виконання, що вже триває для цього ключа.
+
+        Returns:
+            Кортеж (результат, shared): shared=True, якщо результат отримано від іншого запиту
+        """
+        if not self.enabled:
+            return await work(), False
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        self.leaders += 1
+        task = asyncio.ensure_future(work())
+        self._calls[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task), False
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def record_llm_call_saved(self) -> None:
+        """Враховує запит, який отримав відповідь LLM без власного виклику API."""
+        self.llm_calls_saved += 1
+
+    def get_stats(self) -> Dict[str, object]:
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / total if total else 0.0,
+            "llm_calls_saved": self.llm_calls_saved,
+        }
+
+
+question_flights = SingleFlight()
+
+
+def question_key(query: str, language: str, persona: str, index_version: Optional[str]) -> Tuple:
+    """Ключ об'єднання: нормалізоване питання, мова, персона та версія її бази знань."""
+    return persona, normalize_query(query), language, index_version
+
+
+def get_coalescing_stats() -> Dict[str, object]:
+    """Метрики об'єднання однакових питань (зокрема кількість зекономлених викликів LLM)."""
+    return question_flights.get_stats()
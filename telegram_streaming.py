@@ -0,0 +1,158 @@
+# telegram_streaming.py
+# Поступова доставка відповіді LLM у повідомлення Telegram: перше речення - новим повідомленням,
+# далі - рідкісні редагування цього повідомлення з урахуванням лімітів Telegram
+
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import List, Optional
+
+from aiogram.types import Message, InlineKeyboardMarkup
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from metrics import time_stage, STAGE_TELEGRAM_SEND
+
+logger = logging.getLogger(__name__)
+
+# Мінімальний інтервал між редагуваннями одного повідомлення (Telegram обмежує частоту редагувань)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+# Скільки символів без кінця речення достатньо, щоб усе одно надіслати перше повідомлення
+STREAM_FIRST_MESSAGE_CHARS = int(os.getenv("STREAM_FIRST_MESSAGE_CHARS", "200"))
+# Максимальна довжина текстового повідомлення Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Кінець речення: розділовий знак, за яким уже почалось наступне слово, або новий рядок
+_SENTENCE_END_RE = re.compile(r"[.!?…](\s)|\n")
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Розбиває довгий текст на частини не довші за limit, по можливості на межі абзацу чи рядка."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    parts.append(text)
+    return parts
+
+
+class StreamingReply:
+    """
+    Відповідь, що наростає під час генерації. Перше повідомлення надсилається, щойно
+    з'являється перше речення; далі окрема задача редагує його не частіше ніж раз на
+    STREAM_EDIT_INTERVAL секунд. Клавіатура фідбеку додається лише фінальним редагуванням.
+    """
+
+    def __init__(self, message: Message, edit_interval: float = STREAM_EDIT_INTERVAL):
+        """
+        Args:
+            message: Повідомлення користувача, на яке відповідаємо
+            edit_interval: Мінімальний інтервал між редагуваннями, секунди
+        """
+        self.message = message
+        self.edit_interval = edit_interval
+        self.text = ""
+        self.sent: Optional[Message] = None
+        self.edits = 0
+        self.first_message_at: Optional[float] = None
+        self._started = time.monotonic()
+        self._shown_text = ""
+        self._next_edit_at = 0.0
+        self._changed = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def feed(self, delta: str) -> None:
+        """Додає фрагмент тексту від LLM (викликається для кожної дельти потоку)."""
+        self.text += delta
+        if self.sent is None:
+            if _SENTENCE_END_RE.search(self.text) or len(self.text) >= STREAM_FIRST_MESSAGE_CHARS:
+                await self._send_first()
+            return
+        self._changed.set()
+
+    async def _send_first(self) -> None:
+        preview = self._preview()
+        if not preview:
+            return
+        with time_stage(STAGE_TELEGRAM_SEND):
+            self.sent = await self.message.answer(preview, parse_mode=None)
+        self._shown_text = preview
+        self.first_message_at = time.monotonic()
+        self._next_edit_at = self.first_message_at + self.edit_interval
+        logger.info(f"Перше речення відповіді надіслано через {self.first_message_at - self._started:.2f} с.")
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    def _preview(self) -> str:
+        """Текст для проміжного показу: не довший за ліміт Telegram."""
+        return self.text.strip()[:TELEGRAM_MESSAGE_LIMIT]
+
+    async def _flush_loop(self) -> None:
+        """Редагує повідомлення при появі нового тексту, витримуючи інтервал між редагуваннями."""
+        while True:
+            await self._changed.wait()
+            delay = self._next_edit_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._changed.clear()
+            preview = self._preview()
+            if preview != self._shown_text:
+                try:
+                    await self._edit(preview)
+                except Exception as e:
+                    # Проміжне редагування не критичне: фінальне все одно покаже повний текст
+                    logger.warning(f"Не вдалося оновити потокову відповідь: {e}")
+
+    async def _edit(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None, final: bool = False) -> None:
+        try:
+            await self.sent.edit_text(text, reply_markup=reply_markup, parse_mode=None)
+            self._shown_text = text
+            self.edits += 1
+            self._next_edit_at = time.monotonic() + self.edit_interval
+        except TelegramRetryAfter as e:
+            # Telegram просить почекати: відкладаємо наступне редагування
+            logger.warning(f"Telegram обмежив редагування, пауза {e.retry_after} с.")
+            self._next_edit_at = time.monotonic() + e.retry_after
+            if final:
+                # Фінальне редагування (з клавіатурою) не можна пропустити
+                await asyncio.sleep(e.retry_after)
+                await self._edit(text, reply_markup, final=True)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+
+    def cancel(self) -> None:
+        """Зупиняє фонові редагування (при помилці обробки запиту)."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+
+    async def finish(self, final_text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """
+        Показує фінальний текст відповіді (разом з клавіатурою фідбеку).
+        Якщо проміжне повідомлення ще не надсилалось, надсилає звичайне повідомлення.
+        Текст, довший за ліміт Telegram, дописується окремими повідомленнями.
+        """
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            flusher.cancel()
+            try:
+                await flusher
+            except asyncio.CancelledError:
+                pass
+
+        parts = split_message(final_text.strip() or final_text)
+        if self.sent is None:
+            for i, part in enumerate(parts):
+                await self.message.answer(part, reply_markup=reply_markup if i == len(parts) - 1 else None, parse_mode=None)
+            return
+
+        await self._edit(parts[0], reply_markup if len(parts) == 1 else None, final=True)
+        for i, part in enumerate(parts[1:], start=2):
+            await self.message.answer(part, reply_markup=reply_markup if i == len(parts) else None, parse_mode=None)
+        logger.info(f"Відповідь доставлено потоково: {self.edits} редагувань, {len(final_text)} символів.")
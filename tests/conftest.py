@@ -0,0 +1,34 @@
+# Спільні фікстури тестів. Модулі бота лежать у корені репозиторію.
+
+import os
+import sys
+import atexit
+import shutil
+import asyncio
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database створює двигун під час імпорту, тому тимчасова БД задається до імпорту модулів бота:
+# тести ніколи не пишуть у робочу history.db
+_TEST_DB_DIR = tempfile.mkdtemp(prefix="celebrichain-tests-")
+atexit.register(shutil.rmtree, _TEST_DB_DIR, ignore_errors=True)
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_TEST_DB_DIR, 'history.db')}"
+
+
+@pytest.fixture
+def history_db():
+    """Модуль database з порожніми таблицями (таблиці створюються заново для кожного тесту)."""
+    import database
+
+    async def reset():
+        async with database.async_engine.begin() as conn:
+            await conn.run_sync(database.metadata.drop_all)
+        await database.init_db()
+
+    asyncio.run(reset())
+    yield database
+    # З'єднання пулу прив'язані до event loop тесту
+    asyncio.run(database.async_engine.dispose())
@@ -0,0 +1,108 @@
+# Кеш відповідей: влучання за подібністю, розділення за персоною/мовою, скидання при зміні версії
+
+import asyncio
+
+import numpy as np
+
+import answer_cache as answer_cache_module
+from answer_cache import AnswerCache
+
+
+def _vector(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_hit_above_threshold_and_miss_below():
+    cache = AnswerCache(max_size=10, threshold=0.9)
+    cache.add("zizan", "en", "v1", 1, "Where was Zizan born?", "In Kuala Lumpur.", _vector(1, 0, 0))
+
+    log_id, answer, similarity = cache.lookup("zizan", "en", "v1", _vector(0.99, 0.05, 0))
+    assert (log_id, answer) == (1, "In Kuala Lumpur.")
+    assert similarity >= 0.9
+    assert cache.lookup("zizan", "en", "v1", _vector(0.5, 0.5, 0.5)) is None
+    stats = cache.get_stats()
+    assert (stats["lookups"], stats["hits"]) == (2, 1)
+
+
+def test_persona_and_language_are_separate():
+    cache = AnswerCache(max_size=10, threshold=0.9)
+    cache.add("zizan", "en", "v1", 1, "q", "answer", _vector(1, 0))
+
+    assert cache.lookup("siti", "en", "v1", _vector(1, 0)) is None
+    assert cache.lookup("zizan", "ms", "v1", _vector(1, 0)) is None
+
+
+def test_version_change_invalidates():
+    cache = AnswerCache(max_size=10, threshold=0.9)
+    cache.add("zizan", "en", "v1", 1, "q", "answer", _vector(1, 0))
+
+    assert cache.lookup("zizan", "en", "v2", _vector(1, 0)) is None
+    assert cache.lookup("zizan", "en", "v1", _vector(1, 0)) is None
+    assert cache.get_stats()["invalidations"] == 1
+
+
+def test_same_question_replaces_answer_and_size_is_bounded():
+    cache = AnswerCache(max_size=2, threshold=0.9)
+    cache.add("zizan", "en", "v1", 1, "Who is Zizan?", "old", _vector(1, 0, 0))
+    cache.add("zizan", "en", "v1", 2, "who is zizan", "new", _vector(1, 0, 0))
+    assert cache.lookup("zizan", "en", "v1", _vector(1, 0, 0))[:2] == (2, "new")
+
+    cache.add("zizan", "en", "v1", 3, "a", "a", _vector(0, 1, 0))
+    cache.add("zizan", "en", "v1", 4, "b", "b", _vector(0, 0, 1))
+    assert cache.lookup("zizan", "en", "v1", _vector(1, 0, 0)) is None
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_failed_generation_is_not_remembered(monkeypatch):
+    """generate_response повертає None при перевантаженні чи помилці API - такий результат не кешується."""
+    cache = AnswerCache(max_size=10, threshold=0.9)
+    monkeypatch.setattr(answer_cache_module, "answer_cache", cache)
+    monkeypatch.setattr(answer_cache_module, "ANSWER_CACHE_FEEDBACK", "not_disliked")
+
+    async def embed(query, persona):
+        return _vector(1, 0)
+
+    monkeypatch.setattr(answer_cache_module, "embed_query_async", embed)
+
+    asyncio.run(answer_cache_module.remember_answer(1, "Who is Zizan?", None, "en", "zizan", "v1"))
+    assert cache.lookup("zizan", "en", "v1", _vector(1, 0)) is None
+
+    asyncio.run(answer_cache_module.remember_answer(2, "Who is Zizan?", "A comedian.", "en", "zizan", "v1"))
+    assert cache.lookup("zizan", "en", "v1", _vector(1, 0))[:2] == (2, "A comedian.")
+
+
+def test_feedback_from_other_workers_is_synced(history_db, monkeypatch):
+    """Воркер дізнається про 👍/👎, записані в БД іншим воркером, і оновлює свій кеш."""
+    database = history_db
+    cache = AnswerCache(max_size=10, threshold=0.9)
+    monkeypatch.setattr(answer_cache_module, "answer_cache", cache)
+    monkeypatch.setattr(answer_cache_module, "_feedback_sync", answer_cache_module._FeedbackSync())
+
+    async def embed(query, persona):
+        return _vector(1, 0) if "born" in query else _vector(0, 1)
+
+    monkeypatch.setattr(answer_cache_module, "embed_query_async", embed)
+
+    async def log(query, answer):
+        return await database.add_log_entry(
+            user_id=1, user_first_name="Fan", user_username=None, user_query=query,
+            bot_response=answer, language="en", persona="zizan", index_version="v1",
+        )
+
+    async def scenario():
+        disliked_id = await log("Where was Zizan born?", "On the Moon.")
+        liked_id = await log("What does Zizan do?", "Comedy.")
+        cache.add("zizan", "en", "v1", disliked_id, "Where was Zizan born?", "On the Moon.", _vector(1, 0))
+        await database.log_writer.flush()
+
+        # Фідбек записує інший воркер: лише в БД, без on_feedback у цьому процесі
+        await database.update_feedback(disliked_id, "dislike")
+        await database.update_feedback(liked_id, "like")
+        first = await answer_cache_module.sync_feedback()
+        second = await answer_cache_module.sync_feedback()
+        return liked_id, first, second
+
+    liked_id, first, second = asyncio.run(scenario())
+    assert (first, second) == (2, 0)
+    assert cache.lookup("zizan", "en", "v1", _vector(1, 0)) is None
+    assert cache.lookup("zizan", "en", "v1", _vector(0, 1))[:2] == (liked_id, "Comedy.")
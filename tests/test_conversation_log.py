@@ -0,0 +1,174 @@
+# Журнал розмов: посилання на чанки та відбір відповідей для кешу відповідей
+
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+import log_retention
+
+
+CHUNKS = [
+    {"chunk_hash": "h1", "text": "Zizan was born in Kuala Lumpur.", "rank": 0, "score": 0.9, "index_version": "v1"},
+    {"chunk_hash": "h2", "text": "Zizan hosts a comedy show.", "rank": 1, "score": 0.7, "index_version": "v1"},
+]
+
+
+def _log(database, response, index_version, chunks=None, feedback_query="q"):
+    return database.add_log_entry(
+        user_id=1,
+        user_first_name="Fan",
+        user_username=None,
+        user_query=feedback_query,
+        bot_response=response,
+        language="en",
+        retrieved_context="\n\n".join(chunk["text"] for chunk in chunks or []),
+        persona="default",
+        index_version=index_version,
+        retrieved_chunks=chunks,
+    )
+
+
+def test_failure_rows_are_not_cacheable(history_db):
+    database = history_db
+
+    async def scenario():
+        answer_id = await _log(database, "Zizan is from KL.", "v1", CHUNKS, "where is zizan from")
+        refusal_id = await _log(database, "Sorry, I cannot fulfill this request.", None, CHUNKS)
+        error_id = await _log(database, "ERROR: RuntimeError - boom", None, CHUNKS)
+        await database.log_writer.flush()
+        cacheable = await database.get_cacheable_answers(only_liked=False)
+        refusal = await database.get_log_entry(refusal_id)
+        async with database.async_engine.connect() as conn:
+            chunk_rows = (await conn.execute(select(database.knowledge_chunks_table))).all()
+        await database.log_writer.close()
+        return answer_id, error_id, cacheable, refusal, chunk_rows
+
+    answer_id, error_id, cacheable, refusal, chunk_rows = asyncio.run(scenario())
+
+    assert [row["log_id"] for row in cacheable] == [answer_id]
+    # Записи без відповіді зберігають контекст посиланнями на ті самі чанки версії v1
+    assert refusal["index_version"] is None
+    assert refusal["retrieved_context"] == "\n\n".join(chunk["text"] for chunk in CHUNKS)
+    assert sorted((row.chunk_hash, row.index_version) for row in chunk_rows) == [("h1", "v1"), ("h2", "v1")]
+
+
+def test_log_ids_of_different_workers_never_collide(history_db):
+    generator_class = history_db._LogIdGenerator
+    first, second = generator_class(0), generator_class(1)
+
+    ids = [generator.next_id() for _ in range(5000) for generator in (first, second)]
+    assert len(set(ids)) == len(ids)
+    # Номер воркера записано в log_id
+    assert {(log_id >> generator_class._SEQUENCE_BITS) % generator_class.MAX_PROCESSES for log_id in ids} == {0, 1}
+
+
+def test_log_worker_index_is_validated(history_db):
+    with pytest.raises(ValueError):
+        history_db._LogIdGenerator(history_db._LogIdGenerator.MAX_PROCESSES)
+
+
+def test_context_without_chunks_is_stored_as_chunks(history_db):
+    """Текст контексту без retrieved_chunks теж зберігається лише чанками: колонки retrieved_context немає."""
+    database = history_db
+    context = "Zizan was born in Kuala Lumpur.\n\nZizan hosts a comedy show."
+
+    async def scenario():
+        log_id = await database.add_log_entry(
+            user_id=1, user_first_name="Fan", user_username=None, user_query="q",
+            bot_response="a", language="en", retrieved_context=context, persona="default",
+        )
+        pending = await database.get_log_entry(log_id)
+        await database.log_writer.flush()
+        stored = await database.get_log_entry(log_id)
+        async with database.async_engine.connect() as conn:
+            columns = {row[1] for row in await conn.exec_driver_sql("PRAGMA table_info(conversation_log)")}
+        await database.log_writer.close()
+        return pending, stored, columns
+
+    pending, stored, columns = asyncio.run(scenario())
+    assert pending["retrieved_context"] == stored["retrieved_context"] == context
+    assert database.LEGACY_CONTEXT_COLUMN not in columns
+
+
+def _slow_chunk_insert(database, monkeypatch, started):
+    original = database._insert_log_chunks
+
+    async def slow_insert(conn, records):
+        started.set()
+        await asyncio.sleep(0.2)
+        await original(conn, records)
+
+    monkeypatch.setattr(database, "_insert_log_chunks", slow_insert)
+
+
+async def _count_rows(database):
+    async with database.async_engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(database.conversation_log_table))).scalar()
+
+
+def test_close_during_flush_writes_every_row(history_db, monkeypatch):
+    """Зупинка бота посеред вставки пакета не губить записи: close() дочікується поточного пакета."""
+    database = history_db
+
+    async def scenario():
+        writer = database.ConversationLogWriter(batch_size=5, flush_interval=60)
+        monkeypatch.setattr(database, "log_writer", writer)
+        started = asyncio.Event()
+        _slow_chunk_insert(database, monkeypatch, started)
+        for i in range(5):
+            await _log(database, f"answer {i}", "v1", CHUNKS, f"question {i}")
+        # П'ятий запис заповнив пакет - фонова задача вже вставляє його
+        await asyncio.wait_for(started.wait(), 5)
+        await writer.close()
+        return await _count_rows(database), writer.get_stats()
+
+    rows, stats = asyncio.run(scenario())
+    assert rows == 5
+    assert stats["pending"] == 0 and stats["records_written"] == 5
+
+
+def test_cancelled_flush_requeues_batch(history_db, monkeypatch):
+    database = history_db
+
+    async def scenario():
+        writer = database.ConversationLogWriter(batch_size=100, flush_interval=60)
+        monkeypatch.setattr(database, "log_writer", writer)
+        started = asyncio.Event()
+        _slow_chunk_insert(database, monkeypatch, started)
+        for i in range(3):
+            await _log(database, f"answer {i}", "v1", CHUNKS, f"question {i}")
+        flush = asyncio.create_task(writer.flush())
+        await asyncio.wait_for(started.wait(), 5)
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+        pending = writer.get_stats()["pending"]
+        await writer.close()
+        return pending, await _count_rows(database)
+
+    assert asyncio.run(scenario()) == (3, 3)
+
+
+def test_retention_deletes_only_unreferenced_chunks(history_db):
+    """Чанки без посилань знаходяться без індексу за chunk_id і видаляються; чанки записів залишаються."""
+    database = history_db
+
+    async def scenario():
+        await _log(database, "Zizan is from KL.", "v1", CHUNKS, "where is zizan from")
+        await database.log_writer.flush()
+        async with database.async_engine.begin() as conn:
+            await conn.execute(database.knowledge_chunks_table.insert(), [
+                {"chunk_hash": "orphan", "index_version": "v0", "chunk_text": "Old fact."},
+            ])
+        deleted = await log_retention._delete_orphan_chunks(batch_size=10)
+        async with database.async_engine.connect() as conn:
+            hashes = sorted(row.chunk_hash for row in await conn.execute(select(database.knowledge_chunks_table)))
+            indexes = [row[0] for row in await conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        await database.log_writer.close()
+        return deleted, hashes, indexes
+
+    deleted, hashes, indexes = asyncio.run(scenario())
+    assert deleted == 1
+    assert hashes == ["h1", "h2"]
+    assert "ix_conversation_log_chunks_chunk_id" not in indexes
@@ -0,0 +1,86 @@
+# Відповіді LLM: помилки повертаються як None, а не як текст, що потрапляє в журнал і кеш
+
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+from anthropic import APIError, RateLimitError
+
+import llm_utils
+import metrics
+
+
+class _FailingMessages:
+    def __init__(self, error: Exception):
+        self.error = error
+        self.calls = 0
+
+    async def create(self, **_):
+        self.calls += 1
+        raise self.error
+
+
+class _FakeClient:
+    def __init__(self, error: Exception):
+        self.messages = _FailingMessages(error)
+
+
+def _response(status: int) -> "httpx.Response":
+    return httpx.Response(status, request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    def install(error: Exception) -> _FakeClient:
+        client = _FakeClient(error)
+
+        async def initialize():
+            return client
+
+        monkeypatch.setattr(llm_utils, "initialize_anthropic_client", initialize)
+        return client
+
+    return install
+
+
+def _generate():
+    return asyncio.run(llm_utils.generate_response("Who is Zizan?", "Zizan is a comedian.", "Be Zizan."))
+
+
+def test_rate_limit_exhausted_returns_none(fake_client, monkeypatch):
+    monkeypatch.setattr(llm_utils, "MAX_RETRIES", 1)
+    monkeypatch.setattr(llm_utils, "BASE_DELAY", 0)
+    monkeypatch.setattr(llm_utils, "_rate_limited_until", 0.0)
+    client = fake_client(RateLimitError("rate limited", response=_response(429), body=None))
+
+    failures = metrics.llm_failures_total.get(metrics.LLM_FAILURE_RATE_LIMITED)
+    assert _generate() is None
+    assert client.messages.calls == 2
+    assert metrics.llm_failures_total.get(metrics.LLM_FAILURE_RATE_LIMITED) == failures + 1
+
+
+def test_api_error_returns_none(fake_client):
+    fake_client(APIError("boom", request=httpx.Request("POST", "https://api.anthropic.com"), body=None))
+    failures = metrics.llm_failures_total.get(metrics.LLM_FAILURE_API_ERROR)
+    assert _generate() is None
+    assert metrics.llm_failures_total.get(metrics.LLM_FAILURE_API_ERROR) == failures + 1
+
+
+def test_queue_timeout_returns_none(fake_client, monkeypatch):
+    client = fake_client(AssertionError("API must not be called without a slot"))
+
+    async def no_slot():
+        return False
+
+    monkeypatch.setattr(llm_utils, "_acquire_llm_slot", no_slot)
+    assert _generate() is None
+    assert client.messages.calls == 0
+
+
+def test_unavailable_client_returns_none(monkeypatch):
+    async def initialize():
+        return None
+
+    monkeypatch.setattr(llm_utils, "initialize_anthropic_client", initialize)
+    assert _generate() is None
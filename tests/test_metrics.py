@@ -0,0 +1,79 @@
+# Метрики: формат Prometheus, етапи обробки та результати питань (зокрема llm_error)
+
+import asyncio
+
+import pytest
+
+from metrics import (
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    record_request,
+    requests_total,
+    request_duration,
+    stage_duration,
+    timed_stage,
+    OUTCOME_LLM_ERROR,
+)
+
+
+def test_counter_renders_labels():
+    counter = Counter("test_total", "Тестовий лічильник", ("outcome",))
+    counter.inc("answered")
+    counter.inc("answered")
+    counter.inc('with "quotes"')
+
+    lines = counter.render()
+    assert "# TYPE test_total counter" in lines
+    assert 'test_total{outcome="answered"} 2.0' in lines
+    assert 'test_total{outcome="with \\"quotes\\""} 1.0' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Тестова гістограма", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "llm")
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="llm",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="llm",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{stage="llm",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="llm"} 3' in lines
+    assert 'test_seconds_sum{stage="llm"} 5.55' in lines
+
+
+def test_collectors_export_only_numeric_fields():
+    registry = MetricsRegistry(prefix="test")
+    registry.register_collector("cache", lambda: {"hits": 3, "enabled": True, "languages": ["en"], "name": "x"})
+
+    def broken():
+        raise RuntimeError("stats unavailable")
+
+    registry.register_collector("broken", broken)
+
+    text = registry.render()
+    assert "test_cache_hits 3" in text
+    assert "test_cache_enabled 1" in text
+    assert "languages" not in text and "test_cache_name" not in text
+    assert "test_broken" not in text
+
+
+def test_timed_stage_counts_failed_calls():
+    @timed_stage("test_stage")
+    async def failing():
+        raise ValueError("boom")
+
+    before = stage_duration.get_count("test_stage")
+    with pytest.raises(ValueError):
+        asyncio.run(failing())
+    assert stage_duration.get_count("test_stage") == before + 1
+
+
+def test_record_llm_error_outcome():
+    before = requests_total.get(OUTCOME_LLM_ERROR)
+    durations = request_duration.get_count(OUTCOME_LLM_ERROR)
+
+    record_request(OUTCOME_LLM_ERROR, 1.5)
+
+    assert requests_total.get(OUTCOME_LLM_ERROR) == before + 1
+    assert request_duration.get_count(OUTCOME_LLM_ERROR) == durations + 1
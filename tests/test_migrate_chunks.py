@@ -0,0 +1,109 @@
+# Міграція старої історії: контексти переносяться в чанки, колонка retrieved_context видаляється
+
+import hashlib
+import sqlite3
+
+import pytest
+
+import migrate_chunks
+
+CONTEXT_A = "Zizan was born in Kuala Lumpur.\n\nZizan hosts a comedy show."
+CONTEXT_B = "Zizan hosts a comedy show.\n\nZizan likes nasi lemak."
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """БД попередньої версії бота: контекст у колонці retrieved_context, таблиця посилань з rowid."""
+    path = str(tmp_path / "history.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE conversation_log (
+            log_id INTEGER PRIMARY KEY, user_id INTEGER, user_first_name VARCHAR, user_username VARCHAR,
+            timestamp_user DATETIME, user_query TEXT, timestamp_bot DATETIME, bot_response TEXT,
+            language VARCHAR(5), retrieved_context TEXT, feedback VARCHAR(10)
+        );
+        CREATE TABLE conversation_log_chunks (
+            log_id INTEGER NOT NULL, rank INTEGER NOT NULL, chunk_id INTEGER NOT NULL, score FLOAT,
+            PRIMARY KEY (log_id, rank)
+        );
+        CREATE INDEX ix_conversation_log_chunks_chunk_id ON conversation_log_chunks (chunk_id);
+    """)
+    connection.executemany(
+        "INSERT INTO conversation_log (log_id, user_query, bot_response, language, retrieved_context) VALUES (?, ?, ?, 'en', ?)",
+        [(1, "q1", "a1", CONTEXT_A), (2, "q2", "a2", CONTEXT_B), (3, "q3", "a3", None)],
+    )
+    # Запис, збережений уже з посиланнями на чанки
+    connection.execute("INSERT INTO conversation_log_chunks (log_id, rank, chunk_id, score) VALUES (3, 0, 99, 0.5)")
+    connection.commit()
+    connection.close()
+    return path
+
+
+def _columns(connection, table):
+    return {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+
+
+def _snapshot(path):
+    """Схема та вміст файлу БД."""
+    connection = sqlite3.connect(path)
+    try:
+        schema = connection.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall()
+    finally:
+        connection.close()
+    with open(path, "rb") as file:
+        return schema, hashlib.sha256(file.read()).hexdigest()
+
+
+def _contexts(path):
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute(
+            "SELECT l.log_id, c.chunk_text FROM conversation_log_chunks l"
+            " JOIN knowledge_chunks c ON c.chunk_id = l.chunk_id ORDER BY l.log_id, l.rank"
+        ).fetchall()
+    finally:
+        connection.close()
+    contexts = {}
+    for log_id, chunk_text in rows:
+        contexts.setdefault(log_id, []).append(chunk_text)
+    return {log_id: "\n\n".join(texts) for log_id, texts in contexts.items()}
+
+
+def test_migration_moves_contexts_and_drops_column(legacy_db):
+    stats = migrate_chunks.migrate(legacy_db)
+
+    assert (stats["rows"], stats["links"], stats["chunks"]) == (2, 4, 3)
+    assert _contexts(legacy_db) == {1: CONTEXT_A, 2: CONTEXT_B}
+
+    connection = sqlite3.connect(legacy_db)
+    try:
+        columns = _columns(connection, "conversation_log")
+        links_sql = connection.execute("SELECT sql FROM sqlite_master WHERE name = 'conversation_log_chunks'").fetchone()[0]
+        kept_link = connection.execute("SELECT chunk_id, score FROM conversation_log_chunks WHERE log_id = 3").fetchall()
+        indexes = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    finally:
+        connection.close()
+    if stats["column_dropped"]:
+        assert "retrieved_context" not in columns
+    assert "WITHOUT ROWID" in links_sql.upper()
+    assert kept_link == [(99, 0.5)]
+    # Індекс за chunk_id попередньої схеми видалено
+    assert "ix_conversation_log_chunks_chunk_id" not in indexes
+
+
+def test_second_run_changes_nothing(legacy_db):
+    migrate_chunks.migrate(legacy_db)
+    stats = migrate_chunks.migrate(legacy_db)
+
+    assert (stats["rows"], stats["links"], stats["chunks"]) == (0, 0, 0)
+    assert _contexts(legacy_db) == {1: CONTEXT_A, 2: CONTEXT_B}
+
+
+def test_dry_run_leaves_database_unchanged(legacy_db):
+    """Dry run рахує ту саму міграцію, але не створює таблиць, не додає колонок і не змінює файл."""
+    before = _snapshot(legacy_db)
+
+    stats = migrate_chunks.migrate(legacy_db, dry_run=True)
+
+    assert (stats["rows"], stats["links"], stats["chunks"]) == (2, 4, 3)
+    assert _snapshot(legacy_db) == before
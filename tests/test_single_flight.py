@@ -0,0 +1,98 @@
+# Об'єднання однакових одночасних питань: одне виконання на ключ, спільний результат
+
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight, question_key
+
+
+def test_concurrent_identical_requests_share_one_execution():
+    flights = SingleFlight(enabled=True)
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        requests = [asyncio.create_task(flights.run("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*requests)
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert results == [("answer", False), ("answer", True), ("answer", True)]
+    assert flights.get_stats()["coalesced"] == 2
+    assert flights.get_stats()["in_flight"] == 0
+
+
+def test_leader_cancellation_does_not_cancel_followers():
+    flights = SingleFlight(enabled=True)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.create_task(flights.run("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.run("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == ("answer", True)
+
+
+def test_failure_is_shared_and_key_is_released():
+    flights = SingleFlight(enabled=True)
+
+    async def scenario():
+        async def failing():
+            await asyncio.sleep(0)
+            raise RuntimeError("search failed")
+
+        results = await asyncio.gather(
+            flights.run("key", failing), flights.run("key", failing), return_exceptions=True
+        )
+
+        async def work():
+            return "fresh"
+
+        return results, await flights.run("key", work)
+
+    results, retry = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # Після завершення ключ звільнено: наступний запит виконує роботу заново
+    assert retry == ("fresh", False)
+
+
+def test_disabled_runs_every_request():
+    flights = SingleFlight(enabled=False)
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return len(calls)
+
+    async def scenario():
+        return await asyncio.gather(flights.run("key", work), flights.run("key", work))
+
+    assert asyncio.run(scenario()) == [(1, False), (2, False)]
+
+
+def test_question_key_ignores_case_and_punctuation():
+    assert question_key("Who is Zizan?", "en", "zizan", "v1") == question_key("who is zizan", "en", "zizan", "v1")
+    assert question_key("Who is Zizan?", "en", "zizan", "v1") != question_key("Who is Zizan?", "ms", "zizan", "v1")
+    assert question_key("Who is Zizan?", "en", "zizan", "v1") != question_key("Who is Zizan?", "en", "zizan", "v2")
@@ -0,0 +1,91 @@
+# Webhook-режим: розподіл оновлень між воркерами за користувачем і обмеження оновлень в обробці
+
+import queue
+import asyncio
+
+from webhook_server import _consume_updates, update_chat_id, update_user_id, user_shard
+
+
+def _fill(updates: queue.Queue, items) -> None:
+    for item in items:
+        updates.put(item)
+
+
+def test_worker_leaves_updates_in_queue_when_busy():
+    updates: queue.Queue = queue.Queue()
+    _fill(updates, [("zizan", chat_id, {"update_id": chat_id}) for chat_id in range(10)])
+    _fill(updates, [None])
+
+    async def scenario():
+        release = asyncio.Event()
+        running = []
+
+        async def process(update):
+            running.append(update["update_id"])
+            await release.wait()
+
+        consumer = asyncio.create_task(
+            _consume_updates(updates, lambda persona, update: lambda: process(update), concurrency=3)
+        )
+        await asyncio.sleep(0.2)
+        # Зайняті всі три слоти, решта оновлень чекає в черзі процесу (там їх і відхиляє сервер при переповненні)
+        assert len(running) == 3
+        assert updates.qsize() == 8
+
+        release.set()
+        await asyncio.wait_for(consumer, 5)
+        return running
+
+    assert sorted(asyncio.run(scenario())) == list(range(10))
+
+
+def test_skipped_updates_release_slots():
+    updates: queue.Queue = queue.Queue()
+    _fill(updates, [("unknown", 1, {"update_id": 1}), ("unknown", 2, {"update_id": 2}), ("zizan", 3, {"update_id": 3}), None])
+    handled = []
+
+    async def process(update):
+        handled.append(update["update_id"])
+
+    def handle(persona, update):
+        if persona != "zizan":
+            return None
+        return lambda: process(update)
+
+    asyncio.run(asyncio.wait_for(_consume_updates(updates, handle, concurrency=1), 5))
+    assert handled == [3]
+
+
+def test_updates_of_one_chat_keep_order():
+    updates: queue.Queue = queue.Queue()
+    _fill(updates, [("zizan", 42, {"update_id": i}) for i in range(5)] + [None])
+    handled = []
+
+    async def process(update):
+        # Перше оновлення обробляється найдовше - порядок все одно зберігається
+        await asyncio.sleep(0.05 if update["update_id"] == 0 else 0)
+        handled.append(update["update_id"])
+
+    asyncio.run(asyncio.wait_for(
+        _consume_updates(updates, lambda persona, update: lambda: process(update), concurrency=5), 5
+    ))
+    assert handled == [0, 1, 2, 3, 4]
+
+
+def _message(update_id, user_id, chat_id):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "from": {"id": user_id}, "text": "hi"}}
+
+
+def test_all_updates_of_a_user_go_to_one_worker():
+    private = _message(1, 1001, 1001)
+    group = _message(2, 1001, -100500)
+    button = {"update_id": 3, "callback_query": {"from": {"id": 1001}, "message": {"chat": {"id": -100500}}, "data": "like"}}
+
+    assert {user_shard(update_user_id(update), 4) for update in (private, group, button)} == {user_shard(1001, 4)}
+    # Усередині воркера оновлення впорядковуються за чатом
+    assert update_chat_id(group) == update_chat_id(button) == -100500
+
+
+def test_updates_without_sender_are_sharded_by_chat():
+    post = {"update_id": 4, "channel_post": {"chat": {"id": -1007}, "text": "news"}}
+    assert update_user_id(post) == -1007
@@ -1,78 +1,312 @@
 import json
 import os
-from typing import Dict, Optional
+import time
+import asyncio
+import logging
+import string
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Як часто (в секундах) перевіряти зміни файлів у locales/; 0 вимикає автоматичне перезавантаження
+LOCALES_RELOAD_INTERVAL = float(os.getenv("LOCALES_RELOAD_INTERVAL", "30"))
+# Службовий ключ файлу перекладу: мова (або список мов), з якої беруться відсутні ключі
+FALLBACK_KEY = "_fallback"
+
+
+class _Template:
+    """Рядок з параметрами ({user_name}), розібраний один раз під час компіляції каталогу."""
+
+    __slots__ = ("text", "fields")
+
+    def __init__(self, text: str, fields: Tuple[str, ...]):
+        self.text = text
+        self.fields = fields
+
+    def render(self, kwargs: Dict[str, Any]) -> str:
+        try:
+            return self.text.format(**kwargs)
+        except (KeyError, IndexError):
+            # Якщо форматування не вдалося, повертаємо неформатований текст
+            return self.text
+
+
+def _compile_text(language: str, key: str, text: str) -> Union[str, _Template]:
+    """Статичний рядок повертається як є (з уже розекранованими {{ }}), рядок з параметрами - як шаблон."""
+    try:
+        fields = tuple(field for _, field, _, _ in string.Formatter().parse(text) if field is not None)
+    except ValueError as e:
+        logger.warning(f"Переклад {language}.{key} має некоректні фігурні дужки, використовується як є: {e}")
+        return text
+    if not fields:
+        return text.format()
+    return _Template(text, fields)
+
+
+# Будівник клавіатури: отримує скомпільований каталог мови і повертає готову клавіатуру
+KeyboardBuilder = Callable[["LocaleCatalog"], Any]
+
+
+class LocaleCatalog:
+    """
+    Незмінний скомпільований каталог однієї мови. Відсутні ключі вже підставлені з мов
+    ланцюжка fallback_chain, тож отримання тексту - один пошук у словнику.
+    """
+
+    __slots__ = ("language", "fallback_chain", "_entries", "keyboards")
+
+    def __init__(self, language: str, fallback_chain: Tuple[str, ...], entries: Dict[str, Union[str, _Template]]):
+        self.language = language
+        self.fallback_chain = fallback_chain
+        self._entries: Mapping[str, Union[str, _Template]] = MappingProxyType(entries)
+        self.keyboards: Mapping[str, Any] = MappingProxyType({})
+
+    def get_text(self, key: str, **kwargs) -> str:
+        entry = self._entries.get(key)
+        if entry is None:
+            return key
+        if entry.__class__ is str:
+            return entry
+        return entry.render(kwargs)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class _CatalogState:
+    """Усі каталоги одного завантаження; замінюється цілком, тому обробники не бачать напівоновленого стану."""
+
+    __slots__ = ("catalogs", "default", "sources", "signature")
+
+    def __init__(self, catalogs: Dict[str, LocaleCatalog], default: LocaleCatalog,
+                 sources: Dict[str, dict], signature: Tuple):
+        self.catalogs = catalogs
+        self.default = default
+        self.sources = sources
+        self.signature = signature
+
 
 class TranslationManager:
     """Клас для управління перекладами з JSON файлів"""
-    
+
     def __init__(self, locales_dir: str = "locales"):
         """Ініціалізація менеджера перекладів
-        
+
         Args:
             locales_dir: Шлях до директорії з файлами перекладів
         """
         self.locales_dir = locales_dir
-        self.translations: Dict[str, Dict[str, str]] = {}
         self.default_language = "en"
+        self._keyboard_builders: Dict[str, KeyboardBuilder] = {}
+        self._state = _CatalogState({}, LocaleCatalog(self.default_language, (), {}), {}, ())
+
+        self.reloads = 0
+        self.reload_errors = 0
+        self.loaded_at = 0.0
         self._load_translations()
-    
+
+    @property
+    def translations(self) -> Dict[str, dict]:
+        """Вихідні (нескомпільовані) переклади, як їх прочитано з файлів."""
+        return self._state.sources
+
+    def _locales_signature(self) -> Tuple:
+        """Імена, час зміни та розмір файлів перекладів - для виявлення змін без читання файлів."""
+        signature = []
+        try:
+            with os.scandir(self.locales_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            pass
+        return tuple(sorted(signature))
+
+    def _read_sources(self, previous: Dict[str, dict]) -> Tuple[Dict[str, dict], int]:
+        """Читає файли перекладів; для файлу з помилкою залишається попередня версія мови."""
+        sources: Dict[str, dict] = {}
+        errors = 0
+        for filename in sorted(os.listdir(self.locales_dir)):
+            if not filename.endswith(".json"):
+                continue
+            language_code = filename.split(".")[0]
+            file_path = os.path.join(self.locales_dir, filename)
+            try:
+                with open(file_path, "r", encoding="utf-8") as file:
+                    data = json.load(file)
+                if not isinstance(data, dict):
+                    raise ValueError("очікується JSON-об'єкт")
+                sources[language_code] = data
+            except Exception as e:
+                errors += 1
+                logger.error(f"Помилка завантаження перекладу {language_code}: {e}")
+                if language_code in previous:
+                    sources[language_code] = previous[language_code]
+        return sources, errors
+
+    def _fallback_chain(self, language: str, sources: Dict[str, dict]) -> Tuple[str, ...]:
+        """Мова, її запасні мови з ключа _fallback (рекурсивно) і наостанок мова за замовчуванням."""
+        chain: List[str] = []
+        pending = [language]
+        while pending:
+            current = pending.pop(0)
+            if current in chain or current not in sources:
+                continue
+            chain.append(current)
+            declared = sources[current].get(FALLBACK_KEY) or []
+            pending.extend([declared] if isinstance(declared, str) else declared)
+        if self.default_language in sources and self.default_language not in chain:
+            chain.append(self.default_language)
+        return tuple(chain)
+
+    def _compile(self, sources: Dict[str, dict], signature: Tuple) -> _CatalogState:
+        catalogs: Dict[str, LocaleCatalog] = {}
+        for language in sources:
+            chain = self._fallback_chain(language, sources)
+            entries: Dict[str, Union[str, _Template]] = {}
+            # Від найменш до найбільш пріоритетної мови: власні переклади перекривають запасні
+            for source_language in reversed(chain):
+                for key, text in sources[source_language].items():
+                    if key.startswith("_"):
+                        continue
+                    if not isinstance(text, str):
+                        logger.warning(f"Переклад {source_language}.{key} не є рядком, пропускаємо.")
+                        continue
+                    entries[key] = _compile_text(source_language, key, text)
+            catalogs[language] = LocaleCatalog(language, chain, entries)
+
+        default = catalogs.get(self.default_language) or LocaleCatalog(self.default_language, (), {})
+        for catalog in list(catalogs.values()) + ([] if self.default_language in catalogs else [default]):
+            catalog.keyboards = MappingProxyType({
+                name: builder(catalog) for name, builder in self._keyboard_builders.items()
+            })
+        return _CatalogState(catalogs, default, sources, signature)
+
     def _load_translations(self) -> None:
         """Завантаження всіх доступних перекладів з директорії locales"""
         if not os.path.exists(self.locales_dir):
             os.makedirs(self.locales_dir)
-            
-        for filename in os.listdir(self.locales_dir):
-            if filename.endswith(".json"):
-                language_code = filename.split(".")[0]
-                file_path = os.path.join(self.locales_dir, filename)
-                
-                try:
-                    with open(file_path, "r", encoding="utf-8") as file:
-                        self.translations[language_code] = json.load(file)
-                except Exception as e:
-                    print(f"Помилка завантаження перекладу {language_code}: {e}")
-    
+        self.reload(force=True)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Перечитує та компілює переклади, якщо файли в locales/ змінились, і атомарно
+        замінює каталоги разом з клавіатурами.
+
+        Args:
+            force: Перекомпілювати навіть без змін у файлах
+
+        Returns:
+            True, якщо каталоги замінено
+        """
+        signature = self._locales_signature()
+        previous = self._state
+        if not force and signature == previous.signature:
+            return False
+        try:
+            sources, errors = self._read_sources(previous.sources)
+            state = self._compile(sources, signature)
+        except Exception as e:
+            self.reload_errors += 1
+            logger.error(f"Не вдалося перезавантажити переклади, залишаємо попередні: {e}", exc_info=True)
+            return False
+        self.reload_errors += errors
+        self._state = state
+        self.reloads += 1
+        self.loaded_at = time.time()
+        logger.info(f"Переклади завантажено: {', '.join(state.catalogs) or 'немає мов'}.")
+        return True
+
+    def register_keyboard(self, name: str, builder: KeyboardBuilder) -> None:
+        """
+        Реєструє клавіатуру, яка будується один раз для кожної мови (і заново при перезавантаженні перекладів).
+
+        Args:
+            name: Назва клавіатури для get_keyboard
+            builder: Функція, що отримує LocaleCatalog і повертає клавіатуру
+        """
+        self._keyboard_builders[name] = builder
+        state = self._state
+        self._state = self._compile(state.sources, state.signature)
+
+    def get_catalog(self, language: str) -> LocaleCatalog:
+        """Каталог мови; для непідтримуваної мови - каталог мови за замовчуванням."""
+        state = self._state
+        return state.catalogs.get(language) or state.default
+
+    def get_keyboard(self, name: str, language: str) -> Any:
+        """Готова клавіатура мови (зареєстрована через register_keyboard)."""
+        return self.get_catalog(language).keyboards[name]
+
     def get_text(self, key: str, language: str, **kwargs) -> str:
         """Отримання перекладеного тексту за ключем
-        
+
         Args:
             key: Ключ перекладу
             language: Код мови
             **kwargs: Параметри для форматування тексту
-            
+
         Returns:
-            Перекладений текст або ключ, якщо переклад не знайдено
+            Перекладений текст (з мови, запасних мов або мови за замовчуванням) або ключ, якщо переклад не знайдено
         """
-        # Якщо мова не підтримується, використовуємо мову за замовчуванням
-        if language not in self.translations:
-            language = self.default_language
-            
-        # Отримуємо переклад або повертаємо ключ, якщо переклад не знайдено
-        text = self.translations.get(language, {}).get(key, key)
-        
-        # Форматуємо текст з переданими параметрами
-        try:
-            return text.format(**kwargs)
-        except KeyError:
-            # Якщо форматування не вдалося, повертаємо неформатований текст
-            return text
-    
+        return self.get_catalog(language).get_text(key, **kwargs)
+
+    def has_language(self, language: str) -> bool:
+        return language in self._state.catalogs
+
     def get_available_languages(self) -> list:
         """Отримання списку доступних мов
-        
+
         Returns:
             Список кодів доступних мов
         """
-        return list(self.translations.keys())
-    
+        return list(self._state.catalogs.keys())
+
     def set_default_language(self, language: str) -> None:
         """Встановлення мови за замовчуванням
-        
+
         Args:
             language: Код мови
         """
-        if language in self.translations:
+        if language in self._state.catalogs:
             self.default_language = language
+            state = self._state
+            self._state = self._compile(state.sources, state.signature)
+
+    def get_stats(self) -> Dict[str, object]:
+        state = self._state
+        return {
+            "languages": list(state.catalogs),
+            "keys": {language: len(catalog) for language, catalog in state.catalogs.items()},
+            "keyboards": list(self._keyboard_builders),
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "loaded_at": self.loaded_at,
+        }
+
+
+async def watch_locales(manager: Optional[TranslationManager] = None, interval: float = LOCALES_RELOAD_INTERVAL) -> None:
+    """Періодично перевіряє файли в locales/ і підхоплює зміни перекладів без перезапуску бота."""
+    manager = manager or translation_manager
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            manager.reload()
+        except Exception as e:
+            logger.error(f"Помилка автоматичного перезавантаження перекладів: {e}", exc_info=True)
+
+
+def get_translation_stats() -> Dict[str, object]:
+    """Метрики каталогів перекладів."""
+    return translation_manager.get_stats()
+
 
 # Створення глобального екземпляру менеджера перекладів
-translation_manager = TranslationManager()
\ No newline at end of file
+translation_manager = TranslationManager()
@@ -0,0 +1,179 @@
+# user_settings.py
+# Налаштування користувачів (мова інтерфейсу): зберігаються в history.db, а обробники читають
+# їх з обмеженого LRU-кешу в пам'яті без звернень до БД
+
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from database import save_user_languages, get_user_language_setting, get_recent_user_languages
+
+logger = logging.getLogger(__name__)
+
+# Мова користувачів, які ще не обирали мову
+DEFAULT_LANGUAGE = "en"
+# Максимальна кількість користувачів у кеші мов
+USER_SETTINGS_CACHE_SIZE = int(os.getenv("USER_SETTINGS_CACHE_SIZE", "50000"))
+# Скільки найнедавніше активних користувачів завантажувати в кеш під час запуску
+USER_SETTINGS_PRELOAD = int(os.getenv("USER_SETTINGS_PRELOAD", "10000"))
+# Як часто (в секундах) повторювати запис змін, що не вдалося зберегти
+USER_SETTINGS_RETRY_INTERVAL = 5.0
+
+
+class UserSettingsStore:
+    """
+    Write-through кеш мов користувачів. Читання (get_language) - O(1) зі словника в пам'яті;
+    користувач, якого немає в кеші, завантажується з БД middleware до виклику обробника.
+    Зміни одразу потрапляють у кеш, а в БД записуються фоновою задачею.
+    """
+
+    def __init__(self, max_size: int = USER_SETTINGS_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        # user_id -> мова; None - користувач мову не обирав (щоб не перепитувати БД)
+        self._languages: "OrderedDict[int, Optional[str]]" = OrderedDict()
+        # Зміни, що ще не записані в БД (не витісняються з пам'яті до запису)
+        self._dirty: Dict[int, str] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+        self.write_errors = 0
+
+    def _remember(self, user_id: int, language: Optional[str]) -> None:
+        self._languages[user_id] = language
+        self._languages.move_to_end(user_id)
+        while len(self._languages) > self.max_size:
+            self._languages.popitem(last=False)
+            self.evictions += 1
+
+    def get_language(self, user_id: int) -> str:
+        """Мова користувача з кешу (без звернення до БД)."""
+        language = self._dirty.get(user_id)
+        if language is not None:
+            return language
+        if user_id in self._languages:
+            self._languages.move_to_end(user_id)
+            return self._languages[user_id] or DEFAULT_LANGUAGE
+        return DEFAULT_LANGUAGE
+
+    async def ensure_loaded(self, user_id: int) -> None:
+        """Завантажує мову користувача з БД, якщо його ще немає в кеші."""
+        if user_id in self._languages or user_id in self._dirty:
+            self.hits += 1
+            return
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            # Кілька оновлень від одного користувача одночасно - один запит до БД
+            await asyncio.shield(loading)
+            return
+        self.misses += 1
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = loading
+        try:
+            language = await get_user_language_setting(user_id)
+            if user_id not in self._dirty:
+                self._remember(user_id, language)
+        except Exception as e:
+            # Без БД користувач отримає мову за замовчуванням; кеш не заповнюємо, щоб спробувати знову
+            logger.error(f"Не вдалося завантажити мову користувача {user_id}: {e}")
+        finally:
+            del self._loading[user_id]
+            loading.set_result(None)
+
+    def set_language(self, user_id: int, language: str) -> None:
+        """Змінює мову користувача: одразу в кеші, у БД - фоновим записом."""
+        self._remember(user_id, language)
+        self._dirty[user_id] = language
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while self._dirty:
+            if not await self.flush():
+                await asyncio.sleep(USER_SETTINGS_RETRY_INTERVAL)
+
+    async def flush(self) -> bool:
+        """
+        Записує в БД усі незбережені зміни.
+
+        Returns:
+            False, якщо запис не вдався
+        """
+        batch = dict(self._dirty)
+        if not batch:
+            return True
+        try:
+            await save_user_languages(batch)
+        except Exception as e:
+            self.write_errors += 1
+            logger.error(f"Не вдалося зберегти мови {len(batch)} користувачів, повторимо пізніше: {e}", exc_info=True)
+            return False
+        for user_id, language in batch.items():
+            # Користувач міг змінити мову ще раз під час запису - таку зміну залишаємо в черзі
+            if self._dirty.get(user_id) == language:
+                del self._dirty[user_id]
+        self.writes += len(batch)
+        return True
+
+    async def preload(self, limit: int = USER_SETTINGS_PRELOAD) -> int:
+        """Заповнює кеш мовами найнедавніше активних користувачів."""
+        if limit <= 0:
+            return 0
+        languages = await get_recent_user_languages(min(limit, self.max_size))
+        # Від найменш до найбільш активних, щоб найактивніші були наприкінці LRU
+        for user_id, language in reversed(list(languages.items())):
+            if user_id not in self._dirty:
+                self._remember(user_id, language)
+        logger.info(f"У кеш мов завантажено {len(languages)} користувачів.")
+        return len(languages)
+
+    async def close(self) -> None:
+        """Дописує незбережені зміни (при завершенні роботи бота)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if not await self.flush() or self._dirty:
+            logger.error(f"Не вдалося зберегти мови {len(self._dirty)} користувачів при завершенні роботи.")
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._languages),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "pending_writes": len(self._dirty),
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+        }
+
+
+user_settings = UserSettingsStore()
+
+
+class UserSettingsMiddleware(BaseMiddleware):
+    """Перед обробником гарантує, що налаштування користувача оновлення є в кеші."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        if user is not None:
+            await user_settings.ensure_loaded(user.id)
+        return await handler(event, data)
+
+
+def get_user_settings_stats() -> Dict[str, int]:
+    """Метрики кешу налаштувань користувачів."""
+    return user_settings.get_stats()
@@ -0,0 +1,290 @@
+# webhook_server.py
+# Webhook-режим: HTTP-сервер приймає оновлення Telegram і розподіляє їх між WEBHOOK_WORKERS
+# процесами-воркерами за користувачем (усі оновлення користувача потрапляють в один воркер,
+# тож його мова, ліміт запитів та інші кеші процесу не розходяться між воркерами; оновлення
+# одного чату всередині воркера обробляються по черзі). Кожен воркер - повноцінний процес бота з власною моделлю
+# векторизації; матриці векторів індексів відкриваються з диска через memory-map і спільні
+# для всіх воркерів у кеші сторінок ОС. Індекс будує лише один воркер (див. index_build_lock).
+#
+# Запуск:
+#   WEBHOOK_BASE_URL=https://bot.example.com python webhook_server.py
+# Локальна перевірка без Telegram - див. fake_telegram.py
+
+import os
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing
+from typing import Dict, List, Optional
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from personas import personas
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Адреса та порт HTTP-сервера
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Шлях webhook; оновлення для персони приходять на <WEBHOOK_PATH>/<назва персони>
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Публічна адреса сервера для setWebhook (порожньо - webhook реєструється вручну)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+# Секрет, який Telegram передає в заголовку X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Кількість процесів-воркерів (кожен завантажує власну модель векторизації)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+# Скільки оновлень може чекати в черзі одного воркера; при переповненні Telegram отримує 503 і повторить пізніше
+WEBHOOK_WORKER_QUEUE_SIZE = int(os.getenv("WEBHOOK_WORKER_QUEUE_SIZE", "1000"))
+# Скільки оновлень воркер обробляє одночасно; решта чекає в черзі процесу, тож при перевантаженні
+# черга заповнюється і Telegram отримує 503
+WEBHOOK_WORKER_CONCURRENCY = int(os.getenv("WEBHOOK_WORKER_CONCURRENCY", "64"))
+# Скільки секунд чекати на завершення воркерів при зупинці
+WORKER_STOP_TIMEOUT = 30.0
+# Найбільша кількість воркерів: номер воркера займає 10 біт log_id (див. database._LogIdGenerator)
+MAX_WEBHOOK_WORKERS = 1024
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(update: dict) -> int:
+    """Чат, до якого належить оновлення (для типів без чату - користувач або update_id)."""
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member", "chat_member"):
+        event = update.get(field)
+        if event and "chat" in event:
+            return event["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        message = callback.get("message")
+        if message and "chat" in message:
+            return message["chat"]["id"]
+        return callback["from"]["id"]
+    for event in update.values():
+        if isinstance(event, dict) and "from" in event:
+            return event["from"]["id"]
+    return update.get("update_id", 0)
+
+
+def update_user_id(update: dict) -> int:
+    """Користувач, від якого надійшло оновлення (для оновлень без відправника - чат)."""
+    for event in update.values():
+        if isinstance(event, dict) and "from" in event:
+            return event["from"]["id"]
+    return update_chat_id(update)
+
+
+def user_shard(user_id: int, workers: int) -> int:
+    """Номер воркера для користувача."""
+    return abs(user_id) % workers
+
+
+class _ChatSequencer:
+    """Оновлення одного чату обробляються по черзі, різних чатів - паралельно."""
+
+    def __init__(self):
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def submit(self, chat_id: int, coro_factory) -> asyncio.Task:
+        previous = self._tails.get(chat_id)
+        task = asyncio.create_task(self._run_after(previous, coro_factory))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda done: self._forget(chat_id, done))
+        return task
+
+    def _forget(self, chat_id: int, task: asyncio.Task) -> None:
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    @staticmethod
+    async def _run_after(previous: Optional[asyncio.Task], coro_factory) -> None:
+        if previous is not None:
+            # Помилка попереднього оновлення не зупиняє наступні
+            await asyncio.wait([previous])
+        await coro_factory()
+
+    async def drain(self) -> None:
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+async def _consume_updates(updates, handle, concurrency: int = WEBHOOK_WORKER_CONCURRENCY) -> None:
+    """
+    Читає оновлення з черги процесу до сигналу зупинки (None) і обробляє їх через _ChatSequencer.
+    Нове оновлення забирається з черги лише після звільнення одного з concurrency слотів: незабрані
+    оновлення залишаються в черзі процесу, і при її переповненні сервер відповідає 503.
+
+    Args:
+        updates: Черга кортежів (persona, chat_id, update)
+        handle: Функція (persona, update), що повертає фабрику корутини обробки або None, якщо оновлення пропускається
+        concurrency: Максимальна кількість оновлень в обробці
+    """
+    loop = asyncio.get_running_loop()
+    sequencer = _ChatSequencer()
+    slots = asyncio.Semaphore(max(1, concurrency))
+    while True:
+        await slots.acquire()
+        # Черга процесів блокуюча, тому читається в потоці
+        item = await loop.run_in_executor(None, updates.get)
+        if item is None:
+            slots.release()
+            break
+        persona, chat_id, update = item
+        coro_factory = handle(persona, update)
+        if coro_factory is None:
+            slots.release()
+            continue
+        task = sequencer.submit(chat_id, coro_factory)
+        task.add_done_callback(lambda _: slots.release())
+    await sequencer.drain()
+
+
+async def _run_worker(worker_index: int, updates: multiprocessing.Queue) -> None:
+    import bot as bot_app
+    from database import set_log_worker_index
+    from metrics import METRICS_PORT
+
+    # Номер воркера входить у log_id: воркери пишуть в одну БД і не мають отримувати однакових ID
+    set_log_worker_index(worker_index)
+    # Архівування журналу та реєстрація webhook - лише в першому воркері; метрики - на власному порту кожного воркера
+    tasks = await bot_app.start_services(
+        retention=worker_index == 0,
+        metrics_port=METRICS_PORT + worker_index if METRICS_PORT > 0 else 0,
+        # Фідбек, отриманий іншими воркерами, оновлює кеш відповідей цього воркера
+        sync_feedback=True,
+    )
+    if worker_index == 0 and WEBHOOK_BASE_URL:
+        for name, persona_bot in bot_app.bots.items():
+            await persona_bot.set_webhook(
+                f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}/{name}",
+                secret_token=WEBHOOK_SECRET or None,
+            )
+        logger.info(f"Webhook зареєстровано для персон: {', '.join(bot_app.bots)}")
+
+    def handle(persona: str, update: dict):
+        persona_bot = bot_app.bots.get(persona)
+        if persona_bot is None:
+            return None
+        return lambda: _feed_update(bot_app.dp, persona_bot, update)
+
+    logger.info(f"Воркер {worker_index} (pid {os.getpid()}) готовий приймати оновлення.")
+    try:
+        await _consume_updates(updates, handle)
+    finally:
+        await bot_app.stop_services(tasks)
+        for persona_bot in bot_app.bots.values():
+            await persona_bot.session.close()
+        logger.info(f"Воркер {worker_index} зупинено.")
+
+
+async def _feed_update(dp, persona_bot, update: dict) -> None:
+    try:
+        await dp.feed_raw_update(persona_bot, update)
+    except Exception as e:
+        logger.error(f"Помилка обробки оновлення {update.get('update_id')}: {e}", exc_info=True)
+
+
+def _worker_main(worker_index: int, updates: multiprocessing.Queue) -> None:
+    """Точка входу процесу-воркера."""
+    # Ctrl+C отримує вся група процесів; воркер зупиняється сигналом із черги, дообробивши оновлення
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(worker_index, updates))
+
+
+class WorkerPool:
+    """Процеси-воркери та їхні черги оновлень."""
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_WORKER_QUEUE_SIZE):
+        # spawn: воркер не успадковує стан event loop і потоків батьківського процесу
+        context = multiprocessing.get_context("spawn")
+        self.workers = max(1, workers)
+        if self.workers > MAX_WEBHOOK_WORKERS:
+            raise ValueError(f"WEBHOOK_WORKERS не може перевищувати {MAX_WEBHOOK_WORKERS}, отримано {workers}")
+        self._queues = [context.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self._processes = [
+            context.Process(target=_worker_main, args=(i, self._queues[i]), name=f"bot-worker-{i}", daemon=False)
+            for i in range(self.workers)
+        ]
+        self.dispatched: List[int] = [0] * self.workers
+        self.rejected = 0
+
+    def start(self) -> None:
+        for process in self._processes:
+            process.start()
+        logger.info(f"Запущено {self.workers} воркерів: {', '.join(str(p.pid) for p in self._processes)}")
+
+    def dispatch(self, persona: str, update: dict) -> bool:
+        """
+        Передає оновлення воркеру його користувача.
+
+        Returns:
+            False, якщо черга воркера переповнена
+        """
+        chat_id = update_chat_id(update)
+        shard = user_shard(update_user_id(update), self.workers)
+        try:
+            self._queues[shard].put_nowait((persona, chat_id, update))
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.dispatched[shard] += 1
+        return True
+
+    def stop(self) -> None:
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не зупинився вчасно, завершуємо примусово.")
+                process.terminate()
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            "workers": self.workers,
+            "alive": sum(process.is_alive() for process in self._processes),
+            "dispatched": list(self.dispatched),
+            "rejected": self.rejected,
+        }
+
+
+def create_app(pool: WorkerPool) -> web.Application:
+    """HTTP-застосунок, що приймає оновлення Telegram для всіх персон."""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        persona = request.match_info["persona"]
+        if persona not in personas:
+            return web.Response(status=404)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not pool.dispatch(persona, update):
+            logger.warning(f"Черга воркера переповнена, оновлення {update.get('update_id')} відхилено.")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def stop_workers(_: web.Application) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, pool.stop)
+
+    app = web.Application()
+    app.router.add_post(f"{WEBHOOK_PATH}/{{persona}}", handle_update)
+    app.on_cleanup.append(stop_workers)
+    return app
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    pool = WorkerPool()
+    pool.start()
+    logger.info(f"Webhook-сервер слухає {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}/<персона>")
+    web.run_app(create_app(pool), host=WEBHOOK_HOST, port=WEBHOOK_PORT, print=None)
+
+
+if __name__ == "__main__":
+    main()